@@ -1,51 +1,124 @@
-class BigInteger:
+from array import array
+from collections import OrderedDict
+import codecs
+import contextvars
+import hashlib
+import math
+import operator
+import re
+import time
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# Magnitudes are stored as little-endian limbs in base 10^9. A limb always
+# fits in an unsigned 32-bit array slot, the product of two limbs fits in
+# 64 bits, and the decimal form is produced nine digits at a time.
+BASE = 1000000000
+BASE_DIGITS = 9
+
+# Operands of at most SMALL_LIMBS limbs (below 10^18, so within a 64-bit
+# word) are combined as machine integers, skipping the limb kernels; a
+# result that outgrows the word just comes back with more limbs
+SMALL_LIMBS = 2
+
+class Frozen:
+    # Base for the slot-based value classes: attributes are set once, through
+    # object.__setattr__, while the object is built, and never rebound after
+    __slots__ = ()
+
+    def __setattr__(self, name, value):
+        raise AttributeError(f'{type(self).__name__} objects are immutable')
+
+    def __delattr__(self, name):
+        raise AttributeError(f'{type(self).__name__} objects are immutable')
+
+class BigInteger(Frozen):
+    # The limbs array is shared between BigIntegers and never modified
+    __slots__ = ('sign', 'limbs')
+
     def __init__(self, value):
         # Initialize the BigInteger from a string value
         if isinstance(value, str):
             value = value.strip()
             if value.startswith('-'):
-                self.sign = -1
-                self.digits = value[1:]
+                sign = -1
+                digits = value[1:]
             else:
-                self.sign = 1
+                sign = 1
                 if value.startswith('+'):
-                    self.digits = value[1:]
+                    digits = value[1:]
                 else:
-                    self.digits = value
+                    digits = value
+            if not digits.isdecimal():
+                raise ValueError('Invalid digits in integer')
+            if len(digits) <= BASE_DIGITS:
+                # A single limb, read directly
+                limb = int(digits)
+                limbs = array('I', [limb] if limb else [])
+            else:
+                limbs = array('I', str_to_limbs(digits))
         elif isinstance(value, BigInteger):
-            self.sign = value.sign
-            self.digits = value.digits
+            sign = value.sign
+            limbs = value.limbs
         else:
             raise ValueError('Value must be a string representing an integer')
-        if not self.digits.isdigit():
-            raise ValueError('Invalid digits in integer')
-        self.digits = self.digits.lstrip('0')  # Remove leading zeros
-        if not self.digits:
-            # Number is zero
-            self.digits = '0'
-            self.sign = 1  # Zero is unsigned
+        object.__setattr__(self, 'limbs', limbs)
+        object.__setattr__(self, 'sign', sign if limbs else 1)  # Zero is unsigned
+
+    @classmethod
+    def _from_limbs(cls, sign, limbs):
+        # Build a BigInteger directly from normalized limbs, skipping parsing
+        result = cls.__new__(cls)
+        if not isinstance(limbs, array):
+            limbs = array('I', limbs)
+        object.__setattr__(result, 'limbs', limbs)
+        object.__setattr__(result, 'sign', sign if limbs else 1)
+        return result
+
+    def __reduce__(self):
+        return BigInteger._from_limbs, (self.sign, self.limbs)
+
+    @classmethod
+    def _from_int(cls, value):
+        # Build a BigInteger from a machine integer, skipping parsing
+        if value < 0:
+            return cls._from_limbs(-1, int_to_limbs(-value))
+        return cls._from_limbs(1, int_to_limbs(value))
+
+    @property
+    def digits(self):
+        # Decimal digits of the magnitude
+        return limbs_to_str(self.limbs)
 
     def __str__(self):
-        s = ''.join(self.digits)
+        s = limbs_to_str(self.limbs)
         if self.sign == -1 and s != '0':
             return '-' + s
         else:
             return s
-    
+
     def __repr__(self):
         return f"BigInteger('{str(self)}')"
 
     def __eq__(self, other):
-        return self.sign == other.sign and self.digits == other.digits
+        if not isinstance(other, BigInteger):
+            return NotImplemented
+        return self.sign == other.sign and self.limbs == other.limbs
 
     def __ne__(self, other):
         return not self == other
 
+    def __hash__(self):
+        return hash((self.sign, self.limbs.tobytes()))
+
     def __lt__(self, other):
         if self.sign != other.sign:
             return self.sign < other.sign
         else:
-            cmp = compare_strings(self.digits, other.digits)
+            cmp = compare_limbs(self.limbs, other.limbs)
             if self.sign == 1:
                 return cmp < 0
             else:
@@ -61,96 +134,76 @@ class BigInteger:
         return not (self < other)
 
     def __add__(self, other):
+        if len(self.limbs) <= SMALL_LIMBS and len(other.limbs) <= SMALL_LIMBS:
+            return BigInteger._from_int(int(self) + int(other))
         if self.sign == other.sign:
             # Same sign, add magnitudes
-            sum_digits = add_strings(self.digits, other.digits)
-            result = BigInteger('0')
-            result.sign = self.sign
-            result.digits = sum_digits
-            return result
+            return BigInteger._from_limbs(self.sign, add_limbs(self.limbs, other.limbs))
         else:
             # Different signs, subtract magnitudes
-            cmp = compare_strings(self.digits, other.digits)
+            cmp = compare_limbs(self.limbs, other.limbs)
             if cmp == 0:
                 # Magnitudes are equal, result is zero
-                return BigInteger('0')
+                return ZERO
             elif cmp > 0:
                 # self magnitude > other magnitude
-                diff_digits = subtract_strings(self.digits, other.digits)
-                result = BigInteger('0')
-                result.sign = self.sign
-                result.digits = diff_digits
-                return result
+                return BigInteger._from_limbs(self.sign, subtract_limbs(self.limbs, other.limbs))
             else:
                 # self magnitude < other magnitude
-                diff_digits = subtract_strings(other.digits, self.digits)
-                result = BigInteger('0')
-                result.sign = other.sign
-                result.digits = diff_digits
-                return result
+                return BigInteger._from_limbs(other.sign, subtract_limbs(other.limbs, self.limbs))
 
     def __sub__(self, other):
         # Subtract other from self: self - other
+        if len(self.limbs) <= SMALL_LIMBS and len(other.limbs) <= SMALL_LIMBS:
+            return BigInteger._from_int(int(self) - int(other))
         if self.sign != other.sign:
             # Different signs, add magnitudes
-            sum_digits = add_strings(self.digits, other.digits)
-            result = BigInteger('0')
-            result.sign = self.sign
-            result.digits = sum_digits
-            return result
+            return BigInteger._from_limbs(self.sign, add_limbs(self.limbs, other.limbs))
         else:
             # Same signs, subtract magnitudes
-            cmp = compare_strings(self.digits, other.digits)
+            cmp = compare_limbs(self.limbs, other.limbs)
             if cmp == 0:
                 # Magnitudes are equal, result is zero
-                return BigInteger('0')
+                return ZERO
             elif cmp > 0:
                 # self magnitude > other magnitude
-                diff_digits = subtract_strings(self.digits, other.digits)
-                result = BigInteger('0')
-                result.sign = self.sign
-                result.digits = diff_digits
-                return result
+                return BigInteger._from_limbs(self.sign, subtract_limbs(self.limbs, other.limbs))
             else:
                 # self magnitude < other magnitude
-                diff_digits = subtract_strings(other.digits, self.digits)
-                result = BigInteger('0')
-                result.sign = -self.sign  # Sign is opposite of self
-                result.digits = diff_digits
-                return result
+                # Sign is opposite of self
+                return BigInteger._from_limbs(-self.sign, subtract_limbs(other.limbs, self.limbs))
 
     def __mul__(self, other):
-        prod_digits = multiply_strings(self.digits, other.digits)
-        result = BigInteger('0')
-        result.sign = self.sign * other.sign
-        result.digits = prod_digits
-        return result
+        if len(self.limbs) <= SMALL_LIMBS and len(other.limbs) <= SMALL_LIMBS:
+            return BigInteger._from_int(int(self) * int(other))
+        prod_limbs = multiply_limbs(self.limbs, other.limbs)
+        return BigInteger._from_limbs(self.sign * other.sign, prod_limbs)
 
     def __floordiv__(self, other):
-        if other.digits == '0':
+        if not other.limbs:
             raise ZeroDivisionError('Division by zero')
-        self_sign = self.sign
-        other_sign = other.sign
-        quotient_digits, remainder_digits = divide_strings(self.digits, other.digits)
-        result = BigInteger('0')
-        result.sign = self_sign * other_sign
-        result.digits = quotient_digits
-        return result
+        quotient_limbs, remainder_limbs = divide_limbs(self.limbs, other.limbs)
+        return BigInteger._from_limbs(self.sign * other.sign, quotient_limbs)
 
     def __mod__(self, other):
-        if other.digits == '0':
+        if not other.limbs:
             raise ZeroDivisionError('Modulo by zero')
-        self_sign = self.sign
-        other_sign = other.sign
-        quotient_digits, remainder_digits = divide_strings(self.digits, other.digits)
-        result = BigInteger('0')
-        result.sign = self_sign  # Remainder takes the sign of dividend
-        result.digits = remainder_digits
-        return result
+        quotient_limbs, remainder_limbs = divide_limbs(self.limbs, other.limbs)
+        # Remainder takes the sign of dividend
+        return BigInteger._from_limbs(self.sign, remainder_limbs)
+
+    def __divmod__(self, other):
+        # Quotient and remainder from a single division, signed as // and %
+        if not other.limbs:
+            raise ZeroDivisionError('Division by zero')
+        quotient_limbs, remainder_limbs = divide_limbs(self.limbs, other.limbs)
+        quotient = BigInteger._from_limbs(self.sign * other.sign, quotient_limbs)
+        remainder = BigInteger._from_limbs(self.sign, remainder_limbs)
+        return quotient, remainder
 
     def __truediv__(self, other):
         # Returns a BigRational
-        if other.digits == '0':
+        if not other.limbs:
             raise ZeroDivisionError('Division by zero')
         numerator = self
         denominator = other
@@ -165,318 +218,1808 @@ class BigInteger:
         result = pow_bigint(self, exponent)
         return result
 
+    def isqrt(self):
+        # Floor of the square root
+        if self.sign == -1:
+            raise ValueError('Square root of a negative integer')
+        return BigInteger._from_limbs(1, isqrt_limbs(self.limbs))
+
+    def __int__(self):
+        return self.sign * limbs_to_int(self.limbs)
+
     def __abs__(self):
-        result = BigInteger(str(self))
-        result.sign = 1
-        return result
+        return BigInteger._from_limbs(1, self.limbs)
 
     def __neg__(self):
-        result = BigInteger(str(self))
-        if self.digits != '0':
-            result.sign = -self.sign
-        return result
-
-def compare_strings(num1, num2):
+        return BigInteger._from_limbs(-self.sign, self.limbs)
+
+# Preallocated constants. A BigInteger is never modified after it is built,
+# so these are shared rather than parsed from strings again
+ZERO = BigInteger._from_limbs(1, [])
+ONE = BigInteger._from_limbs(1, [1])
+TWO = BigInteger._from_limbs(1, [2])
+
+# Deadlines. The long-running kernels call check_deadline at bounded
+# intervals: every multiplication or squaring past schoolbook size, every NTT
+# stage, every so many rows of a long schoolbook product or division, every
+# step of a power, GCD or prime sieve loop. Inside "with Deadline(seconds):"
+# it raises TimeoutError once the time is up or cancel() has been called,
+# from any thread; outside one it is a single context variable lookup.
+ACTIVE_DEADLINE = contextvars.ContextVar('deadline', default=None)
+
+class Deadline:
+    def __init__(self, seconds=None):
+        # seconds=None never expires, but can still be cancelled
+        self.seconds = seconds
+        self.expires = None if seconds is None else time.monotonic() + seconds
+        self.cancelled = False
+        self.outer = None
+        self.token = None
+
+    def __enter__(self):
+        # A nested deadline also honours the one around it
+        self.outer = ACTIVE_DEADLINE.get()
+        self.token = ACTIVE_DEADLINE.set(self)
+        return self
+
+    def __exit__(self, *exc_info):
+        ACTIVE_DEADLINE.reset(self.token)
+
+    def cancel(self):
+        self.cancelled = True
+
+    def check(self):
+        if self.cancelled:
+            raise TimeoutError('Calculation cancelled')
+        if self.expires is not None and time.monotonic() >= self.expires:
+            raise TimeoutError(f'Calculation timed out after {self.seconds:g} s')
+        if self.outer is not None:
+            self.outer.check()
+
+def check_deadline():
+    deadline = ACTIVE_DEADLINE.get()
+    if deadline is not None:
+        deadline.check()
+
+# Schoolbook rows and division steps between deadline checks, and the limb
+# count past which a schoolbook row is long enough to check on its own
+DEADLINE_STRIDE = 64
+DEADLINE_LIMBS = 4096
+
+# Limb kernels. Limb sequences are little-endian lists (or arrays) of base-10^9
+# limbs without trailing zero limbs; zero is the empty sequence. The kernels
+# never modify their inputs and return new lists.
+
+def str_to_limbs(num):
+    # num is a string of decimal digits
+    # Returns little-endian limbs, nine digits per limb
+    limbs = [int(num[max(0, end - BASE_DIGITS):end]) for end in range(len(num), 0, -BASE_DIGITS)]
+    return strip_limbs(limbs)
+
+def limbs_to_str(limbs):
+    # Returns the decimal digits of limbs, without leading zeros
+    if not limbs:
+        return '0'
+    head = str(limbs[-1])
+    if len(limbs) == 1:
+        return head
+    return head + ''.join(['%09d' % limb for limb in reversed(limbs[:-1])])
+
+def strip_limbs(limbs):
+    # Remove high zero limbs in place
+    while limbs and limbs[-1] == 0:
+        limbs.pop()
+    return limbs
+
+def compare_limbs(num1, num2):
     # Compare magnitudes of num1 and num2
-    if len(num1) > len(num2):
-        return 1
-    elif len(num1) < len(num2):
-        return -1
+    if len(num1) != len(num2):
+        return 1 if len(num1) > len(num2) else -1
+    for i in range(len(num1) - 1, -1, -1):
+        if num1[i] != num2[i]:
+            return 1 if num1[i] > num2[i] else -1
+    return 0
+
+def add_limbs(num1, num2):
+    if len(num1) < len(num2):
+        num1, num2 = num2, num1
+    result = []
+    carry = 0
+    for i in range(len(num2)):
+        total = num1[i] + num2[i] + carry
+        if total >= BASE:
+            result.append(total - BASE)
+            carry = 1
+        else:
+            result.append(total)
+            carry = 0
+    for i in range(len(num2), len(num1)):
+        if not carry:
+            result.extend(num1[i:])
+            break
+        total = num1[i] + 1
+        if total == BASE:
+            result.append(0)
+        else:
+            result.append(total)
+            carry = 0
+    if carry:
+        result.append(1)
+    return result
+
+def subtract_limbs(num1, num2):
+    # num1 >= num2
+    result = []
+    borrow = 0
+    for i in range(len(num2)):
+        diff = num1[i] - num2[i] - borrow
+        if diff < 0:
+            result.append(diff + BASE)
+            borrow = 1
+        else:
+            result.append(diff)
+            borrow = 0
+    for i in range(len(num2), len(num1)):
+        if not borrow:
+            result.extend(num1[i:])
+            break
+        diff = num1[i] - 1
+        if diff < 0:
+            result.append(BASE - 1)
+        else:
+            result.append(diff)
+            borrow = 0
+    return strip_limbs(result)
+
+def multiply_limbs_small(num, factor):
+    # Multiply limbs by a single limb 0 <= factor < BASE
+    if not num or not factor:
+        return []
+    result = []
+    carry = 0
+    for limb in num:
+        total = limb * factor + carry
+        carry = total // BASE
+        result.append(total - carry * BASE)
+    if carry:
+        result.append(carry)
+    return result
+
+def divide_limbs_small(num, divisor):
+    # Divide limbs by a single limb 0 < divisor < BASE
+    # Returns (quotient limbs, remainder as an int)
+    quotient = [0] * len(num)
+    remainder = 0
+    for i in range(len(num) - 1, -1, -1):
+        current = remainder * BASE + num[i]
+        digit = current // divisor
+        quotient[i] = digit
+        remainder = current - digit * divisor
+    return strip_limbs(quotient), remainder
+
+# Operand sizes (in limbs) at which multiply_limbs switches algorithm; the
+# shorter operand decides, and lopsided products are cut into balanced slices.
+# NumPy's vectorized butterflies bring the NTT crossover down considerably
+KARATSUBA_THRESHOLD = 32
+TOOM3_THRESHOLD = 120
+NTT_THRESHOLD = 800 if numpy is None else 200
+
+def multiply_limbs(num1, num2):
+    # Dispatch to schoolbook, Karatsuba or Toom-3 by operand size
+    if not num1 or not num2:
+        return []
+    if num1 is num2:
+        return square_limbs(num1)
+    if len(num1) < len(num2):
+        num1, num2 = num2, num1
+    if len(num2) < KARATSUBA_THRESHOLD:
+        return schoolbook_multiply_limbs(num1, num2)
+    check_deadline()
+    if 2 * len(num2) <= len(num1):
+        return unbalanced_multiply_limbs(num1, num2)
+    if len(num2) < TOOM3_THRESHOLD:
+        return karatsuba_multiply_limbs(num1, num2)
+    if len(num2) < NTT_THRESHOLD or len(num1) + len(num2) > NTT_MAX_LENGTH:
+        return toom3_multiply_limbs(num1, num2)
+    return ntt_multiply_limbs(num1, num2)
+
+def schoolbook_multiply_limbs(num1, num2):
+    # Schoolbook multiplication, one row per limb of the shorter operand
+    if not num1 or not num2:
+        return []
+    if len(num1) < len(num2):
+        num1, num2 = num2, num1
+    size = len(num1)
+    result = [0] * (size + len(num2))
+    for j, factor in enumerate(num2):
+        if not factor:
+            continue
+        if size >= DEADLINE_LIMBS:
+            check_deadline()
+        carry = 0
+        k = j
+        for limb in num1:
+            total = result[k] + limb * factor + carry
+            carry = total // BASE
+            result[k] = total - carry * BASE
+            k += 1
+        result[j + size] = carry
+    return strip_limbs(result)
+
+def square_limbs(num):
+    # Squaring through the same tiers as multiply_limbs; each tier passes
+    # the same object for both operands, which it squares with fewer steps
+    if not num:
+        return []
+    if len(num) < KARATSUBA_THRESHOLD:
+        return schoolbook_square_limbs(num)
+    check_deadline()
+    if len(num) < TOOM3_THRESHOLD:
+        return karatsuba_multiply_limbs(num, num)
+    if len(num) < NTT_THRESHOLD or 2 * len(num) > NTT_MAX_LENGTH:
+        return toom3_multiply_limbs(num, num)
+    return ntt_multiply_limbs(num, num)
+
+def schoolbook_square_limbs(num):
+    # Each cross product num[i] * num[j] with i < j is formed once, then the
+    # sum is doubled and the squares on the diagonal added
+    size = len(num)
+    result = [0] * (2 * size)
+    for i in range(size - 1):
+        factor = num[i]
+        if not factor:
+            continue
+        carry = 0
+        k = 2 * i + 1
+        for j in range(i + 1, size):
+            total = result[k] + num[j] * factor + carry
+            carry = total // BASE
+            result[k] = total - carry * BASE
+            k += 1
+        result[i + size] = carry
+    carry = 0
+    for i in range(size):
+        square = num[i] * num[i]
+        high = square // BASE
+        total = 2 * result[2 * i] + (square - high * BASE) + carry
+        carry = total // BASE
+        result[2 * i] = total - carry * BASE
+        total = 2 * result[2 * i + 1] + high + carry
+        carry = total // BASE
+        result[2 * i + 1] = total - carry * BASE
+    return strip_limbs(result)
+
+def unbalanced_multiply_limbs(num1, num2):
+    # len(num1) >= 2 * len(num2): multiply num2 by slices of num1 of the
+    # same length so every sub-product is balanced
+    size = len(num2)
+    result = [0] * (len(num1) + size)
+    for offset in range(0, len(num1), size):
+        piece = strip_limbs(list(num1[offset:offset + size]))
+        add_limbs_into(result, multiply_limbs(piece, num2), offset)
+    return strip_limbs(result)
+
+def karatsuba_multiply_limbs(num1, num2):
+    # Three half-size products: x0*y0, x1*y1 and (x0+x1)*(y0+y1)
+    half = (max(len(num1), len(num2)) + 1) // 2
+    x0 = strip_limbs(list(num1[:half]))
+    x1 = list(num1[half:])
+    if num1 is num2:
+        z0 = square_limbs(x0)
+        z2 = square_limbs(x1)
+        z1 = square_limbs(add_limbs(x0, x1))
+    else:
+        y0 = strip_limbs(list(num2[:half]))
+        y1 = list(num2[half:])
+        z0 = multiply_limbs(x0, y0)
+        z2 = multiply_limbs(x1, y1)
+        z1 = multiply_limbs(add_limbs(x0, x1), add_limbs(y0, y1))
+    z1 = subtract_limbs(subtract_limbs(z1, z0), z2)
+    result = [0] * (len(num1) + len(num2) + 1)
+    add_limbs_into(result, z0, 0)
+    add_limbs_into(result, z1, half)
+    add_limbs_into(result, z2, 2 * half)
+    return strip_limbs(result)
+
+def toom3_multiply_limbs(num1, num2):
+    # Toom-Cook 3-way: evaluate both operands at 0, 1, -1, -2 and infinity,
+    # multiply pointwise, and interpolate (Bodrato's sequence). Intermediate
+    # values can be negative, so they are carried as (sign, limbs) pairs
+    third = (max(len(num1), len(num2)) + 2) // 3
+    x = [strip_limbs(list(num1[i * third:(i + 1) * third])) for i in range(3)]
+
+    def evaluate(parts):
+        p0, p1, p2 = parts
+        even = add_limbs(p0, p2)
+        at_one = (1, add_limbs(even, p1))
+        at_minus_one = signed_subtract_limbs((1, even), (1, p1))
+        # p(-2) = 2 * (p(-1) + p2) - p0
+        doubled = signed_add_limbs(at_minus_one, (1, p2))
+        doubled = (doubled[0], multiply_limbs_small(doubled[1], 2))
+        at_minus_two = signed_subtract_limbs(doubled, (1, p0))
+        return at_one, at_minus_one, at_minus_two
+
+    x_one, x_minus_one, x_minus_two = evaluate(x)
+    if num1 is num2:
+        # Squaring: y is x, and multiply_limbs squares identical operands
+        y = x
+        y_one, y_minus_one, y_minus_two = x_one, x_minus_one, x_minus_two
+    else:
+        y = [strip_limbs(list(num2[i * third:(i + 1) * third])) for i in range(3)]
+        y_one, y_minus_one, y_minus_two = evaluate(y)
+    r0 = multiply_limbs(x[0], y[0])
+    r_inf = multiply_limbs(x[2], y[2])
+    r_one = (1, multiply_limbs(x_one[1], y_one[1]))
+    r_minus_one = (x_minus_one[0] * y_minus_one[0],
+                   multiply_limbs(x_minus_one[1], y_minus_one[1]))
+    r_minus_two = (x_minus_two[0] * y_minus_two[0],
+                   multiply_limbs(x_minus_two[1], y_minus_two[1]))
+
+    # Interpolation; every division below is exact
+    c3 = signed_divide_limbs_small(signed_subtract_limbs(r_minus_two, r_one), 3)
+    c1 = signed_divide_limbs_small(signed_subtract_limbs(r_one, r_minus_one), 2)
+    c2 = signed_subtract_limbs(r_minus_one, (1, r0))
+    c3 = signed_divide_limbs_small(signed_subtract_limbs(c2, c3), 2)
+    c3 = signed_add_limbs(c3, (1, multiply_limbs_small(r_inf, 2)))
+    c2 = signed_subtract_limbs(signed_add_limbs(c2, c1), (1, r_inf))
+    c1 = signed_subtract_limbs(c1, c3)
+
+    result = [0] * (len(num1) + len(num2) + 1)
+    add_limbs_into(result, r0, 0)
+    add_limbs_into(result, c1[1], third)
+    add_limbs_into(result, c2[1], 2 * third)
+    add_limbs_into(result, c3[1], 3 * third)
+    add_limbs_into(result, r_inf, 4 * third)
+    return strip_limbs(result)
+
+# Number-theoretic transform multiplication. Each product is convolved
+# modulo three NTT-friendly primes and the coefficients are rebuilt with
+# the Chinese remainder theorem; the primes' product exceeds
+# NTT_MAX_LENGTH * (BASE - 1)^2, so the reconstruction is exact.
+NTT_PRIMES = ((998244353, 3), (167772161, 3), (469762049, 3))
+NTT_MAX_LENGTH = 1 << 23
+
+def ntt_multiply_limbs(num1, num2):
+    size = len(num1) + len(num2)
+    length = 1
+    while length < size:
+        length *= 2
+    square = num1 is num2
+    residues = []
+    for prime, root in NTT_PRIMES:
+        if numpy is not None:
+            residues.append(ntt_convolve_numpy(num1, num2, length, prime, root, square))
+        else:
+            residues.append(ntt_convolve(num1, num2, length, prime, root, square))
+    return ntt_combine(residues, size)
+
+def ntt_twiddles(length, prime, root, inverse):
+    # Powers w^0 .. w^(length/2 - 1) of a primitive length-th root of unity
+    w = pow(root, (prime - 1) // length, prime)
+    if inverse:
+        w = pow(w, prime - 2, prime)
+    twiddles = [1] * (length // 2)
+    for j in range(1, length // 2):
+        twiddles[j] = twiddles[j - 1] * w % prime
+    return twiddles
+
+def ntt_forward(values, prime, twiddles):
+    # Decimation-in-frequency transform in place; the output is left in
+    # bit-reversed order, which ntt_inverse consumes directly
+    length = len(values)
+    half = length // 2
+    while half:
+        check_deadline()
+        step = 2 * half
+        stage = twiddles[::length // step]
+        if half >= length // step:
+            for start in range(0, length, step):
+                left = values[start:start + half]
+                right = values[start + half:start + step]
+                values[start:start + half] = [(x + y) % prime for x, y in zip(left, right)]
+                values[start + half:start + step] = [(x - y) * t % prime for x, y, t in zip(left, right, stage)]
+        else:
+            for j in range(half):
+                t = stage[j]
+                left = values[j::step]
+                right = values[j + half::step]
+                values[j::step] = [(x + y) % prime for x, y in zip(left, right)]
+                values[j + half::step] = [(x - y) * t % prime for x, y in zip(left, right)]
+        half //= 2
+
+def ntt_inverse(values, prime, twiddles):
+    # Decimation-in-time transform of bit-reversed input back to natural order
+    length = len(values)
+    half = 1
+    while half < length:
+        check_deadline()
+        step = 2 * half
+        stage = twiddles[::length // step]
+        if half >= length // step:
+            for start in range(0, length, step):
+                left = values[start:start + half]
+                right = [y * t % prime for y, t in zip(values[start + half:start + step], stage)]
+                values[start:start + half] = [(x + y) % prime for x, y in zip(left, right)]
+                values[start + half:start + step] = [(x - y) % prime for x, y in zip(left, right)]
+        else:
+            for j in range(half):
+                t = stage[j]
+                left = values[j::step]
+                right = [y * t % prime for y in values[j + half::step]]
+                values[j::step] = [(x + y) % prime for x, y in zip(left, right)]
+                values[j + half::step] = [(x - y) % prime for x, y in zip(left, right)]
+        half *= 2
+
+def ntt_convolve(num1, num2, length, prime, root, square):
+    # Cyclic convolution of num1 and num2 modulo prime, in pure Python
+    forward = ntt_twiddles(length, prime, root, False)
+    fa = [limb % prime for limb in num1] + [0] * (length - len(num1))
+    ntt_forward(fa, prime, forward)
+    if square:
+        fb = fa
+    else:
+        fb = [limb % prime for limb in num2] + [0] * (length - len(num2))
+        ntt_forward(fb, prime, forward)
+    product = [x * y % prime for x, y in zip(fa, fb)]
+    ntt_inverse(product, prime, ntt_twiddles(length, prime, root, True))
+    scale = pow(length, prime - 2, prime)
+    return [x * scale % prime for x in product]
+
+def ntt_convolve_numpy(num1, num2, length, prime, root, square):
+    # Same convolution with each butterfly stage vectorized; operands stay
+    # below 2^30, so every intermediate product fits in an unsigned 64-bit
+    uint64 = numpy.uint64
+    p = uint64(prime)
+
+    def transform(values, twiddles, inverse):
+        half = length // 2 if not inverse else 1
+        while 1 <= half < length:
+            check_deadline()
+            step = 2 * half
+            stage = twiddles[::length // step]
+            blocks = values.reshape(-1, step)
+            left = blocks[:, :half].copy()
+            right = blocks[:, half:]
+            if inverse:
+                right = right * stage % p
+                blocks[:, :half] = (left + right) % p
+                blocks[:, half:] = (left + p - right) % p
+                half *= 2
+            else:
+                blocks[:, :half] = (left + right) % p
+                blocks[:, half:] = (left + p - right) * stage % p
+                half //= 2
+
+    forward = numpy.array(ntt_twiddles(length, prime, root, False), dtype=uint64)
+    fa = numpy.zeros(length, dtype=uint64)
+    fa[:len(num1)] = numpy.array(num1, dtype=uint64) % p
+    transform(fa, forward, False)
+    if square:
+        fb = fa
     else:
-        if num1 == num2:
-            return 0
-        elif num1 > num2:
-            return 1
+        fb = numpy.zeros(length, dtype=uint64)
+        fb[:len(num2)] = numpy.array(num2, dtype=uint64) % p
+        transform(fb, forward, False)
+    product = fa * fb % p
+    inverse = numpy.array(ntt_twiddles(length, prime, root, True), dtype=uint64)
+    transform(product, inverse, True)
+    product = product * uint64(pow(length, prime - 2, prime)) % p
+    return product.tolist()
+
+def ntt_combine(residues, size):
+    # Garner's CRT on each coefficient, then carry into base-10^9 limbs
+    (p1, _), (p2, _), (p3, _) = NTT_PRIMES
+    inv_p1 = pow(p1, p2 - 2, p2)
+    inv_p1p2 = pow(p1 * p2 % p3, p3 - 2, p3)
+    p1p2 = p1 * p2
+    result = [0] * (size + 1)
+    carry = 0
+    for k, (r1, r2, r3) in enumerate(zip(*residues)):
+        if k >= size:
+            break
+        v2 = (r2 - r1) * inv_p1 % p2
+        v3 = (r3 - r1 - p1 * v2) * inv_p1p2 % p3
+        total = r1 + p1 * v2 + p1p2 * v3 + carry
+        carry = total // BASE
+        result[k] = total - carry * BASE
+    result[size] = carry
+    return strip_limbs(result)
+
+def add_limbs_into(target, num, offset):
+    # Add num into the list target in place, starting at limb offset;
+    # target must be long enough to absorb the final carry
+    carry = 0
+    k = offset
+    for limb in num:
+        total = target[k] + limb + carry
+        if total >= BASE:
+            target[k] = total - BASE
+            carry = 1
+        else:
+            target[k] = total
+            carry = 0
+        k += 1
+    while carry:
+        total = target[k] + 1
+        if total == BASE:
+            target[k] = 0
         else:
-            return -1
+            target[k] = total
+            carry = 0
+        k += 1
+
+# Signed limb helpers; a signed value is a (sign, limbs) pair
+
+def signed_add_limbs(num1, num2):
+    sign1, limbs1 = num1
+    sign2, limbs2 = num2
+    if sign1 == sign2:
+        return sign1, add_limbs(limbs1, limbs2)
+    if compare_limbs(limbs1, limbs2) >= 0:
+        return sign1, subtract_limbs(limbs1, limbs2)
+    return sign2, subtract_limbs(limbs2, limbs1)
+
+def signed_subtract_limbs(num1, num2):
+    return signed_add_limbs(num1, (-num2[0], num2[1]))
+
+def signed_divide_limbs_small(num, divisor):
+    # Exact division of a signed value by a single limb
+    return num[0], divide_limbs_small(num[1], divisor)[0]
+
+# Divisor size (in limbs) from which divide_limbs switches from schoolbook
+# division to Burnikel-Ziegler recursive division
+BURNIKEL_ZIEGLER_THRESHOLD = 40
+
+def divide_limbs(num1, num2):
+    # num2 must be non-zero
+    # Returns quotient, remainder
+    if not num2:
+        raise ZeroDivisionError('Division by zero')
+    if compare_limbs(num1, num2) < 0:
+        return [], list(num1)
+    if len(num1) <= SMALL_LIMBS:
+        quotient, remainder = divmod(limbs_to_int(num1), limbs_to_int(num2))
+        return int_to_limbs(quotient), int_to_limbs(remainder)
+    if len(num2) == 1:
+        quotient, remainder = divide_limbs_small(num1, num2[0])
+        return quotient, [remainder] if remainder else []
+    if len(num2) < BURNIKEL_ZIEGLER_THRESHOLD or len(num1) - len(num2) < BURNIKEL_ZIEGLER_THRESHOLD:
+        return schoolbook_divide_limbs(num1, num2)
+    return burnikel_ziegler_divide_limbs(num1, num2)
+
+def schoolbook_divide_limbs(num1, num2):
+    # Knuth's algorithm D; num2 has at least two limbs
+    # Returns quotient, remainder
+    if compare_limbs(num1, num2) < 0:
+        return [], list(num1)
+    # Normalize so the top divisor limb is at least BASE / 2; this keeps
+    # each estimated quotient limb at most two above the true value
+    scale = BASE // (num2[-1] + 1)
+    u = multiply_limbs_small(num1, scale)
+    v = multiply_limbs_small(num2, scale)
+    if len(u) == len(num1):
+        u.append(0)
+    n = len(v)
+    m = len(u) - n
+    v_top = v[-1]
+    v_next = v[-2]
+    quotient = [0] * m
+    for j in range(m - 1, -1, -1):
+        if not j % DEADLINE_STRIDE:
+            check_deadline()
+        # Estimate the quotient limb from the top two remainder limbs
+        q_hat, r_hat = divmod(u[j + n] * BASE + u[j + n - 1], v_top)
+        while q_hat >= BASE or q_hat * v_next > r_hat * BASE + u[j + n - 2]:
+            q_hat -= 1
+            r_hat += v_top
+            if r_hat >= BASE:
+                break
+        # Multiply and subtract q_hat * v from the current window
+        carry = 0
+        borrow = 0
+        for i in range(n):
+            product = q_hat * v[i] + carry
+            carry = product // BASE
+            diff = u[i + j] - (product - carry * BASE) - borrow
+            if diff < 0:
+                u[i + j] = diff + BASE
+                borrow = 1
+            else:
+                u[i + j] = diff
+                borrow = 0
+        diff = u[j + n] - carry - borrow
+        if diff < 0:
+            # The estimate was one too large; add the divisor back
+            q_hat -= 1
+            carry = 0
+            for i in range(n):
+                total = u[i + j] + v[i] + carry
+                if total >= BASE:
+                    u[i + j] = total - BASE
+                    carry = 1
+                else:
+                    u[i + j] = total
+                    carry = 0
+            u[j + n] = (diff + BASE + carry) % BASE
+        else:
+            u[j + n] = diff
+        quotient[j] = q_hat
+    remainder, _ = divide_limbs_small(strip_limbs(u[:n]), scale)
+    return strip_limbs(quotient), remainder
+
+def burnikel_ziegler_divide_limbs(num1, num2):
+    # Normalize the divisor, then feed the dividend to the recursive 2n/n
+    # step one divisor-sized chunk at a time, most significant chunk first
+    scale = BASE // (num2[-1] + 1)
+    dividend = multiply_limbs_small(num1, scale)
+    divisor = multiply_limbs_small(num2, scale)
+    n = len(divisor)
+    quotient = [0] * (len(dividend) + n)
+    remainder = []
+    for start in range(((len(dividend) - 1) // n) * n, -1, -n):
+        chunk = dividend[start:start + n]
+        current = strip_limbs(chunk + [0] * (n - len(chunk)) + remainder)
+        digit, remainder = divide_2n_by_n_limbs(current, divisor, n)
+        quotient[start:start + len(digit)] = digit
+    remainder, _ = divide_limbs_small(remainder, scale)
+    return strip_limbs(quotient), remainder
+
+def divide_2n_by_n_limbs(num, divisor, n):
+    # Divide num < divisor * BASE^n by the normalized n-limb divisor
+    if n < BURNIKEL_ZIEGLER_THRESHOLD:
+        return schoolbook_divide_limbs(num, divisor)
+    pad = n % 2
+    if pad:
+        # Shift both operands up one limb so the divisor splits evenly
+        num = [0] + num if num else []
+        divisor = [0] + divisor
+        n += 1
+    half = n // 2
+    divisor_high = divisor[half:]
+    divisor_low = strip_limbs(divisor[:half])
+    q_high, remainder = divide_3n_by_2n_limbs(
+        num[n:], strip_limbs(num[half:n]), divisor, divisor_high, divisor_low, half)
+    q_low, remainder = divide_3n_by_2n_limbs(
+        remainder, strip_limbs(num[:half]), divisor, divisor_high, divisor_low, half)
+    if pad:
+        remainder = remainder[1:]
+    quotient = q_low + [0] * (half - len(q_low)) + q_high
+    return strip_limbs(quotient), remainder
+
+def divide_3n_by_2n_limbs(num_high, num_low, divisor, divisor_high, divisor_low, n):
+    # Helper for divide_2n_by_n_limbs: divide num_high * BASE^n + num_low by
+    # divisor, estimating the quotient from the divisor's top half
+    if compare_limbs(num_high[n:], divisor_high) == 0:
+        quotient = [BASE - 1] * n
+        remainder = subtract_limbs(add_limbs(num_high, divisor_high), [0] * n + divisor_high)
+    else:
+        quotient, remainder = divide_2n_by_n_limbs(num_high, divisor_high, n)
+    # The estimate is at most two too large; correct it against the low half
+    remainder = strip_limbs(num_low + [0] * (n - len(num_low)) + remainder)
+    correction = multiply_limbs(quotient, divisor_low)
+    while compare_limbs(remainder, correction) < 0:
+        quotient = subtract_limbs(quotient, [1])
+        remainder = add_limbs(remainder, divisor)
+    return quotient, subtract_limbs(remainder, correction)
+
+# Decimal-string wrappers around the limb kernels
+
+def compare_strings(num1, num2):
+    # Compare magnitudes of num1 and num2
+    return compare_limbs(str_to_limbs(num1), str_to_limbs(num2))
 
 def add_strings(num1, num2):
     # num1 and num2 are strings of digits
     # Returns string of digits
-    maxlen = max(len(num1), len(num2))
-    num1 = num1.zfill(maxlen)
-    num2 = num2.zfill(maxlen)
-    carry = 0
-    result = []
-    for i in range(maxlen - 1, -1, -1):
-        n1 = int(num1[i])
-        n2 = int(num2[i])
-        total = n1 + n2 + carry
-        result.append(str(total % 10))
-        carry = total // 10
-    if carry:
-        result.append(str(carry))
-    result_str = ''.join(result[::-1]).lstrip('0')
-    if result_str == '':
-        result_str = '0'
-    return result_str
+    return limbs_to_str(add_limbs(str_to_limbs(num1), str_to_limbs(num2)))
 
 def subtract_strings(num1, num2):
     # num1 and num2 are strings of digits, num1 >= num2
     # Returns string of digits
-    maxlen = max(len(num1), len(num2))
-    num1 = num1.zfill(maxlen)
-    num2 = num2.zfill(maxlen)
-    borrow = 0
-    result = []
-    for i in range(maxlen - 1, -1, -1):
-        n1 = int(num1[i])
-        n2 = int(num2[i]) + borrow
-        if n1 < n2:
-            n1 += 10
-            borrow = 1
-        else:
-            borrow = 0
-        diff = n1 - n2
-        result.append(str(diff))
-    result_str = ''.join(result[::-1]).lstrip('0')
-    if result_str == '':
-        result_str = '0'
-    return result_str
+    return limbs_to_str(subtract_limbs(str_to_limbs(num1), str_to_limbs(num2)))
 
 def multiply_strings(num1, num2):
     # num1 and num2 are strings of digits
     # Returns string of digits
-    if num1 == '0' or num2 == '0':
-        return '0'
-    result = [0] * (len(num1) + len(num2))
-    num1 = num1[::-1]
-    num2 = num2[::-1]
-    for i1, d1 in enumerate(num1):
-        for i2, d2 in enumerate(num2):
-            n1 = int(d1)
-            n2 = int(d2)
-            result[i1 + i2] += n1 * n2
-            result[i1 + i2 + 1] += result[i1 + i2] // 10
-            result[i1 + i2] = result[i1 + i2] % 10
-    # Remove leading zeros
-    while len(result) > 1 and result[-1] == 0:
-        result.pop()
-    result_str = ''.join(map(str, result[::-1]))
-    return result_str
-
-def divide_strings(num1, num2, decimal_places=0):
+    return limbs_to_str(multiply_limbs(str_to_limbs(num1), str_to_limbs(num2)))
+
+def divide_strings(num1, num2):
     # num1 and num2 are strings, num2 != '0'
     # Returns quotient, remainder
-    if num2 == '0':
-        raise ZeroDivisionError('Division by zero')
-    if num1 == '0':
-        return ('0', '0')
-    cmp = compare_strings(num1, num2)
-    if cmp < 0:
-        return ('0', num1)  # Quotient is 0, remainder is num1
-    elif cmp == 0:
-        return ('1', '0')  # Quotient is 1, remainder is 0
-    else:
-        # num1 > num2
-        quotient = ''
-        remainder = ''
-        n = len(num1)
-        i = 0
-        while i < n or (decimal_places > 0 and remainder != '0'):
-            if i < n:
-                remainder += num1[i]
-                i += 1
-            else:
-                remainder += '0'
-                decimal_places -= 1
-            remainder = remainder.lstrip('0')
-            if remainder == '':
-                remainder = '0'
-            count = 0
-            while compare_strings(remainder, num2) >= 0:
-                remainder = subtract_strings(remainder, num2)
-                count += 1
-            quotient += str(count)
-        quotient = quotient.lstrip('0')
-        if quotient == '':
-            quotient = '0'
-        remainder = remainder.lstrip('0')
-        if remainder == '':
-            remainder = '0'
-        return (quotient, remainder)
+    quotient, remainder = divide_limbs(str_to_limbs(num1), str_to_limbs(num2))
+    return (limbs_to_str(quotient), limbs_to_str(remainder))
 
 def pow_bigint(base, exponent):
-    result = BigInteger('1')
-    base_pow = BigInteger(str(base))
-    exp = BigInteger(str(exponent))
-    while exp > BigInteger('0'):
-        if int(exp.digits[-1]) % 2 == 1:
-            result = result * base_pow
-        base_pow = base_pow * base_pow
-        exp = exp // BigInteger('2')
+    # base^exponent; a negative exponent counts as zero
+    if exponent.sign == -1:
+        return ONE
+    power = limbs_to_int(exponent.limbs)
+    sign = base.sign if power % 2 else 1
+    return BigInteger._from_limbs(sign, pow_limbs(base.limbs, power))
+
+def pow_limbs(base, exponent):
+    # base^exponent for a machine integer exponent
+    if not exponent:
+        return [1]
+    if not base or list(base) == [1]:
+        return list(base)
+    top = base[-1]
+    if not any(base[:-1]) and str(top).rstrip('0') == '1':
+        # A power of ten is a decimal shift
+        return shift_decimal_limbs([1], exponent * (decimal_length(base) - 1))
+    # Multiplying by a single limb is already linear; no table needed
+    width = 1 if len(base) == 1 else window_width(exponent)
+    return window_pow_limbs(list(base), exponent, multiply_limbs, square_limbs, width)
+
+def window_width(exponent):
+    # Window size balancing the odd-power table against the multiplications
+    bits = exponent.bit_length()
+    return 1 if bits < 8 else 2 if bits < 24 else 3 if bits < 80 else 4 if bits < 240 else 5
+
+def window_pow_limbs(base, exponent, multiply, square, width):
+    # Sliding windows over the bits of exponent > 0: runs of zero bits cost
+    # one squaring each, and every window of up to width bits ending in a one
+    # costs one multiplication by a precomputed odd power of the base
+    table = [base]
+    if width > 1:
+        base_squared = square(base)
+        for _ in range((1 << (width - 1)) - 1):
+            table.append(multiply(table[-1], base_squared))
+    result = None
+    i = exponent.bit_length() - 1
+    while i >= 0:
+        check_deadline()
+        if not (exponent >> i) & 1:
+            result = square(result)
+            i -= 1
+            continue
+        low = max(i - width + 1, 0)
+        while not (exponent >> low) & 1:
+            low += 1
+        window = (exponent >> low) & ((1 << (i - low + 1)) - 1)
+        if result is None:
+            result = table[window >> 1]
+        else:
+            for _ in range(i - low + 1):
+                result = square(result)
+            result = multiply(result, table[window >> 1])
+        i = low - 1
+    return result
+
+# Modular arithmetic. Powers modulo m run the same sliding windows with every
+# product reduced at once: by Montgomery reduction (R = BASE^n) when m is
+# coprime to the base, i.e. to 10, and by Barrett reduction otherwise. Both
+# reduce with ordinary multiplications, so they ride on the fast tiers.
+
+def powmod(a, b, m):
+    # a^b % m with the sign rules of %, without building a^b; a negative b
+    # uses the inverse of a modulo m and gives a result in [0, |m|)
+    if not m.limbs:
+        raise ZeroDivisionError('Modulo by zero')
+    if b.sign == -1:
+        inverse = modinv(a, m)
+        return BigInteger._from_limbs(1, powmod_limbs(inverse.limbs, limbs_to_int(b.limbs), m.limbs))
+    power = limbs_to_int(b.limbs)
+    sign = a.sign if power % 2 else 1
+    return BigInteger._from_limbs(sign, powmod_limbs(a.limbs, power, m.limbs))
+
+def modinv(a, m):
+    # x in [0, |m|) with a*x = 1 (mod m)
+    if not m.limbs:
+        raise ZeroDivisionError('Modulo by zero')
+    inverse = modinv_limbs(a.limbs, m.limbs)
+    if inverse is None:
+        raise ValueError('Modular inverse does not exist')
+    if a.sign == -1 and inverse:
+        inverse = subtract_limbs(m.limbs, inverse)
+    return BigInteger._from_limbs(1, inverse)
+
+def modinv_limbs(num, modulus):
+    # Inverse of num modulo modulus in [0, modulus), or None if there is none
+    g, x, _ = gcd_limbs(num, modulus, extended=True)
+    if g != [1]:
+        return None
+    _, inverse = divide_limbs(x[1], modulus)
+    if x[0] == -1 and inverse:
+        inverse = subtract_limbs(modulus, inverse)
+    return inverse
+
+def powmod_limbs(base, exponent, modulus):
+    # base^exponent mod modulus for a machine integer exponent
+    _, base = divide_limbs(base, modulus)
+    if list(modulus) == [1]:
+        return []
+    if not exponent:
+        return [1]
+    if not base:
+        return []
+    width = window_width(exponent)
+    if modulus[0] % 2 and modulus[0] % 5:
+        size = len(modulus)
+        negated_inverse = subtract_limbs([0] * size + [1], modinv_limbs(modulus, [0] * size + [1]))
+        reduce = lambda value: montgomery_reduce_limbs(value, modulus, negated_inverse)
+        # Into Montgomery form (times R), powered, and back out
+        _, base = divide_limbs([0] * size + base, modulus)
+        result = window_pow_limbs(base, exponent, lambda x, y: reduce(multiply_limbs(x, y)),
+                                  lambda x: reduce(square_limbs(x)), width)
+        return reduce(result)
+    reciprocal, _ = divide_limbs([0] * (2 * len(modulus)) + [1], modulus)
+    reduce = lambda value: barrett_reduce_limbs(value, modulus, reciprocal)
+    return window_pow_limbs(base, exponent, lambda x, y: reduce(multiply_limbs(x, y)),
+                            lambda x: reduce(square_limbs(x)), width)
+
+def montgomery_reduce_limbs(value, modulus, negated_inverse):
+    # value / R mod modulus for value < modulus * R, where negated_inverse
+    # is -1 / modulus mod R: adding u * modulus clears the low n limbs
+    size = len(modulus)
+    u = strip_limbs(multiply_limbs(strip_limbs(list(value[:size])), negated_inverse)[:size])
+    result = add_limbs(value, multiply_limbs(u, modulus))[size:]
+    if compare_limbs(result, modulus) >= 0:
+        result = subtract_limbs(result, modulus)
+    return result
+
+def barrett_reduce_limbs(value, modulus, reciprocal):
+    # value mod modulus for value < BASE^(2n), with reciprocal the floor of
+    # BASE^(2n) / modulus; the estimated quotient is at most two too small
+    size = len(modulus)
+    quotient = multiply_limbs(value[size - 1:], reciprocal)[size + 1:]
+    result = subtract_limbs(value, multiply_limbs(quotient, modulus))
+    while compare_limbs(result, modulus) >= 0:
+        result = subtract_limbs(result, modulus)
     return result
 
 def factorial_bigint(n):
     if n.sign == -1:
-        return BigInteger('0')
-    result = BigInteger('1')
-    i = BigInteger('1')
-    while i <= n:
-        result = result * i
-        i = i + BigInteger('1')
-    return result
+        return ZERO
+    return BigInteger._from_limbs(1, factorial_limbs(int(n)))
+
+def double_factorial_bigint(n):
+    # n!! = n * (n - 2) * (n - 4) * ...
+    if n.sign == -1:
+        return ZERO
+    n = int(n)
+    if n % 2 == 0:
+        # (2k)!! = 2^k * k!
+        half = n // 2
+        return pow_bigint(TWO, BigInteger._from_int(half)) * factorial_bigint(BigInteger._from_int(half))
+    return BigInteger._from_limbs(1, product_limbs(range(3, n + 1, 2)))
+
+def factorial_limbs(n):
+    # Prime-swing factorial: n! = (floor(n/2)!)^2 * swing(n), where the swing
+    # is a product of small prime powers; every multiplication is balanced
+    if n < 20:
+        return product_limbs(range(2, n + 1))
+    primes = small_primes(n)
+    half = factorial_limbs(n // 2)
+    return multiply_limbs(multiply_limbs(half, half), prime_swing_limbs(n, primes))
+
+def prime_swing_limbs(n, primes):
+    # swing(n) = n! / (floor(n/2)!)^2. The exponent of p is the number of odd
+    # terms in floor(n/p), floor(n/p^2), ...; each prime power is at most n
+    factors = []
+    for p in primes:
+        if p > n:
+            break
+        power = 1
+        quotient = n // p
+        while quotient:
+            if quotient % 2 == 1:
+                power *= p
+            quotient //= p
+        if power > 1:
+            factors.append(power)
+    return product_limbs(factors)
+
+def small_primes(limit):
+    # Sieve of Eratosthenes; primes up to and including limit
+    if limit < 2:
+        return []
+    sieve = bytearray([1]) * (limit + 1)
+    sieve[0] = sieve[1] = 0
+    for i in range(2, int(limit ** 0.5) + 1):
+        if sieve[i]:
+            check_deadline()
+            sieve[i * i::i] = bytearray(len(range(i * i, limit + 1, i)))
+    return [i for i in range(limit + 1) if sieve[i]]
+
+def product_limbs(factors):
+    # Product of small integers (each below BASE). Runs of factors are packed
+    # into blocks with single-limb multiplications, then the blocks are
+    # combined pairwise so large multiplications have balanced operands
+    blocks = []
+    block = [1]
+    pending = 1
+    for factor in factors:
+        if pending * factor < BASE:
+            pending *= factor
+            continue
+        block = multiply_limbs_small(block, pending)
+        pending = factor
+        if len(block) >= KARATSUBA_THRESHOLD:
+            check_deadline()
+            blocks.append(block)
+            block = [1]
+    blocks.append(multiply_limbs_small(block, pending))
+    return balanced_product_limbs(blocks)
+
+def balanced_product_limbs(blocks):
+    # Product of a non-empty list of limb sequences, multiplied pairwise
+    while len(blocks) > 1:
+        paired = [multiply_limbs(blocks[i], blocks[i + 1]) for i in range(0, len(blocks) - 1, 2)]
+        if len(blocks) % 2:
+            paired.append(blocks[-1])
+        blocks = paired
+    return blocks[0]
+
+def falling_factorial_bigint(x, k):
+    # x * (x - 1) * ... * (x - k + 1) for a machine integer k >= 0; this is
+    # n! / m! for x = n and k = n - m, without either factorial
+    if k <= 0:
+        return ONE
+    x = int(x)
+    low = x - k + 1
+    if low <= 0 <= x:
+        return ZERO
+    sign = 1
+    if x < 0:
+        # A product of k negative factors
+        sign = -1 if k % 2 else 1
+        low, x = -x, -low
+    if x < BASE:
+        limbs = product_limbs(range(low, x + 1))
+    else:
+        blocks = []
+        for factor in range(low, x + 1):
+            if not factor % DEADLINE_STRIDE:
+                check_deadline()
+            blocks.append(int_to_limbs(factor))
+        limbs = balanced_product_limbs(blocks)
+    return BigInteger._from_limbs(sign, limbs)
+
+# Integer square root. The root of the top half of the limbs, scaled up, is
+# an overestimate of the root with about half its limbs correct. One Newton
+# step x -> (x + n // x) // 2 doubles that, but it can still be above the
+# floor of the root by up to about sqrt(BASE) / 2 when the top limb is small.
+# The excess x*x - n is computed once: taking d = excess // 2x + 1 off x
+# cannot pass the floor, and leaves at most a unit or two, settled with
+# linear updates of the excess.
+ISQRT_BASE_LIMBS = 4
+
+def isqrt_limbs(num):
+    if len(num) <= ISQRT_BASE_LIMBS:
+        value = limbs_to_int(num)
+        if not value:
+            return []
+        x = 1 << ((value.bit_length() + 1) // 2)
+        while True:
+            y = (x + value // x) // 2
+            if y >= x:
+                return int_to_limbs(x)
+            x = y
+    shift = len(num) // 4
+    root = isqrt_limbs(num[2 * shift:])
+    x = [0] * shift + add_limbs(root, [1])
+    quotient, _ = divide_limbs(num, x)
+    x, _ = divide_limbs_small(add_limbs(x, quotient), 2)
+    # Newton's iteration never drops below the floor of the root
+    square = square_limbs(x)
+    if compare_limbs(square, num) <= 0:
+        return x
+    excess = subtract_limbs(square, num)
+    d, _ = divide_limbs(excess, add_limbs(x, x))
+    d = add_limbs(d, [1])
+    # (x - d)^2 = x^2 - 2xd + d^2
+    over = add_limbs(excess, square_limbs(d))
+    under = multiply_limbs(add_limbs(x, x), d)
+    x = subtract_limbs(x, d)
+    if compare_limbs(over, under) <= 0:
+        return x
+    excess = subtract_limbs(over, under)
+    while True:
+        # (x - 1)^2 = x^2 - (2x - 1)
+        step = subtract_limbs(add_limbs(x, x), [1])
+        x = subtract_limbs(x, [1])
+        if compare_limbs(excess, step) <= 0:
+            return x
+        excess = subtract_limbs(excess, step)
 
 def gcd(a, b):
     # GCD of BigIntegers a and b
-    a_abs = abs(a)
-    b_abs = abs(b)
-    while b_abs != BigInteger('0'):
-        a_abs, b_abs = b_abs, a_abs % b_abs
-    return a_abs
-
-class BigRational:
-    def __init__(self, numerator, denominator=BigInteger('1')):
-        if isinstance(numerator, BigInteger):
-            self.numerator = numerator
-        elif isinstance(numerator, BigRational):
-            self.numerator = numerator.numerator
-            self.denominator = numerator.denominator
-            self.simplify()
-            return
+    return BigInteger._from_limbs(1, gcd_limbs(a.limbs, b.limbs))
+
+def gcd_extended(a, b):
+    # Returns (g, x, y) with a*x + b*y = g = gcd(a, b)
+    g, x, y = gcd_limbs(a.limbs, b.limbs, extended=True)
+    g = BigInteger._from_limbs(1, g)
+    x = BigInteger._from_limbs(x[0] * a.sign, x[1])
+    y = BigInteger._from_limbs(y[0] * b.sign, y[1])
+    return g, x, y
+
+# GCD engine. Operands of at most LEHMER_LIMBS limbs are finished with binary
+# GCD on machine integers, Lehmer's algorithm (driven by the top LEHMER_LIMBS
+# limbs) handles medium sizes, and the recursive half-GCD takes over from
+# HALF_GCD_THRESHOLD limbs.
+#
+# Every reduction is recorded as a 2x2 matrix M = [m00, m01, m10, m11, det]
+# of non-negative limb entries with determinant det = +-1, such that the
+# original pair equals M times the reduced pair. Extended GCD multiplies the
+# matrices together and reads the Bezout cofactors off the product.
+LEHMER_LIMBS = 6
+HALF_GCD_THRESHOLD = 1000
+
+def gcd_limbs(num1, num2, extended=False):
+    # Returns the gcd, or (gcd, x, y) with signed cofactors (sign, limbs)
+    # satisfying num1 * x + num2 * y = gcd when extended is true
+    a = strip_limbs(list(num1))
+    b = strip_limbs(list(num2))
+    matrix = [[1], [], [], [1], 1] if extended else None
+    if compare_limbs(a, b) < 0:
+        a, b = b, a
+        if extended:
+            matrix = [[], [1], [1], [], -1]
+    while b:
+        check_deadline()
+        if len(a) <= LEHMER_LIMBS:
+            small_a, small_b = limbs_to_int(a), limbs_to_int(b)
+            if not extended:
+                return int_to_limbs(binary_gcd(small_a, small_b))
+            g, step = euclid_matrix(small_a, small_b)
+            matrix = matrix_multiply_limbs(matrix, step)
+            a, b = int_to_limbs(g), []
+            break
+        step = None
+        if len(a) - len(b) < 2:
+            if len(a) >= HALF_GCD_THRESHOLD:
+                step = half_gcd_limbs(a, b)
+            else:
+                step = lehmer_step_limbs(a, b, 0)
+        if step is None:
+            step = division_step_limbs(a, b, 0)
+        reduction, a, b = step
+        if extended:
+            matrix = matrix_multiply_limbs(matrix, reduction)
+    if not extended:
+        return a
+    # The original pair is matrix * (g, 0), so g = det * (m11 * num1 - m01 * num2)
+    m00, m01, m10, m11, det = matrix
+    return a, (det, m11), (-det, m01)
+
+def binary_gcd(a, b):
+    # Stein's algorithm on machine integers
+    if not a or not b:
+        return a or b
+    shift = 0
+    while not (a | b) & 1:
+        a >>= 1
+        b >>= 1
+        shift += 1
+    while not a & 1:
+        a >>= 1
+    while b:
+        while not b & 1:
+            b >>= 1
+        if a > b:
+            a, b = b, a
+        b -= a
+    return a << shift
+
+def euclid_matrix(a, b):
+    # Euclid's algorithm on machine integers a >= b, returning the gcd and
+    # the reduction matrix in limb form
+    m00, m01, m10, m11, det = 1, 0, 0, 1, 1
+    while b:
+        q, r = divmod(a, b)
+        a, b = b, r
+        m00, m01 = m00 * q + m01, m00
+        m10, m11 = m10 * q + m11, m10
+        det = -det
+    return a, [int_to_limbs(m00), int_to_limbs(m01), int_to_limbs(m10), int_to_limbs(m11), det]
+
+def division_step_limbs(a, b, s):
+    # One Euclidean step (a, b) -> (b, a mod b). With s > 0 the step is
+    # refused (None) if the remainder would not stay longer than s limbs
+    q, r = divide_limbs(a, b)
+    if s and len(r) <= s:
+        return None
+    return [q, [1], [1], [], -1], b, r
+
+def lehmer_step_limbs(a, b, s):
+    # Run Euclid on the top LEHMER_LIMBS limbs of a >= b and apply the
+    # certified quotients to the full numbers at once. Knuth's test (Algorithm
+    # L) accepts a quotient only if both bounds on a/b agree, so every step is
+    # exact. With s > 0, steps are also stopped while the full remainder is
+    # still guaranteed to be longer than s limbs. Returns None when no
+    # quotient could be certified
+    shift = len(a) - LEHMER_LIMBS
+    a_hat = limbs_to_int(a[shift:])
+    b_hat = limbs_to_int(b[shift:])
+    bound = BASE ** (s - shift) if s > shift else 1
+    A, B, C, D = 1, 0, 0, 1
+    while b_hat + C and b_hat + D:
+        q = (a_hat + A) // (b_hat + C)
+        if q != (a_hat + B) // (b_hat + D):
+            break
+        next_C = A - q * C
+        next_D = B - q * D
+        next_b = a_hat - q * b_hat
+        if s and next_b - max(abs(next_C), abs(next_D)) < bound:
+            break
+        A, B, C, D = C, D, next_C, next_D
+        a_hat, b_hat = b_hat, next_b
+    if B == 0:
+        return None
+    # (A, B; C, D) maps (a, b) to the reduced pair; its inverse is the
+    # non-negative matrix (|D|, |B|; |C|, |A|) with the same determinant
+    matrix = [int_to_limbs(abs(D)), int_to_limbs(abs(B)), int_to_limbs(abs(C)), int_to_limbs(abs(A)), A * D - B * C]
+    return matrix, combine_limbs(a, b, A, B), combine_limbs(a, b, C, D)
+
+def combine_limbs(a, b, x, y):
+    # x * a + y * b for machine integers x and y (of either sign) in a single
+    # pass over the limbs; the result must be non-negative
+    if len(a) < len(b):
+        a, b, x, y = b, a, y, x
+    result = []
+    carry = 0
+    for i in range(len(a)):
+        total = carry + x * a[i] + (y * b[i] if i < len(b) else 0)
+        carry = total // BASE
+        result.append(total - carry * BASE)
+    result.extend(int_to_limbs(carry))
+    return strip_limbs(result)
+
+def half_gcd_limbs(a, b):
+    # Reduce a >= b (n limbs) while both stay longer than s = n // 2 + 1
+    # limbs. Large inputs are reduced through two recursive calls on their
+    # top parts, following the structure of Moller's subquadratic GCD; each
+    # recursive matrix is checked against the full numbers before it is used.
+    # Returns (matrix, a', b'), or None if no reduction was possible
+    n = len(a)
+    s = n // 2 + 1
+    if len(b) <= s:
+        return None
+    matrix = None
+    if n >= HALF_GCD_THRESHOLD:
+        reduced = half_gcd_top_limbs(a, b, n // 2, s)
+        if reduced is not None:
+            matrix, a, b = reduced
+        limit = 3 * n // 4 + 1
+        while len(a) > limit:
+            step = half_gcd_step_limbs(a, b, s)
+            if step is None:
+                break
+            reduction, a, b = step
+            matrix = reduction if matrix is None else matrix_multiply_limbs(matrix, reduction)
+        # The second call needs the first stage to have got a down to about
+        # 3n/4 limbs, so that its top part has at most about n/2 of them
+        if s + 2 < len(a) <= limit:
+            reduced = half_gcd_top_limbs(a, b, 2 * s - len(a) + 1, s)
+            if reduced is not None:
+                reduction, a, b = reduced
+                matrix = reduction if matrix is None else matrix_multiply_limbs(matrix, reduction)
+    while True:
+        step = half_gcd_step_limbs(a, b, s)
+        if step is None:
+            break
+        reduction, a, b = step
+        matrix = reduction if matrix is None else matrix_multiply_limbs(matrix, reduction)
+    if matrix is None:
+        return None
+    return matrix, a, b
+
+def half_gcd_top_limbs(a, b, p, s):
+    # Half-GCD of the parts of a and b above limb p, applied to the full
+    # numbers; None if it does not reduce them or breaks the size bound
+    top = half_gcd_limbs(a[p:], strip_limbs(b[p:]))
+    if top is None:
+        return None
+    matrix = top[0]
+    reduced = apply_matrix_inverse_limbs(matrix, a, b)
+    if reduced is None or len(reduced[1]) <= s or compare_limbs(reduced[0], reduced[1]) < 0:
+        return None
+    return matrix, reduced[0], reduced[1]
+
+def half_gcd_step_limbs(a, b, s):
+    step = lehmer_step_limbs(a, b, s)
+    if step is None:
+        step = division_step_limbs(a, b, s)
+    return step
+
+def apply_matrix_inverse_limbs(matrix, a, b):
+    # Solve (a, b) = matrix * (a', b') for the reduced pair. Returns None if
+    # either component would be negative, i.e. the matrix does not belong to
+    # the continued fraction of a / b
+    m00, m01, m10, m11, det = matrix
+    first = signed_subtract_limbs((1, multiply_limbs(m11, a)), (1, multiply_limbs(m01, b)))
+    second = signed_subtract_limbs((1, multiply_limbs(m00, b)), (1, multiply_limbs(m10, a)))
+    if (first[1] and first[0] != det) or (second[1] and second[0] != det):
+        return None
+    return first[1], second[1]
+
+def matrix_multiply_limbs(left, right):
+    a00, a01, a10, a11, det1 = left
+    b00, b01, b10, b11, det2 = right
+    if max(len(b00), len(b01), len(b10), len(b11)) <= LEHMER_LIMBS:
+        # A Lehmer or division step: combine with machine-integer entries
+        b00, b01, b10, b11 = [limbs_to_int(entry) for entry in (b00, b01, b10, b11)]
+        return [combine_limbs(a00, a01, b00, b10), combine_limbs(a00, a01, b01, b11),
+                combine_limbs(a10, a11, b00, b10), combine_limbs(a10, a11, b01, b11),
+                det1 * det2]
+    return [add_limbs(multiply_limbs(a00, b00), multiply_limbs(a01, b10)),
+            add_limbs(multiply_limbs(a00, b01), multiply_limbs(a01, b11)),
+            add_limbs(multiply_limbs(a10, b00), multiply_limbs(a11, b10)),
+            add_limbs(multiply_limbs(a10, b01), multiply_limbs(a11, b11)),
+            det1 * det2]
+
+def limbs_to_int(limbs):
+    # Machine integer from a few limbs
+    value = 0
+    for limb in reversed(limbs):
+        value = value * BASE + limb
+    return value
+
+def int_to_limbs(value):
+    # Limbs of a non-negative machine integer
+    limbs = []
+    while value:
+        value, limb = divmod(value, BASE)
+        limbs.append(limb)
+    return limbs
+
+# Decimal expansion. The digits of a fraction are produced as one block,
+# (remainder * 10^count) // divisor, so long expansions ride on the fast
+# division. The repeating part is found without tracking remainders: once the
+# factors 2 and 5 of the denominator are used up, the remainders cycle with
+# the multiplicative order of 10 modulo what is left of it.
+
+def shift_decimal_limbs(limbs, count):
+    # Multiply limbs by 10^count
+    if not limbs:
+        return []
+    whole, part = divmod(count, BASE_DIGITS)
+    return [0] * whole + multiply_limbs_small(limbs, 10 ** part)
+
+def decimal_length(limbs):
+    # Number of decimal digits in non-zero limbs
+    return (len(limbs) - 1) * BASE_DIGITS + len(str(limbs[-1]))
+
+def decimal_digits_limbs(remainder, divisor, count):
+    # The first count digits after the point of remainder / divisor, where
+    # remainder < divisor
+    if count <= 0:
+        return ''
+    quotient, _ = divide_limbs(shift_decimal_limbs(remainder, count), divisor)
+    return limbs_to_str(quotient).zfill(count)
+
+def split_decimal_denominator(limbs):
+    # Split a denominator into 2^a * 5^b * rest with rest coprime to 10
+    # Returns (max(a, b), rest limbs)
+    zeros = 0
+    while not limbs[zeros]:
+        zeros += 1
+    limbs = list(limbs[zeros:])
+    exponents = []
+    for prime in (2, 5):
+        # Divide out the largest power of prime below BASE while it goes in,
+        # then smaller ones
+        power, exponent = prime, 1
+        while power * prime < BASE:
+            power *= prime
+            exponent += 1
+        count = zeros * BASE_DIGITS
+        while exponent:
+            check_deadline()
+            quotient, remainder = divide_limbs_small(limbs, power)
+            if remainder:
+                power //= prime
+                exponent -= 1
+            else:
+                limbs = quotient
+                count += exponent
+        exponents.append(count)
+    return max(exponents), limbs
+
+def string_periods(text):
+    # Periods of a non-empty text in increasing order, read off its borders
+    # with the Knuth-Morris-Pratt failure function
+    failure = [0] * len(text)
+    k = 0
+    for i in range(1, len(text)):
+        if not i % DEADLINE_LIMBS:
+            check_deadline()
+        while k and text[i] != text[k]:
+            k = failure[k - 1]
+        if text[i] == text[k]:
+            k += 1
+        failure[i] = k
+    border = failure[-1]
+    while border:
+        yield len(text) - border
+        border = failure[border - 1]
+    yield len(text)
+
+def decimal_period_limbs(remainder, divisor, rest, start, places):
+    # Returns the first places digits of remainder / divisor and the length
+    # of the period beginning start digits after the point, or 0 if no whole
+    # period fits. rest is divisor without its factors 2 and 5
+    if places <= start:
+        return decimal_digits_limbs(remainder, divisor, places), 0
+    # A repeat of the next size digits pins the remainder down exactly, so a
+    # digit period that holds that long is a true one; shorter windows are
+    # tried first to avoid expanding far beyond a short period
+    size = decimal_length(divisor)
+    rest_size = decimal_length(rest)
+    window = 64 + 2 * size
+    while True:
+        count = min(places, start + window)
+        digits = decimal_digits_limbs(remainder, divisor, count)
+        for period in string_periods(digits[start:]):
+            if start + period + size <= count:
+                return digits, period
+            if count < places:
+                break
+            # Too close to the end to be read off the digits; compare the
+            # remainders themselves. 10^period = 1 (mod rest) needs
+            # 10^period > rest
+            if period >= rest_size:
+                _, first = divide_limbs(shift_decimal_limbs(remainder, start), divisor)
+                _, later = divide_limbs(shift_decimal_limbs(remainder, start + period), divisor)
+                if compare_limbs(first, later) == 0:
+                    return digits, period
+        if count == places:
+            return digits, 0
+        window *= 2
+
+# Logarithms. A positive rational is reduced to x = 10^j * 2^k * y with y in
+# [0.75, 1.5), and ln(y) is summed "bit-burst" style: y is approximated by
+# decimal fractions of 4, 8, 16, ... digits, and the logarithm of each ratio
+# between consecutive approximations is 2 * atanh(p / q) with p / q ever
+# smaller, summed by binary splitting. Values are fixed-point BigIntegers,
+# scaled by 10^places. ln(2) and ln(10) are kept in a memo that is extended
+# when more digits are asked for; constants past LN_CACHE_DIGITS digits are
+# computed but not kept.
+LN_CACHE_DIGITS = 100000
+LN_CONSTANTS = {}
+
+def power_of_ten(n):
+    return BigInteger._from_limbs(1, shift_decimal_limbs([1], n))
+
+def decimal_rational(value, places):
+    # The BigRational value / 10^places in lowest terms. The only factors it
+    # can share with the denominator are 2 and 5, so they are divided out
+    # directly rather than found by a GCD of the full-size operands
+    if not value.limbs:
+        return BigRational._from_parts(ZERO, ONE, True, False)
+    limbs = list(value.limbs)
+    zeros = 0
+    while zeros < len(limbs) - 1 and not limbs[zeros] and places - BASE_DIGITS * (zeros + 1) >= 0:
+        zeros += 1
+    limbs = limbs[zeros:]
+    places -= BASE_DIGITS * zeros
+    while places and limbs and not limbs[0] % 10:
+        limbs, _ = divide_limbs_small(limbs, 10)
+        places -= 1
+    count = 0
+    factor = 2 if limbs and not limbs[0] % 2 else 5
+    while count < places and limbs and not limbs[0] % factor:
+        limbs, _ = divide_limbs_small(limbs, factor)
+        count += 1
+    numerator = BigInteger._from_limbs(value.sign, limbs)
+    denominator = power_of_ten(places - count)
+    if count:
+        denominator = denominator * BigInteger._from_int(10 // factor) ** BigInteger._from_int(count)
+    return BigRational._from_parts(numerator, denominator, True, False)
+
+def log10_estimate(limbs):
+    # Floating-point log10 of non-zero limbs
+    top = limbs[-1] + (limbs[-2] / BASE if len(limbs) > 1 else 0)
+    return (len(limbs) - 1) * BASE_DIGITS + math.log10(top)
+
+def atanh_fixed(p, q, places):
+    # atanh(p / q) * 10^places within a unit, for integers 0 < |p| < q
+    ratio = log10_estimate(q.limbs) - log10_estimate(p.limbs)
+    terms = int(places / (2 * ratio)) + 2
+    _, power, odd, total = atanh_split(p * p, q * q, 0, terms)
+    numerator = (p * total).limbs
+    denominator = (q * odd * power).limbs
+    # Only places digits of the quotient are wanted, so low limbs beyond
+    # that precision are dropped from both sides before dividing
+    drop = max(0, len(denominator) - places // BASE_DIGITS - 3)
+    quotient, _ = divide_limbs(shift_decimal_limbs(numerator[drop:], places), denominator[drop:])
+    return BigInteger._from_limbs(p.sign, quotient)
+
+def atanh_split(p2, q2, start, end):
+    # Binary splitting of sum z^(2n) / (2n + 1) for start <= n < end, with
+    # z^2 = p2 / q2. Returns (P, Q, B, T) where P and Q are p2 and q2 to the
+    # number of terms (except n = 0), B the product of the 2n + 1 and the
+    # partial sum is T / (B * Q)
+    if end - start == 1:
+        if start == 0:
+            return ONE, ONE, ONE, ONE
+        return p2, q2, BigInteger._from_int(2 * start + 1), p2
+    mid = (start + end) // 2
+    p_left, q_left, b_left, t_left = atanh_split(p2, q2, start, mid)
+    p_right, q_right, b_right, t_right = atanh_split(p2, q2, mid, end)
+    return (p_left * p_right, q_left * q_right, b_left * b_right,
+            b_right * q_right * t_left + b_left * p_left * t_right)
+
+def ln_constant(name, places):
+    # ln(2) or ln(10) times 10^places, within two units
+    cached = LN_CONSTANTS.get(name)
+    if cached is None or cached[0] < places:
+        digits = places
+        if cached is not None:
+            # Grow by half again so that creeping precision does not recompute
+            # on every call
+            digits = max(places, min(cached[0] * 3 // 2, LN_CACHE_DIGITS))
+        work = digits + 5
+        # ln(2) = 18 atanh(1/26) - 2 atanh(1/4801) + 8 atanh(1/8749)
+        value = (BigInteger._from_int(18) * atanh_fixed(ONE, BigInteger._from_int(26), work)
+                 - TWO * atanh_fixed(ONE, BigInteger._from_int(4801), work)
+                 + BigInteger._from_int(8) * atanh_fixed(ONE, BigInteger._from_int(8749), work))
+        if name == 'ln10':
+            # ln(10) = 3 ln(2) + ln(5/4), and ln(5/4) = 2 atanh(1/9)
+            value = BigInteger._from_int(3) * value + TWO * atanh_fixed(ONE, BigInteger._from_int(9), work)
+        cached = (digits, value // power_of_ten(work - digits))
+        if digits <= LN_CACHE_DIGITS:
+            LN_CONSTANTS[name] = cached
+    digits, value = cached
+    return value // power_of_ten(digits - places)
+
+def ln_reduce(numerator, denominator):
+    # Write numerator / denominator as 10^j * 2^k * y with y in [0.75, 1.5)
+    # Returns (j, k, a, b) with y = a / b
+    j = decimal_length(numerator.limbs) - decimal_length(denominator.limbs)
+    a = numerator * power_of_ten(-j) if j < 0 else numerator
+    b = denominator * power_of_ten(j) if j > 0 else denominator
+    if a < b:
+        j -= 1
+        if j < 0:
+            a = numerator * power_of_ten(-j)
+            b = denominator
         else:
-            raise ValueError('Numerator must be BigInteger or BigRational')
-        if isinstance(denominator, BigInteger):
-            self.denominator = denominator
-        elif isinstance(denominator, BigRational):
-            self.numerator = self.numerator * denominator.denominator
-            self.denominator = self.denominator * denominator.numerator
-            self.simplify()
-            return
+            a = numerator
+            b = denominator * power_of_ten(j)
+    # Now 1 <= a / b < 10
+    k = 0
+    for cut_numerator, cut_denominator in ((3, 2), (3, 1), (6, 1)):
+        if a * BigInteger._from_int(cut_denominator) >= b * BigInteger._from_int(cut_numerator):
+            k += 1
+    if k:
+        b = b * BigInteger._from_int(2 ** k)
+    return j, k, a, b
+
+def ln_fixed(j, k, a, b, places):
+    # ln(10^j * 2^k * a / b) * 10^places for a / b in [0.75, 1.5)
+    # Returns (value, error bound in units)
+    value = ZERO
+    error = 0
+    digits = 2
+    target = places + 2
+    previous = None
+    while True:
+        u = (a * power_of_ten(digits)) // b
+        if previous is None:
+            v = power_of_ten(digits)
         else:
+            v = previous[1] * power_of_ten(digits - previous[0])
+        if u != v:
+            value = value + TWO * atanh_fixed(u - v, u + v, places)
+            error += 2
+        if digits >= target:
+            break
+        previous = (digits, u)
+        digits = min(2 * digits, target)
+    if k:
+        value = value + BigInteger._from_int(k) * ln_constant('ln2', places)
+        error += 2 * k
+    if j:
+        value = value + BigInteger._from_int(j) * ln_constant('ln10', places)
+        error += 2 * abs(j)
+    # The last approximation of y is within 10^-(places + 2) of it
+    return value, error + 1
+
+def round_fixed(value, error, guard):
+    # Round value / 10^guard to the nearest integer, or None if an error of
+    # up to error units could put it on the other side of a half
+    scale = power_of_ten(guard)
+    half = power_of_ten(guard - 1) * BigInteger._from_int(5)
+    magnitude = abs(value)
+    if abs(magnitude % scale - half) <= BigInteger._from_int(error):
+        return None
+    rounded = (magnitude + half) // scale
+    return -rounded if value.sign == -1 else rounded
+
+def ln_rational(x, places, base10=False):
+    # ln(x), or log10(x) if base10, rounded to places digits after the point
+    # for a positive BigRational x; guard digits are doubled until the
+    # rounding is certain, which always happens as the values are irrational
+    j, k, a, b = ln_reduce(x.numerator, x.denominator)
+    if a == b and not k and (base10 or not j):
+        # x is a power of ten
+        return BigRational(BigInteger._from_int(j) if base10 else ZERO)
+    guard = 10 + len(str(abs(j)))
+    while True:
+        work = places + guard
+        value, error = ln_fixed(j, k, a, b, work)
+        if base10:
+            value = (value * power_of_ten(work)) // ln_constant('ln10', work)
+            error += 2 * abs(j) + 4
+        rounded = round_fixed(value, error, guard)
+        if rounded is not None:
+            return decimal_rational(rounded, places)
+        guard *= 2
+
+# Lazy rationals (BigRational(..., lazy=True), or Evaluator(lazy=True)) skip
+# the GCD on each operation. They are reduced when observed - compared for
+# order, printed, or when numerator/denominator is read - or once their
+# components grow past a limit of LAZY_REDUCE_LIMBS limbs, or twice their
+# size at the last reduction if that is larger.
+LAZY_REDUCE_LIMBS = 64
+
+class BigRational(Frozen):
+    # The value never changes; reducing a lazy rational in place only swaps
+    # its numerator and denominator for an equal, reduced pair
+    __slots__ = ('_numerator', '_denominator', '_reduced', '_lazy', '_limit')
+
+    def __init__(self, numerator, denominator=ONE, lazy=False):
+        if isinstance(numerator, BigRational):
+            # A copy of a rational; the denominator argument is not used
+            self._set_parts(numerator.numerator, numerator.denominator, True, lazy)
+            return
+        if not isinstance(numerator, BigInteger):
+            raise ValueError('Numerator must be BigInteger or BigRational')
+        if isinstance(denominator, BigRational):
+            numerator, denominator = numerator * denominator.denominator, denominator.numerator
+        elif not isinstance(denominator, BigInteger):
             raise ValueError('Denominator must be BigInteger or BigRational')
-        
-        if self.denominator == BigInteger('0'):
+
+        if not denominator.limbs:
             raise ZeroDivisionError('Denominator cannot be zero')
-            
-        if self.denominator.sign == -1:
-            self.numerator = -self.numerator
-            self.denominator = abs(self.denominator)
-        self.simplify()
 
-    def simplify(self):
-        gcd_value = gcd(abs(self.numerator), self.denominator)
-        self.numerator = self.numerator // gcd_value
-        self.denominator = self.denominator // gcd_value
+        if denominator.sign == -1:
+            numerator = -numerator
+            denominator = abs(denominator)
+        if lazy:
+            self._set_parts(numerator, denominator, False, True)
+        else:
+            numerator, denominator, limit = self._reduce(numerator, denominator)
+            self._set_parts(numerator, denominator, True, False, limit)
+
+    @classmethod
+    def _from_parts(cls, numerator, denominator, reduced, lazy, limit=LAZY_REDUCE_LIMBS):
+        # Build a BigRational from a positive denominator without any checks
+        result = cls.__new__(cls)
+        result._set_parts(numerator, denominator, reduced, lazy, limit)
+        return result
 
-    def __add__(self, other):
+    def _set_parts(self, numerator, denominator, reduced, lazy, limit=LAZY_REDUCE_LIMBS):
+        object.__setattr__(self, '_numerator', numerator)
+        object.__setattr__(self, '_denominator', denominator)
+        object.__setattr__(self, '_reduced', reduced)
+        object.__setattr__(self, '_lazy', lazy)
+        object.__setattr__(self, '_limit', limit)
+
+    def __reduce__(self):
+        return BigRational._from_parts, (self._numerator, self._denominator, self._reduced, self._lazy, self._limit)
+
+    @property
+    def numerator(self):
+        if not self._reduced:
+            self.simplify()
+        return self._numerator
+
+    @property
+    def denominator(self):
+        if not self._reduced:
+            self.simplify()
+        return self._denominator
+
+    def simplify(self):
+        numerator, denominator, limit = self._reduce(self._numerator, self._denominator)
+        self._set_parts(numerator, denominator, True, self._lazy, limit)
+
+    @staticmethod
+    def _reduce(numerator, denominator):
+        # The fraction in lowest terms, and the lazy size limit that goes with it
+        if denominator != ONE:
+            gcd_value = gcd(abs(numerator), denominator)
+            if gcd_value != ONE:
+                numerator = numerator // gcd_value
+                denominator = denominator // gcd_value
+        return numerator, denominator, max(LAZY_REDUCE_LIMBS, 2 * max(len(numerator.limbs), len(denominator.limbs)))
+
+    def _coerce(self, other):
         if isinstance(other, BigInteger):
             other = BigRational(other)
         if not isinstance(other, BigRational):
             raise ValueError('Operand must be BigRational or BigInteger')
-        numerator = self.numerator * other.denominator + other.numerator * self.denominator
-        denominator = self.denominator * other.denominator
-        return BigRational(numerator, denominator)
+        return other
+
+    def _stays_lazy(self, other, size):
+        # Whether a lazy result of about size limbs can skip reduction; if
+        # not, both operands are reduced so Henrici's formulas apply
+        if not (self._lazy or other._lazy):
+            return False
+        if size <= max(self._limit, other._limit):
+            return True
+        if not self._reduced:
+            self.simplify()
+        if not other._reduced:
+            other.simplify()
+        return False
+
+    def __add__(self, other):
+        return self._add(self._coerce(other), 1)
 
     def __sub__(self, other):
-        if isinstance(other, BigInteger):
-            other = BigRational(other)
-        if not isinstance(other, BigRational):
-            raise ValueError('Operand must be BigRational or BigInteger')
-        numerator = self.numerator * other.denominator - other.numerator * self.denominator
-        denominator = self.denominator * other.denominator
-        return BigRational(numerator, denominator)
+        return self._add(self._coerce(other), -1)
+
+    def _add(self, other, sign):
+        a, b = self._numerator, self._denominator
+        c, d = other._numerator, other._denominator
+        if sign == -1:
+            c = -c
+        lazy = self._lazy or other._lazy
+        if b == ONE and d == ONE:
+            # Integers: nothing to cross-multiply or reduce
+            return BigRational._from_parts(a + c, ONE, True, lazy)
+        size = max(len(a.limbs) + len(d.limbs), len(b.limbs) + len(c.limbs), len(b.limbs) + len(d.limbs))
+        if self._stays_lazy(other, size):
+            return BigRational._from_parts(a * d + c * b, b * d, False, True, max(self._limit, other._limit))
+        a, b = self._numerator, self._denominator
+        c, d = other._numerator, other._denominator
+        if sign == -1:
+            c = -c
+        # Henrici: with g = gcd(b, d), only the gcd of the new numerator and
+        # g can remain, so no full-size GCD is needed
+        g = gcd(b, d)
+        if g == ONE:
+            return BigRational._from_parts(a * d + c * b, b * d, True, lazy)
+        b_over_g = b // g
+        t = a * (d // g) + c * b_over_g
+        if not t.limbs:
+            return BigRational._from_parts(t, ONE, True, lazy)
+        g2 = gcd(t, g)
+        return BigRational._from_parts(t // g2, b_over_g * (d // g2), True, lazy)
 
     def __mul__(self, other):
-        if isinstance(other, BigInteger):
-            other = BigRational(other)
-        if not isinstance(other, BigRational):
-            raise ValueError('Operand must be BigRational or BigInteger')
-        numerator = self.numerator * other.numerator
-        denominator = self.denominator * other.denominator
-        return BigRational(numerator, denominator)
+        return self._multiply(self._coerce(other))
 
     def __truediv__(self, other):
-        if isinstance(other, BigInteger):
-            other = BigRational(other)
-        if not isinstance(other, BigRational):
-            raise ValueError('Operand must be BigRational or BigInteger')
-        if other.numerator == BigInteger('0'):
+        other = self._coerce(other)
+        if not other._numerator.limbs:
             raise ZeroDivisionError('Division by zero')
-        numerator = self.numerator * other.denominator
-        denominator = self.denominator * other.numerator
-        return BigRational(numerator, denominator)
+        # Multiply by the reciprocal, keeping its denominator positive
+        numerator, denominator = other._denominator, other._numerator
+        if denominator.sign == -1:
+            numerator, denominator = -numerator, -denominator
+        reciprocal = BigRational._from_parts(numerator, denominator, other._reduced, other._lazy, other._limit)
+        return self._multiply(reciprocal)
+
+    def _multiply(self, other):
+        a, b = self._numerator, self._denominator
+        c, d = other._numerator, other._denominator
+        lazy = self._lazy or other._lazy
+        if b == ONE and d == ONE:
+            return BigRational._from_parts(a * c, ONE, True, lazy)
+        size = max(len(a.limbs) + len(c.limbs), len(b.limbs) + len(d.limbs))
+        if self._stays_lazy(other, size):
+            return BigRational._from_parts(a * c, b * d, False, True, max(self._limit, other._limit))
+        a, b = self._numerator, self._denominator
+        c, d = other._numerator, other._denominator
+        if not a.limbs or not c.limbs:
+            return BigRational._from_parts(ZERO, ONE, True, lazy)
+        # Henrici: cancel gcd(a, d) and gcd(c, b) before multiplying
+        g1 = gcd(a, d)
+        g2 = gcd(c, b)
+        numerator = (a // g1) * (c // g2)
+        denominator = (b // g2) * (d // g1)
+        return BigRational._from_parts(numerator, denominator, True, lazy)
 
     def __pow__(self, exponent):
         if not isinstance(exponent, BigInteger):
             raise ValueError('Exponent must be BigInteger')
+        numerator, denominator = self.numerator, self.denominator
         if exponent.sign == -1:
-            new_numerator = pow_bigint(self.denominator, abs(exponent))
-            new_denominator = pow_bigint(self.numerator, abs(exponent))
-        else:
-            new_numerator = pow_bigint(self.numerator, exponent)
-            new_denominator = pow_bigint(self.denominator, exponent)
-        return BigRational(new_numerator, new_denominator)
+            if not numerator.limbs:
+                raise ZeroDivisionError('Denominator cannot be zero')
+            numerator, denominator = denominator, numerator
+            if denominator.sign == -1:
+                numerator, denominator = -numerator, -denominator
+            exponent = -exponent
+        # Powers of coprime integers are coprime, so no GCD is needed
+        return BigRational._from_parts(pow_bigint(numerator, exponent), pow_bigint(denominator, exponent),
+                                       True, self._lazy)
+
+    def sqrt(self, decimal_places=50):
+        # Exact when the numerator and denominator are both perfect squares,
+        # otherwise the root rounded to decimal_places digits after the point
+        if self._numerator.sign == -1:
+            raise ValueError('sqrt(x) is undefined for x < 0')
+        numerator, denominator = self.numerator.limbs, self.denominator.limbs
+        numerator_root = isqrt_limbs(numerator)
+        if compare_limbs(multiply_limbs(numerator_root, numerator_root), numerator) == 0:
+            denominator_root = isqrt_limbs(denominator)
+            if compare_limbs(multiply_limbs(denominator_root, denominator_root), denominator) == 0:
+                return BigRational._from_parts(BigInteger._from_limbs(1, numerator_root),
+                                               BigInteger._from_limbs(1, denominator_root), True, self._lazy)
+        # The floor of 2 * sqrt(x) * 10^places is the integer root of
+        # 4 * x * 10^(2 * places); halving it rounds half up, and an
+        # irrational root is never a tie
+        scaled, _ = divide_limbs(multiply_limbs_small(shift_decimal_limbs(numerator, 2 * decimal_places), 4), denominator)
+        rounded, _ = divide_limbs_small(add_limbs(isqrt_limbs(scaled), [1]), 2)
+        return decimal_rational(BigInteger._from_limbs(1, rounded), decimal_places)
+
+    def ln(self, decimal_places=10):
+        # Natural logarithm rounded to decimal_places digits after the point
+        if self._numerator.sign == -1 or not self._numerator.limbs:
+            raise ValueError('ln(x) is undefined for x <= 0')
+        return ln_rational(self, decimal_places)
+
+    def log10(self, decimal_places=10):
+        # Common logarithm, exact for powers of ten
+        if self._numerator.sign == -1 or not self._numerator.limbs:
+            raise ValueError('log(x) is undefined for x <= 0')
+        return ln_rational(self, decimal_places, base10=True)
 
     def __abs__(self):
-        return BigRational(abs(self.numerator), self.denominator)
+        return BigRational._from_parts(abs(self._numerator), self._denominator, self._reduced, self._lazy, self._limit)
 
     def __neg__(self):
-        return BigRational(-self.numerator, self.denominator)
+        return BigRational._from_parts(-self._numerator, self._denominator, self._reduced, self._lazy, self._limit)
 
     def __str__(self):
         # Return decimal expansion
         return self.to_decimal(10)  # Default to 10 decimal places
 
     def to_fraction_string(self):
-        if self.denominator == BigInteger('1'):
+        if self.denominator == ONE:
             return str(self.numerator)
         else:
             return f"{self.numerator}/{self.denominator}"
 
     def to_decimal(self, decimal_places=20):
-        # Perform decimal division
-        integer_part = self.numerator // self.denominator
-        remainder = self.numerator % self.denominator
-        
-        # Handle negative numbers
-        if remainder.sign == -1:
-            remainder = abs(remainder)
-            
-        decimal_digits = ''
-        remainder_digits = {}
-        count = 0
-        periodic = False
-        
-        while remainder != BigInteger('0') and count < decimal_places:
-            remainder = remainder * BigInteger('10')
-            digit = remainder // self.denominator
-            remainder = remainder % self.denominator
-            decimal_digits += str(digit)
-            count += 1
-            
-            remainder_key = str(remainder)
-            if remainder_key in remainder_digits:
-                # Period detected
-                repeat_start = remainder_digits[remainder_key]
-                non_repeat = decimal_digits[:repeat_start]
-                repeat = decimal_digits[repeat_start:]
-                periodic = True
-                break
-            remainder_digits[remainder_key] = count
-            
-        if periodic:
-            if non_repeat:
-                result = f"{integer_part}.{non_repeat}({repeat})"
-            else:
-                result = f"{integer_part}.({repeat})"
-        else:
-            if decimal_digits:
-                result = f"{integer_part}.{decimal_digits}"
-            else:
-                result = str(integer_part)
-        return result
+        # Digits past decimal_places are truncated; a repeating block is shown
+        # in parentheses when its first whole period fits
+        integer_part, remainder = divmod(self.numerator, self.denominator)
+        if not remainder.limbs or decimal_places <= 0:
+            return str(integer_part)
+        divisor = self.denominator.limbs
+        start, rest = split_decimal_denominator(divisor)
+        if rest == [1]:
+            # Terminating expansion
+            digits = decimal_digits_limbs(remainder.limbs, divisor, min(start, decimal_places))
+            return f"{integer_part}.{digits}"
+        # The period is reported from the first digit at the earliest, so
+        # 1/3 reads 0.3(3)
+        start = max(start, 1)
+        digits, period = decimal_period_limbs(remainder.limbs, divisor, rest, start, decimal_places)
+        if period:
+            return f"{integer_part}.{digits[:start]}({digits[start:start + period]})"
+        return f"{integer_part}.{digits}"
 
     def __eq__(self, other):
         if isinstance(other, BigInteger):
             other = BigRational(other)
-        return self.numerator == other.numerator and self.denominator == other.denominator
+        if not isinstance(other, BigRational):
+            return NotImplemented
+        if self._reduced and other._reduced:
+            return self._numerator == other._numerator and self._denominator == other._denominator
+        # Cross-multiplying compares unreduced fractions without a GCD
+        return self._numerator * other._denominator == other._numerator * self._denominator
+
+    def __hash__(self):
+        # Hashes the reduced fraction, so equal values hash alike; an integer
+        # hashes like the BigInteger it equals
+        if self.denominator == ONE:
+            return hash(self.numerator)
+        return hash((self.numerator, self.denominator))
 
     def __lt__(self, other):
         if isinstance(other, BigInteger):
             other = BigRational(other)
-        left = self.numerator * other.denominator
-        right = other.numerator * self.denominator
+        left = self._numerator * other._denominator
+        right = other._numerator * self._denominator
         return left < right
 
     def __le__(self, other):
@@ -496,10 +2039,23 @@ class BigRational:
 
 # Tokenizer and Parser
 
-class Token:
+class Token(Frozen):
+    __slots__ = ('type', 'value')
+
     def __init__(self, type_, value=None):
-        self.type = type_
-        self.value = value  # For numbers or identifiers
+        object.__setattr__(self, 'type', type_)
+        object.__setattr__(self, 'value', value)  # For numbers or identifiers
+
+    def __reduce__(self):
+        return Token, (self.type, self.value)
+
+    def __eq__(self, other):
+        if not isinstance(other, Token):
+            return NotImplemented
+        return self.type == other.type and self.value == other.value
+
+    def __hash__(self):
+        return hash((self.type, self.value))
 
     def __repr__(self):
         if self.value:
@@ -521,103 +2077,159 @@ RPAREN = 'RPAREN'
 COMMA = 'COMMA'
 EOF = 'EOF'
 
+# Tokens are shared: one Token object per operator, made once. Runs of
+# ASCII digits, names and spaces are matched by a single compiled pattern and
+# each literal is sliced out of the text once, so scanning is linear. A
+# character outside that pattern (a non-ASCII digit, letter or space) is
+# classified with the str predicates: numbers continue while isdigit() holds,
+# and BigInteger accepts any decimal digits (as int() does) but not other
+# digit characters such as superscripts; names start with isalpha() and
+# continue with isalnum() or '_'
+OPERATOR_TOKENS = {
+    '+': Token(PLUS), '-': Token(MINUS), '*': Token(MULTIPLY), '/': Token(DIVIDE),
+    '%': Token(MODULO), '^': Token(EXPONENT), '!': Token(FACTORIAL),
+    '(': Token(LPAREN), ')': Token(RPAREN), ',': Token(COMMA),
+}
+EOF_TOKEN = Token(EOF)
+TOKEN_PATTERN = re.compile('([0-9]+)|([A-Za-z][A-Za-z0-9_]*)|[ \t\n\r]+')
+DIGIT_RUN = re.compile('[0-9]+')
+NAME_RUN = re.compile('[A-Za-z0-9_]+')
+WORD_RUN = re.compile(r'\w*')
+
 def tokenize(text):
-    tokens = []
-    i = 0
-    n = len(text)
-    while i < n:
-        c = text[i]
-        if c.isdigit():
-            num = c
-            i += 1
-            while i < n and text[i].isdigit():
-                num += text[i]
-                i += 1
-            tokens.append(Token(NUMBER, num))
-        elif c.isalpha():
-            ident = c
-            i += 1
-            while i < n and (text[i].isalnum() or text[i] == '_'):
-                ident += text[i]
-                i += 1
-            tokens.append(Token(IDENTIFIER, ident))
-        elif c == '+':
-            tokens.append(Token(PLUS))
-            i += 1
-        elif c == '-':
-            tokens.append(Token(MINUS))
-            i += 1
-        elif c == '*':
-            tokens.append(Token(MULTIPLY))
-            i += 1
-        elif c == '/':
-            tokens.append(Token(DIVIDE))
-            i += 1
-        elif c == '%':
-            tokens.append(Token(MODULO))
-            i += 1
-        elif c == '^':
-            tokens.append(Token(EXPONENT))
-            i += 1
-        elif c == '!':
-            tokens.append(Token(FACTORIAL))
-            i += 1
-        elif c == '(':
-            tokens.append(Token(LPAREN))
-            i += 1
-        elif c == ')':
-            tokens.append(Token(RPAREN))
-            i += 1
-        elif c == ',':
-            tokens.append(Token(COMMA))
-            i += 1
+    tokens = list(scan_tokens(text, 0, len(text)))
+    tokens.append(EOF_TOKEN)
+    return tokens
+
+def scan_tokens(text, pos, end):
+    # Tokens of text[pos:end], without the final EOF
+    operator_tokens = OPERATOR_TOKENS
+    match = TOKEN_PATTERN.match
+    while pos < end:
+        c = text[pos]
+        tok = operator_tokens.get(c)
+        if tok is not None:
+            yield tok
+            pos += 1
+            continue
+        start = pos
+        found = match(text, pos, end)
+        if found:
+            if found.lastindex is None:
+                pos = found.end()
+                continue
+            pos = found.end()
+            number = found.lastindex == 1
+        elif c.isdigit() or c.isalpha():
+            pos += 1
+            number = c.isdigit()
         elif c.isspace():
-            i += 1
+            pos += 1
+            continue
         else:
             raise ValueError(f'Unknown character {c}')
-    tokens.append(Token(EOF))
-    return tokens
+        if number:
+            while pos < end and text[pos].isdigit():
+                found = DIGIT_RUN.match(text, pos, end)
+                pos = found.end() if found else pos + 1
+            yield Token(NUMBER, text[start:pos])
+        else:
+            while pos < end and (text[pos].isalnum() or text[pos] == '_'):
+                found = NAME_RUN.match(text, pos, end)
+                pos = found.end() if found else pos + 1
+            yield Token(IDENTIFIER, text[start:pos])
+
+def iter_tokens(source, chunk_size=65536):
+    # Tokens read lazily from a file-like object (a file, io.StringIO, or a
+    # socket's makefile()), ending with EOF; bytes are decoded as UTF-8. Each
+    # chunk is scanned up to the run of name or digit characters it ends
+    # with, as that run may continue in the next chunk. Reads grow with the
+    # run, so even a huge literal is assembled in linear time
+    decoder = codecs.getincrementaldecoder('utf-8')()
+    carry = ''
+    while True:
+        raw = source.read(max(chunk_size, len(carry)))
+        chunk = decoder.decode(raw, not raw) if isinstance(raw, bytes) else raw
+        text = carry + chunk
+        if not raw:
+            yield from scan_tokens(text, 0, len(text))
+            yield EOF_TOKEN
+            return
+        # \w is exactly isalnum() or '_'; the carry is all word characters
+        cut = 0
+        if not WORD_RUN.fullmatch(chunk):
+            cut = len(text)
+            while text[cut - 1].isalnum() or text[cut - 1] == '_':
+                cut -= 1
+            yield from scan_tokens(text, 0, cut)
+        carry = text[cut:]
+
+# AST nodes are immutable and compare by identity
+
+class NumberNode(Frozen):
+    __slots__ = ('value',)
 
-class NumberNode:
     def __init__(self, value):
-        self.value = value  # BigInteger
+        object.__setattr__(self, 'value', value)  # BigInteger
+    def __reduce__(self):
+        return NumberNode, (self.value,)
     def __repr__(self):
         return f'NumberNode({self.value})'
 
-class UnaryOpNode:
+class UnaryOpNode(Frozen):
+    __slots__ = ('op_tok', 'node')
+
     def __init__(self, op_tok, node):
-        self.op_tok = op_tok
-        self.node = node
+        object.__setattr__(self, 'op_tok', op_tok)
+        object.__setattr__(self, 'node', node)
+    def __reduce__(self):
+        return UnaryOpNode, (self.op_tok, self.node)
     def __repr__(self):
         return f'UnaryOpNode({self.op_tok}, {self.node})'
 
-class BinOpNode:
+class BinOpNode(Frozen):
+    __slots__ = ('left_node', 'op_tok', 'right_node')
+
     def __init__(self, left_node, op_tok, right_node):
-        self.left_node = left_node
-        self.op_tok = op_tok
-        self.right_node = right_node
+        object.__setattr__(self, 'left_node', left_node)
+        object.__setattr__(self, 'op_tok', op_tok)
+        object.__setattr__(self, 'right_node', right_node)
+    def __reduce__(self):
+        return BinOpNode, (self.left_node, self.op_tok, self.right_node)
     def __repr__(self):
         return f'BinOpNode({self.left_node}, {self.op_tok}, {self.right_node})'
 
-class FuncCallNode:
+class FuncCallNode(Frozen):
+    __slots__ = ('func_name_tok', 'arg_nodes')
+
     def __init__(self, func_name_tok, arg_nodes):
-        self.func_name_tok = func_name_tok
-        self.arg_nodes = arg_nodes
+        object.__setattr__(self, 'func_name_tok', func_name_tok)
+        object.__setattr__(self, 'arg_nodes', tuple(arg_nodes))
+    def __reduce__(self):
+        return FuncCallNode, (self.func_name_tok, self.arg_nodes)
     def __repr__(self):
         return f'FuncCallNode({self.func_name_tok}, {self.arg_nodes})'
 
+class ConstantNode(Frozen):
+    # A value computed ahead of time by the Optimizer
+    __slots__ = ('value',)
+
+    def __init__(self, value):
+        object.__setattr__(self, 'value', value)  # BigRational
+    def __reduce__(self):
+        return ConstantNode, (self.value,)
+    def __repr__(self):
+        return f'ConstantNode({self.value.to_fraction_string()})'
+
 class Parser:
     def __init__(self, tokens):
-        self.tokens = tokens
-        self.pos = 0
-        self.current_tok = self.tokens[self.pos]
+        # tokens is a list or any iterable, such as iter_tokens(file); it is
+        # read one token at a time
+        self.tokens = iter(tokens)
+        self.current_tok = next(self.tokens, EOF_TOKEN)
 
     def advance(self):
-        self.pos += 1
-        if self.pos < len(self.tokens):
-            self.current_tok = self.tokens[self.pos]
-        else:
-            self.current_tok = Token(EOF)
+        self.current_tok = next(self.tokens, EOF_TOKEN)
 
     def parse(self):
         result = self.expression()
@@ -626,240 +2238,1075 @@ class Parser:
         return result
 
     def expression(self):
-        node = self.term()
-        while self.current_tok.type in (PLUS, MINUS):
-            op_tok = self.current_tok
-            self.advance()
-            right_node = self.term()
-            node = BinOpNode(node, op_tok, right_node)
-        return node
-
-    def term(self):
-        node = self.factor()
-        while self.current_tok.type in (MULTIPLY, DIVIDE, MODULO):
-            op_tok = self.current_tok
-            self.advance()
-            right_node = self.factor()
-            node = BinOpNode(node, op_tok, right_node)
-        return node
-
-    def factor(self):
-        node = self.unary()
-        while self.current_tok.type == EXPONENT:
-            op_tok = self.current_tok
-            self.advance()
-            right_node = self.factor()
-            node = BinOpNode(node, op_tok, right_node)
-        return node
-
-    def unary(self):
-        tok = self.current_tok
-        if tok.type in (PLUS, MINUS):
-            self.advance()
-            node = self.unary()
-            return UnaryOpNode(tok, node)
-        else:
-            return self.primary()
-
-    def primary(self):
-        tok = self.current_tok
-        if tok.type == NUMBER:
-            self.advance()
-            node = NumberNode(BigInteger(tok.value))
-            while self.current_tok.type == FACTORIAL:
-                op_tok = self.current_tok
+        # Operator-precedence parsing with explicit stacks. Each parenthesis
+        # or argument list being read is a frame of its own, so the nesting
+        # depth is not bounded by Python's recursion limit. Signs bind to the
+        # primary they precede, postfix ! to a number or parenthesis, and
+        # binary operators follow BINARY_PRECEDENCE
+        frames = [ParseFrame(None)]
+        while True:
+            # Read an operand: any prefix signs, then a primary
+            frame = frames[-1]
+            tok = self.current_tok
+            while tok.type in (PLUS, MINUS):
+                frame.prefixes.append(tok)
                 self.advance()
-                node = UnaryOpNode(op_tok, node)
-            return node
-        elif tok.type == IDENTIFIER:
-            self.advance()
-            if self.current_tok.type == LPAREN:
+                tok = self.current_tok
+            if tok.type == NUMBER:
+                self.advance()
+                node = self.postfix(NumberNode(BigInteger(tok.value)))
+            elif tok.type == IDENTIFIER:
+                self.advance()
+                if self.current_tok.type != LPAREN:
+                    raise ValueError(f'Unexpected token {self.current_tok}')
                 # Function call
                 self.advance()
-                arg_nodes = []
                 if self.current_tok.type != RPAREN:
-                    arg_nodes.append(self.expression())
-                    while self.current_tok.type == COMMA:
-                        self.advance()
-                        arg_nodes.append(self.expression())
-                if self.current_tok.type != RPAREN:
-                    raise ValueError('Expected ) after function arguments')
+                    frames.append(ParseFrame(tok))
+                    continue
                 self.advance()
-                node = FuncCallNode(tok, arg_nodes)
-                return node
+                node = FuncCallNode(tok, [])
+            elif tok.type == LPAREN:
+                self.advance()
+                frames.append(ParseFrame(tok))
+                continue
             else:
-                raise ValueError(f'Unexpected token {self.current_tok}')
-        elif tok.type == LPAREN:
-            self.advance()
-            node = self.expression()
-            if self.current_tok.type != RPAREN:
-                raise ValueError('Expected )')
-            self.advance()
-            while self.current_tok.type == FACTORIAL:
+                raise ValueError('Expected number, identifier, or (')
+            # Hand the operand to its frame; a frame that ends here yields
+            # the operand of the frame below
+            while True:
+                frame = frames[-1]
+                while frame.prefixes:
+                    node = UnaryOpNode(frame.prefixes.pop(), node)
+                frame.operands.append(node)
                 op_tok = self.current_tok
+                if op_tok.type in BINARY_PRECEDENCE:
+                    frame.reduce(BINARY_PRECEDENCE[op_tok.type], op_tok.type in RIGHT_ASSOCIATIVE)
+                    frame.operators.append(op_tok)
+                    self.advance()
+                    break
+                frame.reduce(0, False)
+                node = frame.operands.pop()
+                if frame.open_tok is None:
+                    return node
+                if frame.open_tok.type == LPAREN:
+                    if self.current_tok.type != RPAREN:
+                        raise ValueError('Expected )')
+                    self.advance()
+                    frames.pop()
+                    node = self.postfix(node)
+                    continue
+                frame.arg_nodes.append(node)
+                if self.current_tok.type == COMMA:
+                    self.advance()
+                    break
+                if self.current_tok.type != RPAREN:
+                    raise ValueError('Expected ) after function arguments')
                 self.advance()
-                node = UnaryOpNode(op_tok, node)
-            return node
+                frames.pop()
+                node = FuncCallNode(frame.open_tok, frame.arg_nodes)
+
+    def postfix(self, node):
+        while self.current_tok.type == FACTORIAL:
+            op_tok = self.current_tok
+            self.advance()
+            node = UnaryOpNode(op_tok, node)
+        return node
+
+# Binary operators by precedence; ^ groups to the right, the rest to the left
+BINARY_PRECEDENCE = {PLUS: 1, MINUS: 1, MULTIPLY: 2, DIVIDE: 2, MODULO: 2, EXPONENT: 3}
+RIGHT_ASSOCIATIVE = (EXPONENT,)
+
+class ParseFrame:
+    # An expression being read by Parser.expression: at top level (open_tok
+    # None), inside a parenthesis, or as an argument of a function call,
+    # whose finished arguments collect in arg_nodes
+    __slots__ = ('open_tok', 'arg_nodes', 'operands', 'operators', 'prefixes')
+
+    def __init__(self, open_tok):
+        self.open_tok = open_tok
+        self.arg_nodes = []
+        self.operands = []
+        self.operators = []
+        self.prefixes = []
+
+    def reduce(self, precedence, right_associative):
+        # Combine pending operators that bind at least as tightly as an
+        # operator of the given precedence (more tightly, if it is
+        # right-associative)
+        operators = self.operators
+        operands = self.operands
+        while operators:
+            top = BINARY_PRECEDENCE[operators[-1].type]
+            if top < precedence or (top == precedence and right_associative):
+                break
+            right_node = operands.pop()
+            operands[-1] = BinOpNode(operands[-1], operators.pop(), right_node)
+
+def is_integer(value):
+    return isinstance(value, BigRational) and value.denominator == ONE
+
+def takes_powmod(base, exponent, modulus):
+    # Whether a ^ b % m runs as powmod(a, b, m): a and m are integers and b
+    # is a non-negative integer
+    return is_powmod_power(base, exponent) and is_integer(modulus)
+
+def is_powmod_power(base, exponent):
+    # Whether a ^ b may run as powmod(a, b, m), depending on m
+    return is_integer(base) and is_integer(exponent) and exponent.numerator.sign == 1
+
+# Shared subexpressions. hash_cons turns a tree into a DAG in which
+# structurally equal subtrees are a single node object, by looking each node
+# up under its kind, its operator or value and its already shared operands.
+# The compiler evaluates a node that is used more than once a single time.
+# For an Evaluator with a SubexpressionMemo, nodes also get canonical digests
+# built from the same parts and the digests of their operands, so equal
+# subtrees get equal digests in any expression; the values of factorials,
+# powers and function calls are kept in the memo between expressions, keyed
+# by their digest.
+DIGEST_SIZE = 16
+
+def hash_cons(node, with_digests=False):
+    # Returns (root, uses, digests): the DAG for node, how many times each of
+    # its nodes is an operand, and the digest of each node (None unless
+    # with_digests is set)
+    # Nodes in postorder: the reverse of a preorder that takes the operands
+    # right to left
+    order = []
+    pending = [node]
+    while pending:
+        item = pending.pop()
+        order.append(item)
+        pending.extend(node_children(item))
+    order.reverse()
+    shared = {}  # node -> its shared node
+    canonical = {}  # key -> shared node
+    uses = {}
+    digests = {} if with_digests else None
+    for item in order:
+        node_type = type(item)
+        if node_type is BinOpNode:
+            left, right = shared[item.left_node], shared[item.right_node]
+            operands = (left, right)
+            label = ('B', item.op_tok.type)
+            key = (label, left, right)
+            changed = left is not item.left_node or right is not item.right_node
+        elif node_type is NumberNode:
+            operands = ()
+            label = key = ('N', item.value.sign, item.value.limbs.tobytes())
+            changed = False
         else:
-            raise ValueError('Expected number, identifier, or (')
+            children = node_children(item)
+            operands = tuple(shared[child] for child in children)
+            label = node_label(item)
+            key = (label, *operands)
+            changed = any(operand is not child for operand, child in zip(operands, children))
+        result = canonical.get(key)
+        if result is None:
+            result = canonical[key] = rebuild_node(item, operands) if changed else item
+            uses[result] = 0
+            for operand in operands:
+                uses[operand] += 1
+            if with_digests:
+                data = repr(label).encode('utf-8') + b''.join(digests[operand] for operand in operands)
+                digests[result] = hashlib.blake2b(data, digest_size=DIGEST_SIZE).digest()
+        shared[item] = result
+    return shared[node], uses, digests
+
+def node_label(node):
+    # What identifies node apart from its operands
+    if isinstance(node, NumberNode):
+        return ('N', node.value.sign, node.value.limbs.tobytes())
+    if isinstance(node, ConstantNode):
+        value = node.value
+        return ('C', value.numerator.sign, value.numerator.limbs.tobytes(), value.denominator.limbs.tobytes())
+    if isinstance(node, FuncCallNode):
+        # The arity is part of the label, so calls of one function with
+        # different numbers of operands never share a digest
+        return ('F', node.func_name_tok.value, len(node.arg_nodes))
+    if isinstance(node, UnaryOpNode):
+        return ('U', node.op_tok.type)
+    if isinstance(node, BinOpNode):
+        return ('B', node.op_tok.type)
+    raise Exception(f'Cannot evaluate {type(node).__name__}')
+
+def rebuild_node(node, operands):
+    # A copy of node with new operands
+    if isinstance(node, UnaryOpNode):
+        return UnaryOpNode(node.op_tok, operands[0])
+    if isinstance(node, BinOpNode):
+        return BinOpNode(operands[0], node.op_tok, operands[1])
+    return FuncCallNode(node.func_name_tok, operands)
+
+def is_memoizable(node):
+    # The operations whose values are worth keeping between expressions
+    if isinstance(node, UnaryOpNode):
+        return node.op_tok.type == FACTORIAL
+    if isinstance(node, BinOpNode):
+        return node.op_tok.type == EXPONENT or (node.op_tok.type == MODULO and is_power(node.left_node))
+    return isinstance(node, FuncCallNode)
+
+def value_nbytes(value):
+    # Approximate memory taken by a BigRational
+    return 200 + 4 * (len(value.numerator.limbs) + len(value.denominator.limbs))
+
+class SubexpressionMemo:
+    # Values of subexpressions keyed by digest, dropping the least recently
+    # used ones once their total size passes max_bytes
+    def __init__(self, max_bytes=64 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()  # digest -> (value, size)
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def get(self, digest):
+        entry = self.entries.get(digest)
+        if entry is None:
+            self.misses += 1
+            return None
+        self.entries.move_to_end(digest)
+        self.hits += 1
+        return entry[0]
+
+    def put(self, digest, value):
+        size = value_nbytes(value)
+        if size > self.max_bytes:
+            return
+        old = self.entries.pop(digest, None)
+        if old is not None:
+            self.nbytes -= old[1]
+        self.entries[digest] = (value, size)
+        self.nbytes += size
+        while self.nbytes > self.max_bytes:
+            _, (_, evicted) = self.entries.popitem(last=False)
+            self.nbytes -= evicted
+
+    def clear(self):
+        self.entries.clear()
+        self.nbytes = 0
+
+# Compiled code is a tuple of (opcode, argument) pairs in postfix order.
+# PUSH_VALUE pushes a ready-made value; the APPLY opcodes replace the top one
+# or two values with the result of a pre-bound function; CALL_FUNCTION
+# takes a (name, count) pair and looks the function up when it runs.
+# STORE_VALUE copies the top value into a numbered slot and LOAD_VALUE pushes
+# it again, for subexpressions used more than once; STORE_MEMO records the
+# top value in the evaluator's memo under a digest
+PUSH_VALUE = 'PUSH_VALUE'
+APPLY_UNARY = 'APPLY_UNARY'
+APPLY_BINARY = 'APPLY_BINARY'
+CALL_FUNCTION = 'CALL_FUNCTION'
+STORE_VALUE = 'STORE_VALUE'
+LOAD_VALUE = 'LOAD_VALUE'
+STORE_MEMO = 'STORE_MEMO'
+
+class PendingPower(Frozen):
+    # The base and exponent of a ^ b % m on the operand stack while m is
+    # evaluated, for a power that may yet run as powmod(a, b, m)
+    __slots__ = ('base', 'exponent')
+
+    def __init__(self, base, exponent):
+        object.__setattr__(self, 'base', base)
+        object.__setattr__(self, 'exponent', exponent)
+
+class CompiledExpression(Frozen):
+    # Returned by Evaluator.compile; calling it evaluates the expression
+    __slots__ = ('code', 'evaluator')
+
+    def __init__(self, code, evaluator):
+        object.__setattr__(self, 'code', code)
+        object.__setattr__(self, 'evaluator', evaluator)
+
+    def __reduce__(self):
+        return CompiledExpression, (self.code, self.evaluator)
+
+    def __call__(self):
+        return self.evaluator.run(self.code)
 
 class Evaluator:
-    def __init__(self):
+    def __init__(self, lazy=False, memo=None):
+        # With lazy=True numbers are lazy BigRationals, so a long chain of
+        # operations defers its GCDs until the result is observed. memo is an
+        # optional SubexpressionMemo, which may be shared between evaluators
+        self.lazy = lazy
+        self.memo = memo
         # You can add built-in functions here
         self.functions = {
             'log': self.func_log,
             'ln': self.func_ln,
             'sqrt': self.func_sqrt,
-            'abs': self.func_abs
+            'abs': self.func_abs,
+            'dfact': self.func_dfact,
+            'powmod': self.func_powmod,
+            'modinv': self.func_modinv,
+            'ffact': self.func_ffact
+        }
+        self.unary_operations = {
+            MINUS: operator.neg,
+            FACTORIAL: self.factorial
+        }
+        self.binary_operations = {
+            PLUS: operator.add,
+            MINUS: operator.sub,
+            MULTIPLY: operator.mul,
+            DIVIDE: operator.truediv,
+            MODULO: self.modulo,
+            EXPONENT: self.power
         }
     
-    def visit(self, node):
-        method_name = 'visit_' + type(node).__name__
-        method = getattr(self, method_name, self.no_visit_method)
-        return method(node)
-        
-    def no_visit_method(self, node):
-        raise Exception(f'No visit_{type(node).__name__} method')
-
-    def visit_NumberNode(self, node):
-        return BigRational(node.value)
+    def compile(self, expr):
+        # Compile expression text or a parsed AST once into a callable that
+        # can be run any number of times
+        if isinstance(expr, str):
+            expr = Parser(tokenize(expr)).parse()
+        code = []
+        self.compile_into(expr, code)
+        return CompiledExpression(tuple(code), self)
 
-    def visit_UnaryOpNode(self, node):
-        op_type = node.op_tok.type
-        number = self.visit(node.node)
-        if op_type == PLUS:
-            return number
-        elif op_type == MINUS:
-            return -number
-        elif op_type == FACTORIAL:
-            if not isinstance(number, BigRational) or number.denominator != BigInteger('1'):
-                raise ValueError('Factorial is only defined for integers')
-            if number.numerator.sign == -1:
-                return BigRational(BigInteger('0'))
-            result = factorial_bigint(number.numerator)
-            return BigRational(result)
-            
-    def visit_BinOpNode(self, node):
-        left = self.visit(node.left_node)
-        right = self.visit(node.right_node)
-        op_type = node.op_tok.type
-        if op_type == PLUS:
-            return left + right
-        elif op_type == MINUS:
-            return left - right
-        elif op_type == MULTIPLY:
-            return left * right
-        elif op_type == DIVIDE:
-            return left / right
-        elif op_type == MODULO:
-            if not isinstance(left, BigRational) or left.denominator != BigInteger('1') or not isinstance(right, BigRational) or right.denominator != BigInteger('1'):
-                raise ValueError('Modulo is only defined for integers')
-            return BigRational(left.numerator % right.numerator)
-        elif op_type == EXPONENT:
-            if not isinstance(right, BigRational) or right.denominator != BigInteger('1'):
-                raise ValueError('Exponent must be an integer')
-            return left ** right.numerator
-            
-    def visit_FuncCallNode(self, node):
-        func_name = node.func_name_tok.value
-        arg_values = [self.visit(arg_node) for arg_node in node.arg_nodes]
+    def visit(self, node):
+        return self.compile(node)()
+
+    def compile_into(self, node, code):
+        # Append the postfix code for node. The DAG of node is walked with an
+        # explicit stack holding nodes still to expand and instructions
+        # waiting for their operands, so depth costs no Python recursion.
+        # A node is expanded once; later uses repeat its value. Instructions
+        # among the children run between the operands around them
+        memo = self.memo
+        root, uses, digests = hash_cons(node, memo is not None)
+        repeat = {}  # node -> instruction that pushes its value again
+        pending = [root]
+        while pending:
+            item = pending.pop()
+            if isinstance(item, tuple):
+                code.append(item)
+                continue
+            instruction = repeat.get(item)
+            if instruction is not None:
+                code.append(instruction)
+                continue
+            memoizable = memo is not None and is_memoizable(item)
+            value = memo.get(digests[item]) if memoizable else None
+            if value is not None:
+                children, instruction = (), (PUSH_VALUE, value)
+            else:
+                children, instruction = self.node_operation(item)
+            if not children:
+                repeat[item] = instruction
+            elif uses[item] > 1:
+                repeat[item] = (LOAD_VALUE, len(repeat))
+                pending.append((STORE_VALUE, repeat[item][1]))
+            if memoizable and children:
+                pending.append((STORE_MEMO, digests[item]))
+            if instruction is not None:
+                pending.append(instruction)
+            pending.extend(reversed(children))
+
+    def node_operation(self, node):
+        # The operand nodes of node and the instruction that combines them;
+        # literals become ready-made values
+        if isinstance(node, NumberNode):
+            return (), (PUSH_VALUE, BigRational(node.value, lazy=self.lazy))
+        elif isinstance(node, ConstantNode):
+            return (), (PUSH_VALUE, node.value)
+        elif isinstance(node, UnaryOpNode):
+            op_type = node.op_tok.type
+            if op_type == PLUS:
+                return (node.node,), None
+            return (node.node,), (APPLY_UNARY, self.unary_operations[op_type])
+        elif isinstance(node, BinOpNode):
+            op_type = node.op_tok.type
+            left_node = node.left_node
+            if op_type == MODULO and isinstance(left_node, BinOpNode) and left_node.op_tok.type == EXPONENT:
+                children = (left_node.left_node, left_node.right_node, (APPLY_BINARY, self.start_power_modulo), node.right_node)
+                return children, (APPLY_BINARY, self.power_modulo)
+            return (left_node, node.right_node), (APPLY_BINARY, self.binary_operations[op_type])
+        elif isinstance(node, FuncCallNode):
+            return node.arg_nodes, (CALL_FUNCTION, (node.func_name_tok.value, len(node.arg_nodes)))
+        else:
+            raise Exception(f'Cannot evaluate {type(node).__name__}')
+
+    def run(self, code):
+        # Execute compiled code on an explicit operand stack
+        stack = []
+        push = stack.append
+        pop = stack.pop
+        slots = {}
+        for opcode, argument in code:
+            if opcode == PUSH_VALUE:
+                push(argument)
+            elif opcode == APPLY_BINARY:
+                right = pop()
+                stack[-1] = argument(stack[-1], right)
+            elif opcode == APPLY_UNARY:
+                stack[-1] = argument(stack[-1])
+            elif opcode == LOAD_VALUE:
+                push(slots[argument])
+            elif opcode == STORE_VALUE:
+                slots[argument] = stack[-1]
+            elif opcode == STORE_MEMO:
+                self.memo.put(argument, stack[-1])
+            else:
+                func_name, count = argument
+                start = len(stack) - count
+                arg_values = stack[start:]
+                del stack[start:]
+                push(self.call_function(func_name, arg_values))
+        return stack[0]
+
+    def call_function(self, func_name, arg_values):
         if func_name in self.functions:
             return self.functions[func_name](arg_values)
         else:
             raise ValueError(f'Unknown function {func_name}')
 
+    def factorial(self, number):
+        if not isinstance(number, BigRational) or number.denominator != ONE:
+            raise ValueError('Factorial is only defined for integers')
+        if number.numerator.sign == -1:
+            return BigRational(ZERO)
+        result = factorial_bigint(number.numerator)
+        return BigRational(result)
+
+    def modulo(self, left, right):
+        if not isinstance(left, BigRational) or left.denominator != ONE or not isinstance(right, BigRational) or right.denominator != ONE:
+            raise ValueError('Modulo is only defined for integers')
+        return BigRational(left.numerator % right.numerator)
+
+    def power(self, left, right):
+        if not isinstance(right, BigRational) or right.denominator != ONE:
+            raise ValueError('Exponent must be an integer')
+        return left ** right.numerator
+
+    def start_power_modulo(self, base, exponent):
+        # a ^ b % m runs as powmod(a, b, m) when a and m are integers and b is
+        # a non-negative integer, so a^b is never built. Any other power is
+        # computed before m is evaluated, so its errors come first as they
+        # would for (a ^ b) % m
+        if is_powmod_power(base, exponent):
+            return PendingPower(base, exponent)
+        return self.power(base, exponent)
+
+    def power_modulo(self, power, modulus):
+        if isinstance(power, PendingPower):
+            if is_integer(modulus):
+                return BigRational(powmod(power.base.numerator, power.exponent.numerator, modulus.numerator))
+            power = self.power(power.base, power.exponent)
+        return self.modulo(power, modulus)
+
     def func_abs(self, args):
         if len(args) != 1:
             raise ValueError('abs() takes exactly one argument')
         return abs(args[0])
 
-    def func_sqrt(self, args):
+    def func_dfact(self, args):
         if len(args) != 1:
-            raise ValueError('sqrt() takes exactly one argument')
+            raise ValueError('dfact() takes exactly one argument')
+        x = args[0]
+        if x.denominator != ONE:
+            raise ValueError('Double factorial is only defined for integers')
+        return BigRational(double_factorial_bigint(x.numerator))
+
+    def func_ffact(self, args):
+        # ffact(x, k) = x * (x - 1) * ... * (x - k + 1), the falling factorial
+        if len(args) != 2:
+            raise ValueError('ffact() takes exactly two arguments')
+        x, k = args
+        if not (is_integer(x) and is_integer(k)) or k.numerator.sign == -1:
+            raise ValueError('ffact(x, k) is only defined for integers x and k >= 0')
+        return BigRational(falling_factorial_bigint(x.numerator, int(k.numerator)))
+
+    def func_powmod(self, args):
+        # powmod(a, b, m) = a^b % m; a negative b raises the inverse of a
+        if len(args) != 3:
+            raise ValueError('powmod() takes exactly three arguments')
+        if not all(is_integer(x) for x in args):
+            raise ValueError('powmod() is only defined for integers')
+        return BigRational(powmod(*[x.numerator for x in args]))
+
+    def func_modinv(self, args):
+        # modinv(a, m): x in [0, |m|) with a*x = 1 (mod m)
+        if len(args) != 2:
+            raise ValueError('modinv() takes exactly two arguments')
+        if not all(is_integer(x) for x in args):
+            raise ValueError('modinv() is only defined for integers')
+        return BigRational(modinv(args[0].numerator, args[1].numerator))
+
+    def func_sqrt(self, args):
+        # sqrt(x) or sqrt(x, places): exact for squares of rationals, otherwise
+        # rounded to places digits after the point (50 by default)
+        if len(args) not in (1, 2):
+            raise ValueError('sqrt() takes one or two arguments')
         x = args[0]
-        if x < BigRational(BigInteger('0')):
+        if x < BigRational(ZERO):
             raise ValueError('sqrt(x) is undefined for x < 0')
-        # Simple approximation for square root
-        # Using Newton's method: x_{n+1} = (x_n + a/x_n) / 2
-        if x == BigRational(BigInteger('0')):
-            return BigRational(BigInteger('0'))
-        
-        # Convert to decimal for approximation
-        decimal_str = x.to_decimal(50)
-        try:
-            import decimal
-            decimal.getcontext().prec = 50
-            x_decimal = decimal.Decimal(decimal_str.split('(')[0])  # Remove repeating part
-            sqrt_decimal = x_decimal.sqrt()
-            # Convert back to rational approximation
-            sqrt_str = str(sqrt_decimal)
-            if '.' in sqrt_str:
-                parts = sqrt_str.split('.')
-                integer_part = parts[0]
-                decimal_part = parts[1]
-                numerator = BigInteger(integer_part + decimal_part)
-                denominator = pow_bigint(BigInteger('10'), BigInteger(str(len(decimal_part))))
-                return BigRational(numerator, denominator)
-            else:
-                return BigRational(BigInteger(sqrt_str))
-        except ImportError:
-            # Fallback to simple approximation
-            return BigRational(BigInteger('1'))  # Placeholder
+        if len(args) == 1:
+            return x.sqrt()
+        return x.sqrt(self.precision_argument('sqrt', args[1]))
 
     def func_ln(self, args):
-        if len(args) != 1:
-            raise ValueError('ln() takes exactly one argument')
+        # ln(x) or ln(x, places), rounded to places digits (10 by default)
+        if len(args) not in (1, 2):
+            raise ValueError('ln() takes one or two arguments')
         x = args[0]
-        if x <= BigRational(BigInteger('0')):
+        if x <= BigRational(ZERO):
             raise ValueError('ln(x) is undefined for x <= 0')
-        
-        # Simple approximation using series expansion
-        # ln(1+x) = x - x^2/2 + x^3/3 - x^4/4 + ...
-        # This is a placeholder implementation
-        decimal_str = x.to_decimal(20)
-        try:
-            import math
-            x_float = float(decimal_str.split('(')[0])  # Remove repeating part
-            ln_result = math.log(x_float)
-            # Convert back to rational approximation
-            ln_str = f"{ln_result:.10f}"
-            if '.' in ln_str:
-                parts = ln_str.split('.')
-                integer_part = parts[0]
-                decimal_part = parts[1]
-                if integer_part.startswith('-'):
-                    sign = -1
-                    integer_part = integer_part[1:]
-                else:
-                    sign = 1
-                numerator = BigInteger(integer_part + decimal_part) * BigInteger(str(sign))
-                denominator = pow_bigint(BigInteger('10'), BigInteger(str(len(decimal_part))))
-                return BigRational(numerator, denominator)
-            else:
-                return BigRational(BigInteger(ln_str))
-        except (ImportError, ValueError):
-            # Fallback
-            return BigRational(BigInteger('0'))
+        if len(args) == 1:
+            return x.ln()
+        return x.ln(self.precision_argument('ln', args[1]))
 
     def func_log(self, args):
-        if len(args) != 1:
-            raise ValueError('log() takes exactly one argument')
+        # log(x) or log(x, places): base-10 logarithm, costing one ln(x)
+        if len(args) not in (1, 2):
+            raise ValueError('log() takes one or two arguments')
         x = args[0]
-        if x <= BigRational(BigInteger('0')):
+        if x <= BigRational(ZERO):
             raise ValueError('log(x) is undefined for x <= 0')
-        
-        # log10(x) = ln(x) / ln(10)
-        ln_x = self.func_ln([x])
-        ln_10 = self.func_ln([BigRational(BigInteger('10'))])
-        return ln_x / ln_10
+        if len(args) == 1:
+            return x.log10()
+        return x.log10(self.precision_argument('log', args[1]))
+
+    def precision_argument(self, name, places):
+        if places.denominator != ONE or places.numerator.sign == -1:
+            raise ValueError(f'{name}() precision must be a non-negative integer')
+        return int(places.numerator)
+
+# Optimization. The Optimizer rewrites a parsed tree into one that evaluates
+# to the same value with less work. Constant subtrees are folded into
+# ConstantNodes as long as their value stays below FOLD_DIGITS digits (and
+# factorials up to FOLD_FACTORIAL), or lower limits given to the Optimizer;
+# a subtree whose evaluation fails is left alone, so its error surfaces in
+# evaluation order. The rewrites are exact:
+#   n! / m!         -> ffact(n, n - m), or 1 / ffact(m, m - n)
+#   x^a * x^b       -> x^(a + b)
+#   x^a / x^b       -> x^(a - b)           (x a non-zero constant)
+#   (x^a)^b         -> x^(a * b)
+# for integer constants a, b, m and n; the power rules need a and b
+# non-negative unless x is a non-zero constant. a ^ b % m is not rewritten,
+# since the evaluator already runs it as powmod(a, b, m).
+FOLD_DIGITS = 10000
+FOLD_FACTORIAL = 2000
+
+class Optimizer:
+    def __init__(self, evaluator=None, fold_digits=FOLD_DIGITS, fold_factorial=FOLD_FACTORIAL):
+        # Folding uses the evaluator's operations and laziness
+        self.evaluator = evaluator if evaluator is not None else Evaluator()
+        self.fold_digits = fold_digits
+        self.fold_factorial = fold_factorial
+        self.notes = []
+
+    def optimize(self, node):
+        # Returns the optimized tree; self.notes describes what was rewritten
+        self.notes = []
+        self.folded = 0
+        # Identical subtrees are shared first, and each shared node is
+        # optimized once, so a repeated constant is folded only once
+        node, _, _ = hash_cons(node)
+        done = {}  # node -> its optimized form
+        # Bottom-up with explicit stacks: a node is rebuilt once the
+        # optimized forms of its children are on the results stack
+        results = []
+        pending = [(node, False)]
+        while pending:
+            item, ready = pending.pop()
+            if not ready and item in done:
+                results.append(done[item])
+                continue
+            children = node_children(item)
+            if not ready and children:
+                pending.append((item, True))
+                pending.extend((child, False) for child in reversed(children))
+                continue
+            if children:
+                optimized = results[len(results) - len(children):]
+                del results[len(results) - len(children):]
+            else:
+                optimized = []
+            done[item] = self.optimize_node(item, optimized)
+            results.append(done[item])
+        if self.folded:
+            self.notes.append(f'{self.folded} constant subexpression(s) folded')
+        return results[0]
+
+    def explain(self, node):
+        # The optimized tree as an expression, followed by what was done
+        optimized = self.optimize(node)
+        lines = [f'Input:     {format_expression(node)}', f'Optimized: {format_expression(optimized)}']
+        lines.extend(f'  {note}' for note in self.notes)
+        return '\n'.join(lines)
+
+    def optimize_node(self, node, children):
+        # node with its children replaced by their optimized forms
+        if isinstance(node, NumberNode):
+            return ConstantNode(BigRational(node.value, lazy=self.evaluator.lazy))
+        if isinstance(node, UnaryOpNode):
+            if node.op_tok.type == PLUS:
+                return children[0]
+            node = UnaryOpNode(node.op_tok, children[0])
+        elif isinstance(node, BinOpNode):
+            node = self.rewrite(BinOpNode(children[0], node.op_tok, children[1]))
+        elif isinstance(node, FuncCallNode):
+            return FuncCallNode(node.func_name_tok, children)
+        else:
+            return node
+        return self.fold(node)
+
+    def rewrite(self, node):
+        op_type = node.op_tok.type
+        left, right = node.left_node, node.right_node
+        if op_type == DIVIDE and is_factorial_of_constant(left) and is_factorial_of_constant(right):
+            n = int(left.node.value.numerator)
+            m = int(right.node.value.numerator)
+            if n >= 0 and m >= 0:
+                self.notes.append(f'{note_integer(n)}! / {note_integer(m)}! computed as a falling product of {note_integer(abs(n - m))} factors')
+                if n >= m:
+                    return falling_factorial_node(n, n - m)
+                return BinOpNode(constant_node(1), OPERATOR_TOKENS['/'], falling_factorial_node(m, m - n))
+        if op_type in (MULTIPLY, DIVIDE) and is_power(left) and is_power(right) and same_tree(left.left_node, right.left_node):
+            base = left.left_node
+            a, b = integer_constant(left.right_node), integer_constant(right.right_node)
+            if a is not None and b is not None:
+                nonzero_base = is_nonzero_constant(base)
+                if op_type == MULTIPLY and (nonzero_base or (a >= 0 and b >= 0)):
+                    self.notes.append(f'x^{note_integer(a)} * x^{note_integer(b)} computed as x^{note_integer(a + b)}')
+                    return self.fold(BinOpNode(base, OPERATOR_TOKENS['^'], constant_node(a + b)))
+                if op_type == DIVIDE and nonzero_base:
+                    self.notes.append(f'x^{note_integer(a)} / x^{note_integer(b)} computed as x^{note_integer(a - b)}')
+                    return self.fold(BinOpNode(base, OPERATOR_TOKENS['^'], constant_node(a - b)))
+        if op_type == EXPONENT and is_power(left):
+            a, b = integer_constant(left.right_node), integer_constant(right)
+            if a is not None and b is not None and (is_nonzero_constant(left.left_node) or (a >= 0 and b >= 0)):
+                self.notes.append(f'(x^{note_integer(a)})^{note_integer(b)} computed once as x^{note_integer(a * b)}')
+                return self.fold(BinOpNode(left.left_node, OPERATOR_TOKENS['^'], constant_node(a * b)))
+        if op_type == MODULO and is_power(left):
+            operands = (left.left_node, left.right_node, right)
+            if not all(isinstance(operand, ConstantNode) for operand in operands):
+                self.notes.append('a ^ b % m evaluated as powmod(a, b, m) if a, b and m are integers and b >= 0')
+            elif takes_powmod(*(operand.value for operand in operands)):
+                self.notes.append('a ^ b % m evaluated as powmod(a, b, m)')
+        return node
+
+    def fold(self, node):
+        # A ConstantNode for node if its operands are constants and its value
+        # is cheap to compute now; otherwise node itself
+        if isinstance(node, UnaryOpNode):
+            if not isinstance(node.node, ConstantNode):
+                return node
+            value = node.node.value
+            if node.op_tok.type == FACTORIAL:
+                n = integer_constant(node.node)
+                if n is None or n > self.fold_factorial:
+                    return node
+                operation = lambda: self.evaluator.factorial(value)
+            else:
+                operation = lambda: self.evaluator.unary_operations[node.op_tok.type](value)
+        elif isinstance(node, BinOpNode):
+            if not (isinstance(node.left_node, ConstantNode) and isinstance(node.right_node, ConstantNode)):
+                return node
+            left, right = node.left_node.value, node.right_node.value
+            op_type = node.op_tok.type
+            if op_type == EXPONENT:
+                exponent = integer_constant(node.right_node)
+                if exponent is None or value_digits(left) * abs(exponent) > self.fold_digits:
+                    return node
+            elif value_digits(left) + value_digits(right) > self.fold_digits:
+                return node
+            operation = lambda: self.evaluator.binary_operations[op_type](left, right)
+        else:
+            return node
+        try:
+            value = operation()
+        except TimeoutError:
+            raise
+        except Exception:
+            return node
+        self.folded += 1
+        return ConstantNode(value)
+
+def node_children(node):
+    if isinstance(node, UnaryOpNode):
+        return (node.node,)
+    if isinstance(node, BinOpNode):
+        return (node.left_node, node.right_node)
+    if isinstance(node, FuncCallNode):
+        return node.arg_nodes
+    return ()
+
+# Integers in rewrite notes are written out up to NOTE_DIGITS digits; longer
+# ones (which str() may refuse) are given by their number of digits
+NOTE_DIGITS = 30
+
+def note_integer(n):
+    if -10 ** NOTE_DIGITS < n < 10 ** NOTE_DIGITS:
+        return str(n)
+    # floor(bits * log10(2)) is the number of digits or one less
+    digits = int(abs(n).bit_length() * math.log10(2))
+    if abs(n) >= 10 ** digits:
+        digits += 1
+    return f'<{digits}-digit integer>'
+
+def constant_node(n):
+    return ConstantNode(BigRational(BigInteger._from_int(n)))
+
+def falling_factorial_node(n, k):
+    return FuncCallNode(Token(IDENTIFIER, 'ffact'), [constant_node(n), constant_node(k)])
+
+def integer_constant(node):
+    # The value of an integer ConstantNode as a machine integer, else None
+    if isinstance(node, ConstantNode) and node.value.denominator == ONE:
+        return int(node.value.numerator)
+    return None
+
+def is_nonzero_constant(node):
+    return isinstance(node, ConstantNode) and bool(node.value.numerator.limbs)
+
+def is_power(node):
+    return isinstance(node, BinOpNode) and node.op_tok.type == EXPONENT
+
+def is_factorial_of_constant(node):
+    return (isinstance(node, UnaryOpNode) and node.op_tok.type == FACTORIAL
+            and integer_constant(node.node) is not None)
+
+def value_digits(value):
+    # Decimal length of the larger of numerator and denominator
+    return max(len(value.numerator.limbs), len(value.denominator.limbs), 1) * BASE_DIGITS
+
+def same_tree(node1, node2):
+    # Structural equality of two trees, compared without recursion
+    pairs = [(node1, node2)]
+    while pairs:
+        a, b = pairs.pop()
+        if type(a) is not type(b):
+            return False
+        if isinstance(a, (NumberNode, ConstantNode)):
+            if a.value != b.value:
+                return False
+            continue
+        if isinstance(a, FuncCallNode):
+            if a.func_name_tok != b.func_name_tok:
+                return False
+        elif a.op_tok != b.op_tok:
+            return False
+        children1, children2 = node_children(a), node_children(b)
+        if len(children1) != len(children2):
+            return False
+        pairs.extend(zip(children1, children2))
+    return True
+
+def format_expression(node):
+    # Expression text for a tree; operands that are themselves operations
+    # are parenthesized, so the grouping is explicit
+    results = []
+    pending = [(node, False)]
+    while pending:
+        item, ready = pending.pop()
+        children = node_children(item)
+        if not ready and children:
+            pending.append((item, True))
+            pending.extend((child, False) for child in reversed(children))
+            continue
+        parts = results[len(results) - len(children):] if children else []
+        if children:
+            del results[len(results) - len(children):]
+        if isinstance(item, NumberNode):
+            text = str(item.value)
+        elif isinstance(item, ConstantNode):
+            text = item.value.to_fraction_string()
+            if item.value.denominator != ONE or item.value.numerator.sign == -1:
+                text = f'({text})'
+        elif isinstance(item, FuncCallNode):
+            text = f"{item.func_name_tok.value}({', '.join(parts)})"
+        else:
+            parts = [f'({part})' if isinstance(child, (BinOpNode, UnaryOpNode)) else part
+                     for part, child in zip(parts, children)]
+            if isinstance(item, BinOpNode):
+                symbol = {PLUS: '+', MINUS: '-', MULTIPLY: '*', DIVIDE: '/', MODULO: '%', EXPONENT: '^'}[item.op_tok.type]
+                text = f'{parts[0]} {symbol} {parts[1]}'
+            elif item.op_tok.type == FACTORIAL:
+                text = f'{parts[0]}!'
+            else:
+                text = ('-' if item.op_tok.type == MINUS else '+') + parts[0]
+        results.append(text)
+    return results[0]
+
+# Cost estimation. estimate_cost walks a tree before it is evaluated and
+# predicts from the operand sizes alone the digits of the largest value it
+# builds, the memory that takes and the time it runs: a^b has about
+# b * log10(a) digits, n! about n * log10(n / e), and so on. Times follow a
+# model of the kernels without NumPy: a product of L limbs costs
+# MULTIPLY_SECONDS * L^2 below the fast tiers and NTT_SECONDS * L * log2(L)
+# past them, and a GCD GCD_SECONDS * L^2. The figures are good to a small
+# factor. Integers of up to EXACT_DIGITS digits are tracked exactly, so
+# constant exponents and factorial arguments are known precisely, and so is
+# the sign of a value where it follows from its operands: a ^ b % m is only
+# costed as powmod when b is known to be non-negative.
+MULTIPLY_SECONDS = 2.3e-7
+NTT_SECONDS = 4.5e-6
+GCD_SECONDS = 4e-7
+BYTES_PER_LIMB = 40
+EXACT_DIGITS = 18
+
+class BudgetExceeded(ValueError):
+    pass
+
+class CostEstimate(Frozen):
+    __slots__ = ('digits', 'nbytes', 'seconds')
+
+    def __init__(self, digits, nbytes, seconds):
+        object.__setattr__(self, 'digits', digits)  # of the largest value
+        object.__setattr__(self, 'nbytes', nbytes)  # working memory at the peak
+        object.__setattr__(self, 'seconds', seconds)
+
+    def __reduce__(self):
+        return CostEstimate, (self.digits, self.nbytes, self.seconds)
+
+    def __repr__(self):
+        return f'CostEstimate(digits={self.digits:.3g}, nbytes={self.nbytes:.3g}, seconds={self.seconds:.3g})'
+
+    def check(self, max_digits=None, max_bytes=None, max_seconds=None):
+        # Raise BudgetExceeded if the estimate is over any of the budgets
+        if max_digits is not None and self.digits > max_digits:
+            raise BudgetExceeded(f'Expression too large: about {self.digits:.3g} digits (limit {max_digits:.3g})')
+        if max_bytes is not None and self.nbytes > max_bytes:
+            raise BudgetExceeded(f'Expression too large: about {self.nbytes:.3g} bytes of memory (limit {max_bytes:.3g})')
+        if max_seconds is not None and self.seconds > max_seconds:
+            raise BudgetExceeded(f'Expression too slow: about {self.seconds:.3g} s of work (limit {max_seconds:.3g} s)')
+
+def estimate_cost(node):
+    # CostEstimate for evaluating node; a subexpression that appears more
+    # than once is counted once, as the compiler evaluates it once
+    root, _, _ = hash_cons(node)
+    estimates = {}  # node -> (digits, integer, value, sign)
+    largest = 1
+    seconds = 0.0
+    pending = [(root, False)]
+    while pending:
+        item, ready = pending.pop()
+        if item in estimates:
+            continue
+        operands = estimate_operands(item)
+        if not ready and operands:
+            pending.append((item, True))
+            pending.extend((operand, False) for operand in reversed(operands))
+            continue
+        digits, integer, value, sign, cost = estimate_node(item, [estimates[operand] for operand in operands])
+        estimates[item] = (digits, integer, value, sign)
+        largest = max(largest, digits)
+        seconds += cost
+    return CostEstimate(largest, 3 * estimated_limbs(largest) * BYTES_PER_LIMB, seconds)
+
+def estimate_operands(node):
+    # The nodes evaluated as operands of node, as in Evaluator.node_operation
+    if isinstance(node, BinOpNode) and node.op_tok.type == MODULO and is_power(node.left_node):
+        return (node.left_node.left_node, node.left_node.right_node, node.right_node)
+    return node_children(node)
+
+def estimate_node(node, operands):
+    # (digits, integer, value, sign, seconds) for node given the (digits,
+    # integer, value, sign) of its operands. value is the exact integer when
+    # it is small; sign is 1 for a value known to be >= 0, -1 for one known
+    # to be negative and 0 if unknown. A fraction's digits are those of its
+    # numerator and denominator together
+    if isinstance(node, NumberNode):
+        if len(node.value.limbs) <= 2:
+            return exact_estimate(int(node.value))
+        return decimal_length(node.value.limbs), True, None, 1, 0.0
+    if isinstance(node, ConstantNode):
+        value = node.value
+        if value.denominator == ONE and len(value.numerator.limbs) <= 2:
+            return exact_estimate(int(value.numerator))
+        if value.denominator == ONE:
+            return decimal_length(value.numerator.limbs), True, None, value.numerator.sign, 0.0
+        digits = log10_estimate(value.numerator.limbs) + log10_estimate(value.denominator.limbs)
+        return digits, False, None, value.numerator.sign, 0.0
+    if isinstance(node, UnaryOpNode):
+        digits, integer, value, sign = operands[0]
+        if node.op_tok.type != FACTORIAL:
+            if node.op_tok.type == MINUS:
+                value = None if value is None else -value
+                sign = -sign
+            return digits, integer, value, sign, 0.0
+        if value is not None and value <= 20:
+            return exact_estimate(math.factorial(value) if value >= 0 else 0)
+        digits = factorial_digits(magnitude(digits, value))
+        return digits, True, None, 1, 2.5 * multiply_seconds(estimated_limbs(digits))
+    if isinstance(node, BinOpNode):
+        op_type = node.op_tok.type
+        if len(operands) == 3:
+            if is_fraction_constant(node.left_node.right_node):
+                return 1, False, None, 0, 0.0
+            return estimate_power_modulo(*operands)
+        if op_type == EXPONENT:
+            if is_fraction_constant(node.right_node):
+                # Evaluation reports the error at once
+                return 1, False, None, 0, 0.0
+            return estimate_power(operands[0], operands[1])
+        (digits1, integer1, value1, sign1), (digits2, integer2, value2, sign2) = operands
+        integer = integer1 and integer2
+        # Sums and products only take a sizeable GCD when both are fractions
+        fractions = not (integer1 or integer2)
+        if value1 is not None and value2 is not None:
+            exact = exact_binary(op_type, value1, value2)
+            if exact is not None:
+                return exact
+        limbs = estimated_limbs(max(digits1, digits2))
+        if fractions:
+            # Their numerators and denominators are each about half as long
+            limbs = estimated_limbs(max(digits1, digits2) / 2)
+        if op_type in (PLUS, MINUS):
+            if op_type == MINUS:
+                sign2 = -sign2
+            sign = sign1 if sign1 == sign2 else 0
+            if integer:
+                return max(digits1, digits2) + 1, True, None, sign, 1e-7 * limbs
+            return digits1 + digits2, False, None, sign, 3 * multiply_seconds(limbs) + (gcd_seconds(limbs) if fractions else 0)
+        if op_type == MULTIPLY:
+            cost = multiply_seconds(limbs) + (gcd_seconds(limbs) if fractions else 0)
+            return digits1 + digits2, integer, None, sign1 * sign2, cost
+        if op_type == DIVIDE:
+            if value1 is not None and value2:
+                # A small fraction, sized by its logarithm
+                digits = math.log10(max(abs(value1), 1)) + math.log10(abs(value2))
+                return digits, False, None, sign1 * sign2, 0.0
+            return digits1 + digits2, False, None, sign1 * sign2, 2 * multiply_seconds(limbs) + gcd_seconds(limbs)
+        # The remainder takes the sign of the dividend
+        return min(digits1, digits2), integer, None, sign1, 2 * multiply_seconds(limbs)
+    if isinstance(node, FuncCallNode):
+        return estimate_function(node.func_name_tok.value, operands)
+    raise Exception(f'Cannot evaluate {type(node).__name__}')
+
+def is_fraction_constant(node):
+    # A constant that is not an integer, which no exponent may be
+    return isinstance(node, ConstantNode) and node.value.denominator != ONE
+
+def estimate_power(base, exponent):
+    digits, integer, value, sign = base
+    exponent_digits, _, exponent_value, exponent_sign = exponent
+    if value is not None and exponent_value is not None and 0 <= exponent_value and exponent_value * decimal_digits_of(value) <= EXACT_DIGITS:
+        return exact_estimate(value ** exponent_value)
+    if exponent_value is not None and exponent_value % 2 == 0:
+        sign = 1
+    elif exponent_value is None and sign != 1:
+        sign = 0
+    if value is not None and abs(value) <= 1:
+        return 1, integer, None, sign, 0.0
+    size = abs(magnitude(exponent_digits, exponent_value))
+    digits = size * (math.log10(abs(value)) if value is not None else digits)
+    integer = integer and exponent_sign == 1
+    if value is not None and str(abs(value)).rstrip('0') == '1':
+        # A power of ten is a decimal shift
+        return max(digits, 1), integer, None, sign, 1e-7 * estimated_limbs(digits)
+    return max(digits, 1), integer, None, sign, multiply_seconds(estimated_limbs(digits))
+
+def estimate_power_modulo(base, exponent, modulus):
+    # a ^ b % m: powmod under the condition of takes_powmod, else the power
+    # itself; an exponent of unknown sign may be negative
+    exponent_digits, exponent_integer, _, exponent_sign = exponent
+    if base[1] and exponent_integer and modulus[1] and exponent_sign == 1:
+        return estimate_modular_power(exponent_digits, modulus[0])
+    # The power is built in full, so its digits count as the largest value
+    digits, integer, _, sign, cost = estimate_power(base, exponent)
+    return digits, integer, None, sign, cost + 2 * multiply_seconds(estimated_limbs(digits))
+
+def estimate_modular_power(exponent_digits, modulus_digits):
+    limbs = estimated_limbs(modulus_digits)
+    steps = 2 * 3.33 * exponent_digits
+    return modulus_digits, True, None, 0, steps * multiply_seconds(limbs) + gcd_seconds(limbs)
+
+def estimate_function(name, operands):
+    if not operands:
+        return 1, True, None, 0, 0.0
+    digits, integer, value, sign = operands[0]
+    if name in ('ln', 'log', 'sqrt'):
+        places = 50 if name == 'sqrt' else 10
+        if len(operands) > 1 and operands[1][2] is not None:
+            places = max(operands[1][2], 0)
+        if name == 'sqrt':
+            # The integer root of a number of about 2 * places + digits
+            # digits, and the division scaling it
+            limbs = estimated_limbs(2 * places + digits)
+            return places + digits / 2, False, None, 1, 4 * multiply_seconds(limbs) + 2 * multiply_seconds(estimated_limbs(digits))
+        # Binary splitting of the atanh series for each ratio
+        limbs = estimated_limbs(places)
+        cost = 2.5 * multiply_seconds(limbs) * math.log2(limbs + 1) ** 2 + 2 * multiply_seconds(estimated_limbs(digits))
+        return places + math.log10(digits + 1) + 1, False, None, 0, cost
+    if name == 'abs':
+        return digits, integer, None if value is None else abs(value), 1, 0.0
+    if name == 'dfact':
+        result = factorial_digits(magnitude(digits, value)) / 2
+        return max(result, 1), True, None, 1, 2.5 * multiply_seconds(estimated_limbs(result))
+    if name == 'ffact' and len(operands) == 2:
+        result = magnitude(operands[1][0], operands[1][2]) * digits
+        return max(result, 1), True, None, 0, 2.5 * multiply_seconds(estimated_limbs(result))
+    if name == 'powmod' and len(operands) == 3:
+        return estimate_modular_power(operands[1][0], operands[2][0])
+    if name == 'modinv' and len(operands) == 2:
+        return operands[1][0], True, None, 0, gcd_seconds(estimated_limbs(max(digits, operands[1][0])))
+    return max(operand[0] for operand in operands), False, None, 0, 0.0
+
+def exact_binary(op_type, value1, value2):
+    # Estimate for an operation on two small integers, computed exactly, or
+    # None if the result is not a small integer
+    if op_type == PLUS:
+        return exact_estimate(value1 + value2)
+    if op_type == MINUS:
+        return exact_estimate(value1 - value2)
+    if op_type == MULTIPLY:
+        return exact_estimate(value1 * value2)
+    if op_type == DIVIDE and value2 and not value1 % value2:
+        return exact_estimate(value1 // value2)
+    if op_type == MODULO and value2:
+        # Truncated, as BigRational's %: the sign follows the dividend
+        remainder = abs(value1) % abs(value2)
+        return exact_estimate(-remainder if value1 < 0 else remainder)
+    return None
+
+def exact_estimate(value):
+    sign = 1 if value >= 0 else -1
+    if decimal_digits_of(value) > EXACT_DIGITS:
+        return decimal_digits_of(value), True, None, sign, 0.0
+    return decimal_digits_of(value), True, value, sign, 0.0
+
+def decimal_digits_of(value):
+    return len(str(abs(value)))
+
+def magnitude(digits, value):
+    # The size of a value, exactly if known, else from its digits
+    if value is not None:
+        return value
+    return 10.0 ** digits if digits < 300 else math.inf
+
+def factorial_digits(n):
+    # Digits of n! by Stirling's formula
+    if n < 2:
+        return 1
+    if n == math.inf:
+        return math.inf
+    return n * math.log10(n / math.e) + 0.5 * math.log10(2 * math.pi * n) + 1
+
+def estimated_limbs(digits):
+    return digits / BASE_DIGITS + 1
+
+def multiply_seconds(limbs):
+    if limbs == math.inf:
+        return math.inf
+    return min(MULTIPLY_SECONDS * limbs * limbs, NTT_SECONDS * limbs * math.log2(max(limbs, 2)))
+
+def gcd_seconds(limbs):
+    return GCD_SECONDS * limbs * limbs
 
 def repl():
     print("Arbitrary-Precision Calculator with Fractions and Logarithms")
-    print("Supports +, -, *, /, %, ^, !, ln(), log(), sqrt(), abs(), and parentheses")
+    print("Supports +, -, *, /, %, ^, !, ln(), log(), sqrt(), abs(), dfact(), powmod(), modinv(), ffact(), and parentheses")
     print("Type 'exit' or 'quit' to leave")
     print("Type 'help' for more information")
     
     evaluator = Evaluator()
+    optimizer = Optimizer(evaluator)
     
     while True:
         try:
@@ -872,25 +3319,33 @@ def repl():
                 print("\nSupported operations:")
                 print("  Basic: +, -, *, /, %, ^")
                 print("  Factorial: !")
-                print("  Functions: ln(x), log(x), sqrt(x), abs(x)")
+                print("  Functions: ln(x[, places]), log(x[, places]), sqrt(x[, places]), abs(x), dfact(x), ffact(x, k)")
+                print("  Modular: powmod(a, b, m), modinv(a, m); a ^ b % m uses powmod")
+                print("  explain <expression> shows the optimized expression")
                 print("  Parentheses: ( )")
                 print("  Examples:")
                 print("    123456789 * 987654321")
                 print("    20!")
                 print("    2^64")
                 print("    ln(2)")
+                print("    log(3, 1000)")
                 print("    sqrt(16)")
+                print("    sqrt(2, 100)")
                 print("    1/2 + 3/4")
                 continue
                 
+            if text.strip().lower().startswith('explain '):
+                print(optimizer.explain(Parser(tokenize(text.strip()[8:])).parse()))
+                continue
+                
             tokens = tokenize(text)
             parser = Parser(tokens)
             ast = parser.parse()
-            result = evaluator.visit(ast)
+            result = evaluator.visit(optimizer.optimize(ast))
             
             # Display result appropriately
             if isinstance(result, BigRational):
-                if result.denominator == BigInteger('1'):
+                if result.denominator == ONE:
                     print(result.numerator)
                 else:
                     print(f"{result.to_fraction_string()} = {result.to_decimal(10)}")
@@ -2,8 +2,13 @@
 
 import json
 import sys
-from http.server import HTTPServer, BaseHTTPRequestHandler
+from collections import OrderedDict
+from concurrent.futures import Future, ProcessPoolExecutor, wait
+from functools import partial
+from concurrent.futures.process import BrokenProcessPool
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
 from urllib.parse import urlparse, parse_qs
+import queue
 import threading
 import time
 import subprocess
@@ -12,13 +17,310 @@ import io
 from contextlib import redirect_stdout, redirect_stderr
 
 # Import our calculator modules
-from calc import tokenize, Parser, Evaluator, BigRational, BigInteger
+from calc import tokenize, Parser, Evaluator, Optimizer, SubexpressionMemo, Deadline, estimate_cost, format_expression, BigRational, BigInteger
 import test_calc
 
+# Values of factorials, powers and function calls shared between requests;
+# each worker process has its own
+SUBEXPRESSION_MEMO = SubexpressionMemo(max_bytes=64 * 1024 * 1024)
+
+# Time limits for one calculation; a request may set its own with
+# "timeout_ms", up to MAX_TIMEOUT_MS. Past its deadline plus DEADLINE_SLACK
+# seconds the handler stops waiting for the worker
+DEFAULT_TIMEOUT_MS = 10000
+MAX_TIMEOUT_MS = 60000
+DEADLINE_SLACK = 5
+
+def request_timeout(data):
+    # The time limit in seconds for a /calculate request body
+    timeout_ms = data.get('timeout_ms', DEFAULT_TIMEOUT_MS)
+    if isinstance(timeout_ms, bool) or not isinstance(timeout_ms, (int, float)) or not timeout_ms > 0:
+        raise ValueError('timeout_ms must be a positive number')
+    return min(timeout_ms, MAX_TIMEOUT_MS) / 1000
+
+# Admission control. The cost of an expression is estimated before it is
+# queued. It is refused if its largest value would pass MAX_DIGITS digits or
+# MAX_MEMORY_BYTES of memory, or if it would run more than ESTIMATE_MARGIN
+# times its time limit; expected to run past SLOW_SECONDS, it goes to the
+# slow pool, so that cheap requests are not stuck behind it. Estimates run in
+# the handler thread, outside any deadline, so constants are only folded
+# there up to ADMIT_FOLD_DIGITS digits (factorials up to ADMIT_FOLD_FACTORIAL),
+# which costs about as much as parsing; the worker folds the rest under the
+# request's deadline
+MAX_DIGITS = 10 ** 7
+MAX_MEMORY_BYTES = 1024 * 1024 * 1024
+ESTIMATE_MARGIN = 2
+SLOW_SECONDS = 1.0
+ADMIT_FOLD_DIGITS = 100
+ADMIT_FOLD_FACTORIAL = 20
+
+def admit(data):
+    # The CostEstimate for a /calculate request body, or None for an empty
+    # expression; raises BudgetExceeded if it is over budget
+    expression = data.get('expression', '')
+    if not isinstance(expression, str) or not expression.strip():
+        return None
+    optimizer = Optimizer(fold_digits=ADMIT_FOLD_DIGITS, fold_factorial=ADMIT_FOLD_FACTORIAL)
+    ast = optimizer.optimize(Parser(tokenize(expression)).parse())
+    estimate = estimate_cost(ast)
+    estimate.check(MAX_DIGITS, MAX_MEMORY_BYTES, ESTIMATE_MARGIN * request_timeout(data))
+    return estimate
+
+def add_estimate(response, estimate):
+    # Report the cost estimate with the explanation, if one was asked for
+    if estimate is not None and 'explain' in response:
+        response['explain']['estimate'] = {
+            'digits': estimate.digits,
+            'bytes': estimate.nbytes,
+            'seconds': estimate.seconds
+        }
+    return response
+
+def calculate(data, estimate=None):
+    # The response for a /calculate request body, with its cost estimate
+    # from admit. Runs in a worker process, so errors are returned as part
+    # of the response rather than raised
+    try:
+        expression = data.get('expression', '')
+        
+        if not expression.strip():
+            return {'error': 'Empty expression'}
+        
+        # Use our calculator to evaluate the expression; the arithmetic
+        # stops with a TimeoutError once the deadline passes
+        with Deadline(request_timeout(data)):
+            evaluator = Evaluator(memo=SUBEXPRESSION_MEMO)
+            optimizer = Optimizer(evaluator)
+            tokens = tokenize(expression)
+            parser = Parser(tokens)
+            ast = parser.parse()
+            optimized = optimizer.optimize(ast)
+            result = evaluator.visit(optimized)
+            
+            # Format the result
+            if isinstance(result, BigRational):
+                if result.denominator == BigInteger('1'):
+                    result_str = str(result.numerator)
+                else:
+                    # Show both fraction and decimal representation
+                    fraction_str = result.to_fraction_string()
+                    decimal_str = result.to_decimal(10)
+                    if '/' in fraction_str:
+                        result_str = f"{fraction_str} = {decimal_str}"
+                    else:
+                        result_str = decimal_str
+            else:
+                result_str = str(result)
+        
+        response = {'result': result_str}
+        if data.get('explain'):
+            response['explain'] = {
+                'optimized': format_expression(optimized),
+                'rewrites': optimizer.notes
+            }
+        return add_estimate(response, estimate)
+        
+    except Exception as e:
+        return {'error': str(e)}
+
+def warm_worker():
+    # Runs once in each worker process: calc is already imported, and one
+    # small calculation fills its lazily built tables
+    calculate({'expression': '2^64 % 7 + 10! / 3 + ln(2)'})
+
+class PoolFull(Exception):
+    pass
+
+class CalculationPool:
+    # Evaluates requests in a pool of worker processes, since the work is
+    # pure Python and threads would share one interpreter lock. At most
+    # workers + queue_size requests are admitted at once; submit raises
+    # PoolFull beyond that instead of letting the backlog grow
+    def __init__(self, workers=None, queue_size=None):
+        self.workers = workers or os.cpu_count() or 1
+        self.queue_size = self.workers * 4 if queue_size is None else queue_size
+        self.slots = threading.BoundedSemaphore(self.workers + self.queue_size)
+        self.executor = ProcessPoolExecutor(max_workers=self.workers, initializer=warm_worker)
+        # Start every worker now rather than on the first requests
+        for future in [self.executor.submit(os.getpid) for _ in range(self.workers)]:
+            future.result()
+
+    def submit(self, function, *args, block=False):
+        # With block=True, waits for a free slot instead of raising PoolFull
+        if not self.slots.acquire(blocking=block):
+            raise PoolFull()
+        try:
+            future = self.executor.submit(function, *args)
+        except BaseException:
+            self.slots.release()
+            raise
+        future.add_done_callback(lambda _: self.slots.release())
+        return future
+
+    def shutdown(self):
+        self.executor.shutdown(cancel_futures=True)
+
+# Responses to repeated /calculate requests are kept in the server process,
+# keyed by the expression's tokens (so spacing does not matter) and the
+# options that change the response. Only successful responses are kept: an
+# error may be a timeout that a longer limit would avoid
+RESULT_CACHE_BYTES = 64 * 1024 * 1024
+
+def result_cache_key(data):
+    expression = data.get('expression', '')
+    if not isinstance(expression, str):
+        raise ValueError('expression must be a string')
+    tokens = tuple((token.type, token.value) for token in tokenize(expression))
+    return tokens, bool(data.get('explain'))
+
+class ResultCache:
+    # Responses keyed by result_cache_key, dropping the least recently used
+    # ones once the total size of their result strings passes max_bytes.
+    # Shared by the handler threads, so every access takes the lock
+    def __init__(self, max_bytes=RESULT_CACHE_BYTES):
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()  # key -> (response, size)
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.entries)
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key, response):
+        if 'error' in response:
+            return
+        size = len(json.dumps(response).encode('utf-8'))
+        if size > self.max_bytes:
+            return
+        with self.lock:
+            old = self.entries.pop(key, None)
+            if old is not None:
+                self.nbytes -= old[1]
+            self.entries[key] = (response, size)
+            self.nbytes += size
+            while self.nbytes > self.max_bytes:
+                _, (_, evicted) = self.entries.popitem(last=False)
+                self.nbytes -= evicted
+                self.evictions += 1
+
+    def put_future(self, key, future):
+        # Done callback for a calculation's future
+        if not future.cancelled() and future.exception() is None:
+            self.put(key, future.result())
+
+    def stats(self):
+        with self.lock:
+            return {
+                'entries': len(self.entries),
+                'bytes': self.nbytes,
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions
+            }
+
+# Batches. /calculate/batch takes a JSON array, or NDJSON (one JSON value
+# per line, read as it arrives), of expressions or /calculate request
+# objects. Up to BATCH_IN_FLIGHT_PER_WORKER items per worker are evaluated
+# at once, and each result is streamed back as an NDJSON line, tagged with
+# the item's index (and its "id", if it had one), as soon as it is ready
+MAX_BATCH_ITEMS = 100000
+BATCH_IN_FLIGHT_PER_WORKER = 2
+# How often a batch waiting on its calculations checks that the client is
+# still there
+BATCH_POLL_SECONDS = 0.1
+
+def batch_request(item):
+    # The /calculate request body for one batch item
+    if isinstance(item, str):
+        return {'expression': item}
+    if not isinstance(item, dict):
+        raise ValueError('Batch items must be strings or JSON objects')
+    return item
+
+class BatchStream:
+    # The chunked NDJSON response of a batch. Lines are reported from any
+    # thread, once per item, and written in order of completion by
+    # write_lines; if the client goes away, the rest are dropped
+    def __init__(self, wfile):
+        self.wfile = wfile
+        self.lines = queue.Queue()
+        self.reported = set()
+        self.lock = threading.Lock()
+        self.broken = False
+
+    def report(self, index, item_id, response):
+        with self.lock:
+            if index is not None and index in self.reported:
+                return
+            self.reported.add(index)
+        line = {'index': index}
+        if item_id is not None:
+            line['id'] = item_id
+        line.update(response)
+        self.lines.put(json.dumps(line, separators=(',', ':')).encode('utf-8') + b'\n')
+
+    def report_future(self, index, item_id, future):
+        if future.cancelled():
+            return
+        try:
+            response = future.result()
+        except BrokenProcessPool:
+            response = {'error': 'Calculation worker failed'}
+        except Exception as e:
+            response = {'error': str(e)}
+        self.report(index, item_id, response)
+
+    def close(self):
+        self.lines.put(None)
+
+    def write_lines(self):
+        while True:
+            data = self.lines.get()
+            if self.broken:
+                if data is None:
+                    return
+                continue
+            try:
+                if data is None:
+                    self.wfile.write(b'0\r\n\r\n')
+                else:
+                    self.wfile.write(f'{len(data):x}\r\n'.encode('ascii') + data + b'\r\n')
+                self.wfile.flush()
+            except (BrokenPipeError, ConnectionResetError):
+                self.broken = True
+            if data is None:
+                return
+
 class CalculatorHandler(BaseHTTPRequestHandler):
+    # HTTP/1.1 for chunked batch responses; every other response carries a
+    # Content-Length
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        if self.path == '/stats':
+            self.send_json_response({'result_cache': self.server.result_cache.stats()})
+        else:
+            self.send_error(404)
+
     def do_POST(self):
         if self.path == '/calculate':
             self.handle_calculate()
+        elif self.path == '/calculate/batch':
+            self.handle_batch()
         elif self.path == '/test':
             self.handle_test()
         else:
@@ -29,6 +331,7 @@ class CalculatorHandler(BaseHTTPRequestHandler):
         self.send_header('Access-Control-Allow-Origin', '*')
         self.send_header('Access-Control-Allow-Methods', 'GET, POST, OPTIONS')
         self.send_header('Access-Control-Allow-Headers', 'Content-Type')
+        self.send_header('Content-Length', '0')
         self.end_headers()
 
     def handle_calculate(self):
@@ -36,39 +339,144 @@ class CalculatorHandler(BaseHTTPRequestHandler):
             content_length = int(self.headers['Content-Length'])
             post_data = self.rfile.read(content_length)
             data = json.loads(post_data.decode('utf-8'))
+            if not isinstance(data, dict):
+                raise ValueError('Request body must be a JSON object')
             
-            expression = data.get('expression', '')
-            
-            if not expression.strip():
-                self.send_json_response({'error': 'Empty expression'})
-                return
+            # The calculation runs in a worker process; this thread waits,
+            # with some slack past the deadline the worker enforces itself
+            future = self.dispatch(data)
+            response = future.result(timeout=request_timeout(data) + DEADLINE_SLACK)
+            self.send_json_response(response)
             
-            # Use our calculator to evaluate the expression
-            evaluator = Evaluator()
-            tokens = tokenize(expression)
-            parser = Parser(tokens)
-            ast = parser.parse()
-            result = evaluator.visit(ast)
-            
-            # Format the result
-            if isinstance(result, BigRational):
-                if result.denominator == BigInteger('1'):
-                    result_str = str(result.numerator)
-                else:
-                    # Show both fraction and decimal representation
-                    fraction_str = result.to_fraction_string()
-                    decimal_str = result.to_decimal(10)
-                    if '/' in fraction_str:
-                        result_str = f"{fraction_str} = {decimal_str}"
-                    else:
-                        result_str = decimal_str
+        except PoolFull:
+            self.send_json_response({'error': 'Server busy, try again later'}, status=429)
+        except TimeoutError:
+            self.send_json_response({'error': 'Calculation timed out'})
+        except BrokenProcessPool:
+            self.send_json_response({'error': 'Calculation worker failed'}, status=500)
+        except Exception as e:
+            self.send_json_response({'error': str(e)})
+
+    def dispatch(self, data, block=False):
+        # A future for the response to a /calculate request body: answered
+        # from the result cache if possible, otherwise admitted and submitted
+        # to the fast or slow pool, with the response cached once it is done
+        cache = self.server.result_cache
+        key = result_cache_key(data)
+        response = cache.get(key)
+        if response is not None:
+            future = Future()
+            future.set_result(response)
+            return future
+        estimate = admit(data)
+        slow = estimate is not None and estimate.seconds > SLOW_SECONDS
+        pool = self.server.slow_pool if slow else self.server.pool
+        future = pool.submit(calculate, data, estimate, block=block)
+        future.add_done_callback(partial(cache.put_future, key))
+        return future
+
+    def handle_batch(self):
+        try:
+            if 'ndjson' in self.headers.get('Content-Type', ''):
+                items = (json.loads(line) for line in self.read_body_lines() if line.strip())
             else:
-                result_str = str(result)
-            
-            self.send_json_response({'result': result_str})
-            
+                items = json.loads(b''.join(self.read_body_lines()).decode('utf-8'))
+                if not isinstance(items, list):
+                    raise ValueError('Request body must be a JSON array or NDJSON')
         except Exception as e:
             self.send_json_response({'error': str(e)})
+            return
+        
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/x-ndjson')
+        self.send_header('Access-Control-Allow-Origin', '*')
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.end_headers()
+        # The rest of an NDJSON body is not read if the batch fails part way
+        self.close_connection = True
+        
+        # Results are written by their own thread as they complete, while
+        # this one reads and dispatches the items
+        batch = BatchStream(self.wfile)
+        writer = threading.Thread(target=batch.write_lines)
+        writer.start()
+        in_flight = threading.BoundedSemaphore(
+            BATCH_IN_FLIGHT_PER_WORKER * (self.server.pool.workers + self.server.slow_pool.workers))
+        futures = {}
+        try:
+            for index, item in enumerate(items):
+                if batch.broken:
+                    break
+                item_id = item.get('id') if isinstance(item, dict) else None
+                if index >= MAX_BATCH_ITEMS:
+                    batch.report(index, item_id, {'error': f'Batches are limited to {MAX_BATCH_ITEMS} items'})
+                    break
+                try:
+                    data = batch_request(item)
+                    request_timeout(data)
+                    if not self.acquire_unless_broken(in_flight, batch):
+                        break
+                    try:
+                        future = self.dispatch(data, block=True)
+                    except BaseException:
+                        in_flight.release()
+                        raise
+                except Exception as e:
+                    batch.report(index, item_id, {'error': str(e)})
+                    continue
+                futures[future] = (index, item_id)
+                future.add_done_callback(lambda _: in_flight.release())
+                future.add_done_callback(partial(batch.report_future, index, item_id))
+        except Exception as e:
+            # A malformed NDJSON line ends the batch with an error line
+            batch.report(None, None, {'error': str(e)})
+        
+        # Every calculation has its own deadline; the overall one only guards
+        # against a worker that does not return. If the client goes away, the
+        # calculations still queued are cancelled and running ones are left
+        # to finish unwatched
+        deadline = time.monotonic() + MAX_TIMEOUT_MS / 1000 + DEADLINE_SLACK
+        not_done = set(futures)
+        while not_done and not batch.broken and time.monotonic() < deadline:
+            done, not_done = wait(not_done, timeout=BATCH_POLL_SECONDS)
+        for future in not_done:
+            future.cancel()
+            batch.report(*futures[future], {'error': 'Calculation timed out'})
+        batch.close()
+        writer.join()
+
+    def acquire_unless_broken(self, semaphore, batch):
+        # Waits for the semaphore, giving up if the batch's client goes away
+        while not semaphore.acquire(timeout=BATCH_POLL_SECONDS):
+            if batch.broken:
+                return False
+        return True
+
+    def read_body_lines(self):
+        # The request body line by line as it arrives, whether it is sent
+        # with a Content-Length or in chunks
+        if 'chunked' in self.headers.get('Transfer-Encoding', '').lower():
+            buffer = b''
+            while True:
+                size = int(self.rfile.readline().split(b';')[0], 16)
+                if not size:
+                    self.rfile.readline()
+                    break
+                buffer += self.rfile.read(size)
+                self.rfile.readline()
+                *lines, buffer = buffer.split(b'\n')
+                for line in lines:
+                    yield line + b'\n'
+            if buffer:
+                yield buffer
+            return
+        remaining = int(self.headers.get('Content-Length', 0))
+        while remaining > 0:
+            line = self.rfile.readline(remaining)
+            if not line:
+                break
+            remaining -= len(line)
+            yield line
 
     def handle_test(self):
         try:
@@ -147,30 +555,59 @@ class CalculatorHandler(BaseHTTPRequestHandler):
                 'message': 'Test execution failed'
             })
 
-    def send_json_response(self, data):
-        self.send_response(200)
+    def send_json_response(self, data, status=200):
+        response = json.dumps(data, indent=2).encode('utf-8')
+        self.send_response(status)
         self.send_header('Content-Type', 'application/json')
         self.send_header('Access-Control-Allow-Origin', '*')
+        self.send_header('Content-Length', str(len(response)))
+        if status == 429:
+            self.send_header('Retry-After', '1')
         self.end_headers()
         
-        response = json.dumps(data, indent=2)
-        self.wfile.write(response.encode('utf-8'))
+        self.wfile.write(response)
 
     def log_message(self, format, *args):
         # Suppress default logging
         pass
 
-def run_server(port=8000):
-    server_address = ('', port)
-    httpd = HTTPServer(server_address, CalculatorHandler)
-    print(f"Calculator API server running on port {port}")
+def create_server(port=8000, workers=None, queue_size=None, slow_workers=None):
+    # Connections are served by one thread each; calculations go to a pool
+    # of worker processes, and those expected to be slow to a smaller pool of
+    # their own. By default the two pools share the CPUs, a quarter of them
+    # (at least one) for slow calculations; with a single CPU there is one
+    # worker of each. Port 0 picks a free port
+    cpus = os.cpu_count() or 1
+    slow_workers = slow_workers or max(1, cpus // 4)
+    pool = CalculationPool(workers or max(1, cpus - slow_workers), queue_size)
+    slow_pool = CalculationPool(slow_workers, queue_size)
+    httpd = ThreadingHTTPServer(('', port), CalculatorHandler)
+    httpd.daemon_threads = True
+    httpd.pool = pool
+    httpd.slow_pool = slow_pool
+    httpd.result_cache = ResultCache()
+    return httpd
+
+def close_server(httpd):
+    httpd.server_close()
+    httpd.pool.shutdown()
+    httpd.slow_pool.shutdown()
+
+def run_server(port=8000, workers=None, queue_size=None, slow_workers=None):
+    httpd = create_server(port, workers, queue_size, slow_workers)
+    print(f"Calculator API server running on port {port} with {httpd.pool.workers} worker(s) and {httpd.slow_pool.workers} for slow calculations")
     print(f"Access the calculator at http://localhost:5173")
     try:
         httpd.serve_forever()
     except KeyboardInterrupt:
         print("\nShutting down server...")
-        httpd.shutdown()
+    finally:
+        close_server(httpd)
 
 if __name__ == '__main__':
+    # python server.py [port [workers [queue_size [slow_workers]]]]
     port = int(sys.argv[1]) if len(sys.argv) > 1 else 8000
-    run_server(port)
\ No newline at end of file
+    workers = int(sys.argv[2]) if len(sys.argv) > 2 else None
+    queue_size = int(sys.argv[3]) if len(sys.argv) > 3 else None
+    slow_workers = int(sys.argv[4]) if len(sys.argv) > 4 else None
+    run_server(port, workers, queue_size, slow_workers)
\ No newline at end of file
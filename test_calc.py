@@ -3,7 +3,15 @@
 # Assuming that 'calc.py' is in the same directory or appropriately accessible
 # and that it defines BigInteger, BigRational, tokenize, Parser, Evaluator
 
-from calc import BigInteger, BigRational, tokenize, Parser, Evaluator
+import io
+import math
+import pickle
+import threading
+import time
+
+from calc import BigInteger, BigRational, Token, tokenize, iter_tokens, Parser, Evaluator, Optimizer, SubexpressionMemo, hash_cons, Deadline, estimate_cost, BudgetExceeded, gcd, gcd_extended, powmod
+from calc import multiply_limbs, schoolbook_multiply_limbs, ntt_multiply_limbs, square_limbs, str_to_limbs
+from calc import isqrt_limbs, int_to_limbs, limbs_to_int
 
 def test_big_integer_operations():
     print("=== Testing BigInteger Operations ===\n")
@@ -42,6 +50,43 @@ def test_big_integer_operations():
     result_pow = a ** exponent
     print(f"{a} ** {exponent} = {result_pow}\n")
 
+def test_limb_representation():
+    print("=== Testing Limb Representation ===\n")
+
+    # Round trips at and around the nine-digit limb boundaries
+    for digits in (1, 8, 9, 10, 17, 18, 19, 27, 28):
+        for text in ('9' * digits, '1' + '0' * (digits - 1), '1' + '0' * (digits - 2) + '1' if digits > 1 else '1'):
+            for sign in ('', '-'):
+                value = BigInteger(sign + text)
+                assert str(value) == sign + text, sign + text
+                assert len(value.limbs) == (digits + 8) // 9
+    assert str(BigInteger('000000000000123')) == '123'
+    print("Round trips at 1 to 28 digits keep their digits and limb counts")
+
+    # Carries and borrows across whole limbs
+    cases = [
+        ('999999999', '1', '1000000000', '999999998'),
+        ('999999999999999999', '1', '1000000000000000000', '999999999999999998'),
+        ('1000000000000000000', '-1', '999999999999999999', '1000000000000000001'),
+        ('-1000000000', '1', '-999999999', '-1000000001'),
+    ]
+    for a, b, total, difference in cases:
+        assert str(BigInteger(a) + BigInteger(b)) == total, (a, b)
+        assert str(BigInteger(a) - BigInteger(b)) == difference, (a, b)
+        print(f"{a} + {b} = {total}, {a} - {b} = {difference}")
+    a = BigInteger('1' + '0' * 27)
+    assert str(a - BigInteger('1')) == '9' * 27
+    assert len((a - BigInteger('1')).limbs) == 3
+
+    # Zero is unsigned, however it is made
+    zeros = [BigInteger('-0'), BigInteger('-000000000000'), BigInteger('5') - BigInteger('5'),
+             BigInteger('-5') + BigInteger('5'), BigInteger('-7') * BigInteger('0'),
+             BigInteger('-3') % BigInteger('3')]
+    for zero in zeros:
+        assert zero.sign == 1 and not zero.limbs and str(zero) == '0'
+        assert zero == BigInteger('0')
+    print("Zero has sign 1 and no limbs however it is made\n")
+
 def test_big_rational_operations():
     print("=== Testing BigRational (Fraction) Operations ===\n")
 
@@ -96,6 +141,8 @@ def test_expression_evaluation():
         "(-5)!",  # This should raise an error
         "0!",     # This should equal 1
         "100!",   # Large factorial
+        "dfact(9)",  # Double factorial: 9 * 7 * 5 * 3 * 1
+        "dfact(10)", # 10 * 8 * 6 * 4 * 2
         "2 ^ 100", # Large power
         "sqrt(2)", # Irrational square root
         "1000000000000000000000000000000 + 1", # Very large numbers
@@ -165,11 +212,587 @@ def test_edge_cases():
             print(f"Error: {e}")
         print()
 
+def test_fast_multiplication():
+    print("=== Testing Fast Multiplication ===\n")
+
+    # (10^n - 1)^2 = 99...9800...01 exercises long carry chains
+    for n in (200, 1000, 5000):
+        nines = BigInteger('9' * n)
+        expected = '9' * (n - 1) + '8' + '0' * (n - 1) + '1'
+        assert str(nines * nines) == expected
+        print(f"(10^{n} - 1)^2 has {len(expected)} digits")
+
+    # Compare the fast tiers against schoolbook on mixed-size operands
+    for len1, len2 in ((300, 300), (1200, 1100), (2000, 450), (5000, 3000)):
+        x = str_to_limbs(''.join(str((i * 7 + 3) % 10) for i in range(len1)))
+        y = str_to_limbs(''.join(str((i * 3 + 1) % 10) for i in range(len2)))
+        assert multiply_limbs(x, y) == schoolbook_multiply_limbs(x, y)
+        print(f"{len1} x {len2} digits: fast product matches schoolbook")
+
+    # The NTT path is exact for operands below its size threshold too
+    x = str_to_limbs('9' * 900 + '1' * 900)
+    y = str_to_limbs('7' * 1000)
+    assert ntt_multiply_limbs(x, y) == schoolbook_multiply_limbs(x, y)
+    assert ntt_multiply_limbs(x, x) == schoolbook_multiply_limbs(x, x)
+    print("NTT products match schoolbook")
+    print()
+
+def test_fast_division():
+    print("=== Testing Burnikel-Ziegler Division ===\n")
+
+    # Rebuild large dividends from known quotients and remainders
+    divisor = BigInteger('987654321' * 60 + '1')
+    for digits in (600, 2000, 6000):
+        quotient = BigInteger(''.join(str((i * 7 + 1) % 10) for i in range(digits)))
+        remainder = BigInteger('123456789' * 30)
+        dividend = quotient * divisor + remainder
+        q, r = divmod(dividend, divisor)
+        assert q == quotient and r == remainder
+        assert dividend // divisor == quotient and dividend % divisor == remainder
+        print(f"{len(str(dividend))}-digit dividend: quotient and remainder recovered")
+
+    # Signs follow // and %: truncated quotient, remainder takes the dividend's sign
+    q, r = divmod(BigInteger('-17'), BigInteger('5'))
+    print(f"divmod(-17, 5) = ({q}, {r})")
+    assert str(q) == '-3' and str(r) == '-2'
+    print()
+
+def test_gcd_engine():
+    print("=== Testing GCD Engine ===\n")
+
+    # Small, Lehmer-sized and half-GCD-sized operands with a known common factor
+    for digits in (12, 400, 12000):
+        common = BigInteger('7' * (digits // 3) + '3')
+        a = common * BigInteger('1' + '0' * digits + '27')
+        b = common * BigInteger('9' * digits + '8')
+        g = gcd(a, b)
+        assert g == common
+        g, x, y = gcd_extended(a, -b)
+        assert g == common and a * x + -b * y == g
+        print(f"gcd of {len(str(a))}- and {len(str(b))}-digit numbers recovered, Bezout identity holds")
+
+    g, x, y = gcd_extended(BigInteger('240'), BigInteger('46'))
+    print(f"gcd_extended(240, 46) = ({g}, {x}, {y})")
+    assert str(g) == '2' and BigInteger('240') * x + BigInteger('46') * y == g
+    print()
+
+def test_lazy_rationals():
+    print("=== Testing Lazy Rationals ===\n")
+
+    # A harmonic sum evaluated eagerly and lazily gives the same reduced fraction
+    expr = '+'.join(f"1/{i}" for i in range(1, 120)) + '-1/7*(3-2/3)'
+    eager = Evaluator().visit(Parser(tokenize(expr)).parse())
+    lazy = Evaluator(lazy=True).visit(Parser(tokenize(expr)).parse())
+    assert lazy == eager and lazy.to_fraction_string() == eager.to_fraction_string()
+    print(f"Harmonic sum of 119 terms: {lazy.to_decimal(20)}")
+
+    # Lazy values stay unreduced until observed, then agree with eager ones
+    half = BigRational(BigInteger('2'), BigInteger('4'), lazy=True)
+    third = BigRational(BigInteger('1'), BigInteger('3'))
+    result = (half + third) * BigRational(BigInteger('6')) - half / third
+    print(f"(2/4 + 1/3) * 6 - (2/4) / (1/3) = {result.to_fraction_string()}")
+    assert result.to_fraction_string() == '7/2'
+    assert result < BigRational(BigInteger('4')) and -result < BigRational(BigInteger('0'))
+    print()
+
+def test_decimal_expansion():
+    print("=== Testing Decimal Expansion ===\n")
+
+    cases = [
+        (BigRational(BigInteger('1'), BigInteger('28')), 20, '0.03(571428)'),
+        (BigRational(BigInteger('-22'), BigInteger('7')), 10, '-3.1(428571)'),
+        (BigRational(BigInteger('1'), BigInteger('1024')), 20, '0.0009765625'),
+        (BigRational(BigInteger('1'), BigInteger('1024')), 5, '0.00097'),
+        (BigRational(BigInteger('1'), BigInteger('17')), 16, '0.0588235294117647'),
+        (BigRational(BigInteger('1'), BigInteger('17')), 17, '0.0(5882352941176470)'),
+    ]
+    for value, places, expected in cases:
+        result = value.to_decimal(places)
+        print(f"{value.to_fraction_string()} to {places} places = {result}")
+        assert result == expected
+
+    # 10 has order 3959 modulo the prime 7919, so the whole period is found
+    expansion = BigRational(BigInteger('1'), BigInteger('7919')).to_decimal(10000)
+    period = expansion[expansion.index('(') + 1:-1]
+    print(f"1/7919 repeats with period {len(period)}")
+    assert len(period) == 3959 and expansion.startswith('0.0(00126278')
+    print()
+
+def test_large_literals():
+    print("=== Testing Large Literals ===\n")
+
+    # A 30103-digit power printed and read back as a literal round-trips
+    power = Evaluator().visit(Parser(tokenize('2^100000')).parse())
+    text = str(power.numerator)
+    tokens = tokenize(text + ' - 2^100000 + 1')
+    assert tokens[0].value == text
+    result = Evaluator().visit(Parser(tokens).parse())
+    print(f"2^100000 has {len(text)} digits; reading it back and subtracting 2^100000 leaves {result.to_fraction_string()}")
+    assert len(text) == 30103 and result.to_fraction_string() == '1'
+    print()
+
+def test_square_roots():
+    print("=== Testing Square Roots ===\n")
+
+    n = BigInteger('7') ** BigInteger('5001')
+    root = n.isqrt()
+    assert root * root <= n and n < (root + BigInteger('1')) * (root + BigInteger('1'))
+    print(f"isqrt(7^5001) has {len(str(root))} digits")
+
+    # A small top limb leaves Newton's step far above the floor of the root;
+    # the correction must still land exactly on it
+    for top in (1, 2, 8, 99):
+        for length in (5, 8, 64, 1001, 2000):
+            value = top * 10 ** (9 * (length - 1)) + 7
+            root = limbs_to_int(isqrt_limbs(int_to_limbs(value)))
+            assert root == math.isqrt(value), (top, length)
+            root = limbs_to_int(isqrt_limbs(int_to_limbs(value - 7)))
+            assert root == math.isqrt(value - 7), (top, length)
+    print("isqrt is exact for small top limbs of 5 to 2000-limb numbers")
+
+    start = time.perf_counter()
+    root = Evaluator().visit(Parser(tokenize("sqrt(8, 20000)")).parse())
+    print(f"sqrt(8, 20000) = {root.to_decimal(20)}... in {time.perf_counter() - start:.2f}s")
+    assert root.to_decimal(20) == '2.82842712474619009760'
+
+    evaluator = Evaluator()
+    for expr, expected in [("sqrt(9/16)", "3/4"), ("sqrt(10^40)", "100000000000000000000"), ("sqrt(2, 3)", "707/500")]:
+        result = evaluator.visit(Parser(tokenize(expr)).parse()).to_fraction_string()
+        print(f"{expr} = {result}")
+        assert result == expected
+
+    # The root of 2 to 1000 places squares to within 10^-999 of 2
+    root = evaluator.visit(Parser(tokenize("sqrt(2, 1000)")).parse())
+    error = abs(root * root - BigRational(BigInteger('2')))
+    assert error < BigRational(BigInteger('1'), BigInteger('10') ** BigInteger('999'))
+    print(f"sqrt(2, 1000) = {root.to_decimal(30)}...")
+
+    for expr in ("sqrt(-1)", "sqrt(2, 1/2)", "sqrt(2, -1)", "sqrt(1, 2, 3)"):
+        try:
+            evaluator.visit(Parser(tokenize(expr)).parse())
+            assert False, expr
+        except ValueError as e:
+            print(f"{expr}: {e}")
+    print()
+
+def test_logarithms():
+    print("=== Testing Logarithms ===\n")
+
+    evaluator = Evaluator()
+    ln2 = evaluator.visit(Parser(tokenize("ln(2, 100)")).parse())
+    print(f"ln(2, 100) = {ln2.to_decimal(100)}")
+    assert ln2.to_decimal(100) == '0.6931471805599453094172321214581765680755001343602552541206800094933936219696947156058633269964186875'
+
+    for expr, expected in [("log(1000)", "3"), ("log(1/100)", "-2"), ("ln(1)", "0"),
+                           ("ln(2^100, 5)", "69.31472"), ("log(2, 30)", "0.301029995663981195213738894724")]:
+        result = evaluator.visit(Parser(tokenize(expr)).parse()).to_decimal(40)
+        print(f"{expr} = {result}")
+        assert result == expected
+
+    # log(x) agrees with ln(x) / ln(10) to within the rounding of both
+    log_value = evaluator.visit(Parser(tokenize("log(7/3, 200)")).parse())
+    ratio = evaluator.visit(Parser(tokenize("ln(7/3, 210) / ln(10, 210)")).parse())
+    assert abs(log_value - ratio) < BigRational(BigInteger('1'), BigInteger('10') ** BigInteger('200'))
+    print(f"log(7/3, 200) = {log_value.to_decimal(30)}...")
+
+    for expr in ("ln(0)", "log(-1)", "ln(2, 1/3)"):
+        try:
+            evaluator.visit(Parser(tokenize(expr)).parse())
+            assert False, expr
+        except ValueError as e:
+            print(f"{expr}: {e}")
+    print()
+
+def test_powers():
+    print("=== Testing Powers ===\n")
+
+    # Squaring through every multiplication tier matches schoolbook
+    for digits in (100, 600, 3000, 12000):
+        x = str_to_limbs(''.join(str((i * 7 + 5) % 10) for i in range(digits)))
+        assert square_limbs(x) == schoolbook_multiply_limbs(x, list(x))
+        print(f"{digits}-digit square matches schoolbook")
+
+    # Windowed powers agree with products of smaller powers
+    base = BigInteger('-123456789123456789')
+    assert base ** BigInteger('777') == base ** BigInteger('700') * base ** BigInteger('77')
+    assert str(BigInteger('1000') ** BigInteger('50')) == '1' + '0' * 150
+    print("(-123456789123456789)^777 = (...)^700 * (...)^77, 1000^50 = 10^150")
+
+    evaluator = Evaluator()
+    for expr, expected in [("(2/3)^-3", "27/8"), ("(-2/3)^-3", "-27/8"), ("(-5)^3", "-125"), ("0^0", "1")]:
+        result = evaluator.visit(Parser(tokenize(expr)).parse()).to_fraction_string()
+        print(f"{expr} = {result}")
+        assert result == expected
+    print()
+
+def test_modular_arithmetic():
+    print("=== Testing Modular Arithmetic ===\n")
+
+    # Montgomery (odd modulus coprime to 10) and Barrett (even modulus) agree
+    # with reducing the full power
+    base = BigInteger('123456789' * 12)
+    for modulus in (BigInteger('987654321' * 11 + '7'), BigInteger('987654321' * 11 + '8')):
+        assert powmod(base, BigInteger('300'), modulus) == base ** BigInteger('300') % modulus
+        print(f"powmod with a {len(str(modulus))}-digit modulus matches the full power")
+
+    evaluator = Evaluator()
+    for expr, expected in [("powmod(4, 13, 497)", "445"), ("modinv(3, 11)", "4"), ("modinv(-3, 11)", "7"),
+                           ("powmod(3, -1, 11)", "4"), ("(-2) ^ 3 % 5", "-3"), ("2 ^ 10 % 1000", "24"),
+                           ("(1/2) ^ -2 % 3", "1")]:
+        result = evaluator.visit(Parser(tokenize(expr)).parse()).to_fraction_string()
+        print(f"{expr} = {result}")
+        assert result == expected
+
+    # An exponent far too large for the power to be built
+    result = evaluator.visit(Parser(tokenize("2 ^ (10 ^ 30) % 1000000007")).parse())
+    print(f"2 ^ (10 ^ 30) % 1000000007 = {result.to_fraction_string()}")
+    assert int(result.numerator) == pow(2, 10 ** 30, 1000000007)
+
+    for expr in ("modinv(6, 9)", "powmod(2, 1/2, 5)", "powmod(2, 3)", "(1/2) ^ 2 % 3"):
+        try:
+            evaluator.visit(Parser(tokenize(expr)).parse())
+            assert False, expr
+        except ValueError as e:
+            print(f"{expr}: {e}")
+
+    # A power that is not a powmod fails before the modulus is evaluated
+    for expr, error, message in [("(2^(1/2)) % (1/0)", ValueError, 'Exponent must be an integer'),
+                                 ("0^-1 % (1/0)", ZeroDivisionError, 'Denominator cannot be zero')]:
+        try:
+            evaluator.visit(Parser(tokenize(expr)).parse())
+            assert False, expr
+        except error as e:
+            print(f"{expr}: {e}")
+            assert str(e) == message, expr
+    print()
+
+def test_small_integers():
+    print("=== Testing Small-Integer Fast Path ===\n")
+
+    # Word-sized operands overflow into more limbs and match the limb kernels
+    big = BigInteger('999999999999999999')
+    for result, expected in [(big + BigInteger('1'), '1' + '0' * 18), (big * big, str(999999999999999999 ** 2)),
+                             (BigInteger('-7') - big, '-1' + '0' * 17 + '6'), (BigInteger('-17') // BigInteger('5'), '-3'),
+                             (BigInteger('-17') % BigInteger('5'), '-2'), (BigInteger('5') - BigInteger('5'), '0')]:
+        print(f"{result} (expected {expected})")
+        assert str(result) == expected
+    assert BigInteger('-0') == BigInteger('0') and str(BigInteger('-0')) == '0'
+
+    # Integer-valued rationals skip cross-multiplication but still print the same
+    total = BigRational(BigInteger('3')) + BigRational(BigInteger('4'), BigInteger('2'))
+    print(f"3 + 4/2 = {total.to_fraction_string()}")
+    assert total.to_fraction_string() == '5' and total.denominator == BigInteger('1')
+    print()
+
+def test_value_objects():
+    print("=== Testing Immutable Value Objects ===\n")
+
+    # Equal values hash alike, reduced or not, so they can key a cache
+    cache = {BigRational(BigInteger('6'), BigInteger('4'), lazy=True): 'three halves', BigInteger('7'): 'seven'}
+    assert cache[BigRational(BigInteger('3'), BigInteger('2'))] == 'three halves'
+    assert cache[BigRational(BigInteger('14'), BigInteger('2'))] == 'seven'
+    assert Token('NUMBER', '12') == tokenize('12')[0] and len({Token('PLUS'), Token('PLUS')}) == 1
+    print("6/4 and 3/2, 14/2 and 7 find the same cache entries")
+
+    for value in (BigInteger('5'), BigRational(BigInteger('1'), BigInteger('3')), Token('PLUS'), Parser(tokenize('1 + 2')).parse()):
+        try:
+            value.value = 0
+            assert False, value
+        except AttributeError as e:
+            print(f"{type(value).__name__}: {e}")
+        assert not hasattr(value, '__dict__')
+
+    # Objects survive pickling, as needed to hand them to worker processes
+    ast = Parser(tokenize('sqrt(2, 5) + 10!')).parse()
+    restored = pickle.loads(pickle.dumps(ast))
+    assert Evaluator().visit(restored) == Evaluator().visit(ast)
+    print(f"Pickled AST round-trips: {restored}")
+    print()
+
+def test_compiled_expressions():
+    print("=== Testing Compiled Expressions ===\n")
+
+    evaluator = Evaluator()
+    for expr in ("3 + 5 * (2 - 8)", "2 ^ 3 ^ 2", "-(3!)! % 7", "sqrt(9/16) + abs(-1/4)", "2 ^ 100 % 97"):
+        compiled = evaluator.compile(expr)
+        expected = evaluator.visit(Parser(tokenize(expr)).parse())
+        assert compiled() == expected and compiled() == expected
+        print(f"{expr} = {compiled().to_fraction_string()} ({len(compiled.code)} instructions)")
+
+    # Functions are looked up when the code runs, so errors surface then too
+    compiled = evaluator.compile(Parser(tokenize("1 + twice(2)")).parse())
+    try:
+        compiled()
+        assert False
+    except ValueError as e:
+        print(f"1 + twice(2): {e}")
+    evaluator.functions['twice'] = lambda args: args[0] * BigRational(BigInteger('2'))
+    assert compiled().to_fraction_string() == '5'
+    print("1 + twice(2) = 5 once twice() is registered")
+    print()
+
+def test_deep_expressions():
+    print("=== Testing Deeply Nested Expressions ===\n")
+
+    evaluator = Evaluator()
+    for expr, expected in [('(' * 5000 + '7' + ')' * 5000, '7'), ('+'.join(['1'] * 100000), '100000'),
+                           ('-' * 20001 + '2', '-2'), ('abs(' * 3000 + '-1' + ')' * 3000, '1'),
+                           ('2 ^ 3 ^ 2', '512'), ('-2 ^ 2', '4'), ('2 ^ -1 ^ 2', '2'), ('-(2 + 1)!', '-6')]:
+        result = evaluator.visit(Parser(tokenize(expr)).parse()).to_fraction_string()
+        print(f"{expr if len(expr) < 40 else expr[:20] + '...'} = {result}")
+        assert result == expected
+
+    for expr, message in [("(1 + 2", "Expected )"), ("f(1, 2", "Expected ) after function arguments"),
+                          ("1 +", "Expected number, identifier, or ("), ("x + 1", "Unexpected token Token(PLUS)"),
+                          ("sqrt(4)!", "Unexpected token after expression")]:
+        try:
+            Parser(tokenize(expr)).parse()
+            assert False, expr
+        except ValueError as e:
+            print(f"{expr}: {e}")
+            assert str(e) == message
+    print()
+
+def test_streaming_tokens():
+    print("=== Testing Streaming Tokenizer ===\n")
+
+    # Reading in tiny chunks, as text or as UTF-8 bytes, splits nothing
+    expr = "sqrt(12345678901234567890, 3) + 7! * value_2 -\u20031/9"
+    expected = tokenize(expr)
+    for source in (io.StringIO(expr), io.BytesIO(expr.encode('utf-8'))):
+        assert list(iter_tokens(source, chunk_size=3)) == expected
+    print(f"{len(expected)} tokens streamed in 3-character chunks match tokenize()")
+
+    # A long literal is read from a stream and parsed without a token list
+    literal = '7' * 200000
+    result = Evaluator().visit(Parser(iter_tokens(io.StringIO(literal + ' % 1000'))).parse())
+    print(f"200000-digit literal % 1000 = {result.to_fraction_string()}")
+    assert result.to_fraction_string() == '777'
+
+    # Decimal digits of other scripts are numbers, as they are for int()
+    result = Evaluator().visit(Parser(iter_tokens(io.StringIO("\u0663\u0660 + 1"))).parse())
+    print(f"'\\u0663\\u0660 + 1' = {result.to_fraction_string()}")
+    assert result.to_fraction_string() == '31'
+
+    for expr in ("2 # 3", "\u00b2 + 1"):
+        try:
+            Parser(iter_tokens(io.StringIO(expr))).parse()
+            assert False, expr
+        except ValueError as e:
+            print(f"{expr!r}: {e}")
+    print()
+
+def test_optimizer():
+    print("=== Testing Optimizer ===\n")
+
+    evaluator = Evaluator()
+    optimizer = Optimizer(evaluator)
+    expressions = [
+        "2 + 3 * 4 - 5", "+(1/3) + -(2/3)", "20!/18!", "5!/8!", "0!/1!",
+        "2^3 * 2^4", "(1/2)^-3 / (1/2)^5", "(2^3)^4", "(-3)^2 * (-3)^-5",
+        "sqrt(4)^2 * sqrt(4)^3", "7 ^ 20 % 13", "ffact(10, 3) + 1",
+    ]
+    for expr in expressions:
+        ast = Parser(tokenize(expr)).parse()
+        expected = evaluator.visit(ast)
+        result = evaluator.visit(optimizer.optimize(ast))
+        print(f"{expr} = {result.to_fraction_string()}")
+        assert result == expected, expr
+
+    # Failing subexpressions are left for evaluation to report
+    for expr in ("1/0 + 2", "0^-1 * 0^2"):
+        try:
+            evaluator.visit(optimizer.optimize(Parser(tokenize(expr)).parse()))
+            assert False, expr
+        except ZeroDivisionError as e:
+            print(f"{expr}: {e}")
+
+    # n!/m! is a short falling product, not two huge factorials
+    result = evaluator.visit(optimizer.optimize(Parser(tokenize("(10^6)! / (10^6 - 3)!")).parse()))
+    print(f"(10^6)! / (10^6 - 3)! = {result.to_fraction_string()}")
+    assert result.to_fraction_string() == str(10**6 * (10**6 - 1) * (10**6 - 2))
+
+    explanation = optimizer.explain(Parser(tokenize("2^3000 * 2^4000 + (1/2)")).parse())
+    print(explanation)
+    assert 'Optimized: (2 ^ 7000) + (1/2)' in explanation
+    assert 'x^3000 * x^4000 computed as x^7000' in explanation
+
+    # A repeated constant subtree is folded once, not once per copy
+    optimizer.optimize(Parser(tokenize("(2^1000 + 1) * (2^1000 + 1) - (2^1000 + 1)")).parse())
+    print(optimizer.notes[-1])
+    assert optimizer.notes == ['4 constant subexpression(s) folded']
+
+    # Notes give long integers by their length, and mention powmod only
+    # where it is used
+    optimizer.optimize(Parser(tokenize("(10^1000)! / (10^1000 - 1)!")).parse())
+    print(optimizer.notes[0])
+    assert optimizer.notes[0].startswith('<1001-digit integer>! / <1000-digit integer>!')
+    for expr, powmod_used in [("7 ^ 10^1000 % 13", True), ("2 ^ -(10^1000) % 7", False), ("(1/2) ^ 10^1000 % 5", False)]:
+        optimizer.optimize(Parser(tokenize(expr)).parse())
+        assert any('powmod' in note for note in optimizer.notes) == powmod_used, expr
+    print()
+
+def test_shared_subexpressions():
+    print("=== Testing Shared Subexpressions ===\n")
+
+    # A repeated subtree is computed once and reused from a slot
+    expr = "(2^4096 + 1) * (2^4096 + 1) - (2^4096 + 1)"
+    compiled = Evaluator().compile(expr)
+    opcodes = [opcode for opcode, _ in compiled.code]
+    print(f"{expr}: {opcodes.count('APPLY_BINARY')} operations, {opcodes.count('LOAD_VALUE')} reuses")
+    assert opcodes.count('APPLY_BINARY') == 4 and opcodes.count('LOAD_VALUE') == 2
+    x = 2**4096 + 1
+    assert compiled().to_fraction_string() == str(x * x - x)
+
+    # Sharing changes neither values nor errors
+    for expr in ["(1+2)*(1+2) + ((1+2)*(1+2))!", "-(3) + -(3) - +(4) * +(4)", "ffact(5, 2) / ffact(5, 2)"]:
+        assert Evaluator().visit(Parser(tokenize(expr)).parse()) == Evaluator().visit(Parser(tokenize(expr)).parse())
+    try:
+        Evaluator().visit(Parser(tokenize("1/(2-2) + 1/(2-2)")).parse())
+        assert False
+    except ZeroDivisionError as e:
+        print(f"1/(2-2) + 1/(2-2): {e}")
+
+    # The memo carries expensive pieces across expressions
+    memo = SubexpressionMemo()
+    evaluator = Evaluator(memo=memo)
+    first = evaluator.visit(Parser(tokenize("1000! + 1")).parse())
+    second = evaluator.visit(Parser(tokenize("1000! - 1")).parse())
+    print(f"memo: {len(memo)} entries, {memo.hits} hit(s), {memo.misses} miss(es)")
+    assert memo.hits == 1 and second == first - BigRational(BigInteger('2'))
+
+    # Calls of one function with different operands or arities are kept apart
+    memo = SubexpressionMemo()
+    evaluator = Evaluator(memo=memo)
+    results = [evaluator.visit(Parser(tokenize(expr)).parse()) for expr in ("sqrt(2)", "sqrt(2, 10)", "sqrt(2, 20)", "sqrt(2)")]
+    print(f"sqrt(2), sqrt(2, 10), sqrt(2, 20), sqrt(2): {len(memo)} entries, {memo.hits} hit(s)")
+    assert len(memo) == 3 and memo.hits == 1
+    assert len({result.to_fraction_string() for result in results}) == 3
+    _, _, digests = hash_cons(Parser(tokenize("sqrt(sqrt(2), 3) + sqrt(sqrt(2, 3))")).parse(), with_digests=True)
+    assert len(set(digests.values())) == len(digests)
+
+    # Least recently used values are dropped to stay within the byte budget
+    memo = SubexpressionMemo(max_bytes=2000)
+    evaluator = Evaluator(memo=memo)
+    for n in range(1, 30):
+        evaluator.visit(Parser(tokenize(f"{n}! + 2^{n}")).parse())
+    print(f"bounded memo: {len(memo)} entries in {memo.nbytes} bytes")
+    assert memo.nbytes <= 2000 and len(memo) < 58
+    assert evaluator.visit(Parser(tokenize("29!")).parse()).to_fraction_string() == str(math.factorial(29))
+    assert memo.hits == 1
+    print()
+
+def test_deadlines():
+    print("=== Testing Deadlines ===\n")
+
+    evaluator = Evaluator()
+    for expr in ["9^9^9", "1000000!", "sqrt(2, 1000000)"]:
+        start = time.perf_counter()
+        try:
+            with Deadline(0.2):
+                evaluator.visit(Parser(tokenize(expr)).parse())
+            assert False, expr
+        except TimeoutError as e:
+            elapsed = time.perf_counter() - start
+            print(f"{expr}: {e} ({elapsed:.2f} s)")
+            assert elapsed < 2
+
+    # Cancelling from another thread stops the calculation too
+    deadline = Deadline()
+    threading.Timer(0.1, deadline.cancel).start()
+    try:
+        with deadline:
+            evaluator.visit(Parser(tokenize("300000!")).parse())
+        assert False
+    except TimeoutError as e:
+        print(f"300000!: {e}")
+
+    # Work that fits within the deadline is unaffected, and so is work after it
+    with Deadline(10):
+        assert evaluator.visit(Parser(tokenize("20!")).parse()).to_fraction_string() == '2432902008176640000'
+    assert evaluator.visit(Parser(tokenize("2^100")).parse()).to_fraction_string() == str(2**100)
+    print()
+
+def test_cost_estimates():
+    print("=== Testing Cost Estimates ===\n")
+
+    def estimate(expr):
+        return estimate_cost(Parser(tokenize(expr)).parse())
+
+    # Result sizes follow the operands: a^b has b * log10(a) digits and n!
+    # about n * log10(n / e)
+    for expr, digits in [("2^(10^9)", 301029996), ("9^9^9", 369693100), ("100000!", 456574), ("123456789 * 987654321", 18)]:
+        cost = estimate(expr)
+        print(f"{expr}: {cost}")
+        assert digits / 2 <= cost.digits <= digits * 2, expr
+
+    # Budgets are checked before any work is done
+    start = time.perf_counter()
+    try:
+        estimate("2^(10^9) + 1").check(max_digits=10**7)
+        assert False
+    except BudgetExceeded as e:
+        print(f"2^(10^9) + 1: {e}")
+    assert time.perf_counter() - start < 1
+    estimate("2^64 + 20!").check(max_digits=100, max_bytes=10**6, max_seconds=0.01)
+
+    # a ^ b % m is costed as powmod, and a repeated subexpression once
+    assert estimate("7^(10^9) % 1000").digits < 20
+    shared = estimate("(3^10000 + 1) * (3^10000 + 1)").seconds
+    assert estimate("3^10000 + 1").seconds < shared < estimate("(3^10000 + 1) * (3^10001 + 1)").seconds
+
+    # ... but only when the exponent is known to be non-negative, as that is
+    # when the evaluator uses powmod
+    assert estimate("7^(10^30 + 1) % 13").seconds < 0.01
+    assert estimate("2^(-(10^30)) % 7").digits > 10**29
+    assert estimate("2^(10^30 - 10^29) % 7").digits > 10**29
+    print(f"2^(-(10^30)) % 7: {estimate('2^(-(10^30)) % 7')}")
+
+    # A fractional exponent costs nothing: evaluation rejects it at once
+    half = Optimizer().optimize(Parser(tokenize("2^(1/2)")).parse())
+    assert estimate_cost(half).seconds == 0
+    try:
+        Evaluator().visit(half)
+        assert False
+    except ValueError as e:
+        print(f"2^(1/2): {estimate_cost(half)}, {e}")
+
+    # Estimated times are within a small factor of the real ones
+    for expr in ("10^1000000", "(1/3)^100000", "sqrt(2, 20000)", "(2/3)^20000 * (5/7)^20000", "30000!"):
+        ast = Parser(tokenize(expr)).parse()
+        start = time.perf_counter()
+        Evaluator().visit(ast).numerator
+        elapsed = time.perf_counter() - start
+        predicted = estimate_cost(ast).seconds
+        print(f"{expr}: estimated {predicted:.3g}s, took {elapsed:.3g}s")
+        assert elapsed / 10 <= predicted <= 10 * elapsed + 0.05, expr
+    print()
+
 def main():
     test_big_integer_operations()
+    test_limb_representation()
     test_big_rational_operations()
     test_expression_evaluation()
     test_edge_cases()
+    test_fast_multiplication()
+    test_fast_division()
+    test_gcd_engine()
+    test_lazy_rationals()
+    test_decimal_expansion()
+    test_large_literals()
+    test_square_roots()
+    test_logarithms()
+    test_powers()
+    test_modular_arithmetic()
+    test_small_integers()
+    test_value_objects()
+    test_compiled_expressions()
+    test_deep_expressions()
+    test_streaming_tokens()
+    test_optimizer()
+    test_shared_subexpressions()
+    test_deadlines()
+    test_cost_estimates()
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -0,0 +1,377 @@
+# test_server.py
+
+# Runs the calculator's HTTP server on a free port with small worker pools
+# and talks to it over real connections
+
+import http.client
+import json
+import os
+import socket
+import threading
+import time
+from concurrent.futures import Future
+from concurrent.futures.process import BrokenProcessPool
+
+import server
+from server import CalculationPool, PoolFull, calculate, admit, SLOW_SECONDS, ResultCache, result_cache_key
+from calc import BudgetExceeded
+
+def start_server(workers=1, queue_size=0, slow_workers=1):
+    httpd = server.create_server(0, workers, queue_size, slow_workers)
+    threading.Thread(target=httpd.serve_forever, daemon=True).start()
+    return httpd
+
+def stop_server(httpd):
+    httpd.shutdown()
+    server.close_server(httpd)
+
+def request(httpd, method, path, body=None, headers=None):
+    # Returns (status, headers, body bytes)
+    connection = http.client.HTTPConnection('127.0.0.1', httpd.server_address[1], timeout=60)
+    try:
+        if body is not None and not isinstance(body, bytes):
+            body = json.dumps(body).encode('utf-8')
+        connection.request(method, path, body=body, headers=headers or {'Content-Type': 'application/json'})
+        response = connection.getresponse()
+        return response.status, response.headers, response.read()
+    finally:
+        connection.close()
+
+def calculate_over_http(httpd, data):
+    # Returns (status, headers, response object) for a /calculate request
+    status, headers, body = request(httpd, 'POST', '/calculate', data)
+    return status, headers, json.loads(body)
+
+def wait_for_free_slots(pool, expected):
+    # Slots are released by a done callback, which may run just after the
+    # future's result is visible, so allow it a moment
+    deadline = time.monotonic() + 5
+    while True:
+        count = 0
+        while pool.slots.acquire(blocking=False):
+            count += 1
+        for _ in range(count):
+            pool.slots.release()
+        if count == expected or time.monotonic() > deadline:
+            return count
+        time.sleep(0.01)
+
+def test_pool_backpressure():
+    print("=== Testing Pool Backpressure ===\n")
+
+    pool = CalculationPool(workers=1, queue_size=1)
+    try:
+        # One running and one queued fill the pool; a third is refused
+        for _ in range(2):
+            pool.submit(time.sleep, 0.5)
+        try:
+            pool.submit(time.sleep, 0)
+            assert False
+        except PoolFull:
+            print("third submission refused with PoolFull")
+
+        # With block=True a submission waits for a slot instead
+        start = time.perf_counter()
+        assert pool.submit(abs, -3, block=True).result() == 3
+        print(f"blocking submission waited {time.perf_counter() - start:.2f}s")
+        assert wait_for_free_slots(pool, 2) == 2
+
+        # A calculation that raises, or runs past its deadline, gives its
+        # slot back
+        assert isinstance(pool.submit(int, 'x').exception(), ValueError)
+        response = pool.submit(calculate, {'expression': '300000!', 'timeout_ms': 50}).result()
+        print(f"300000! with a 50 ms limit: {response}")
+        assert 'timed out' in response['error']
+        assert wait_for_free_slots(pool, 2) == 2
+
+        # So does one whose worker process dies
+        assert isinstance(pool.submit(os._exit, 1).exception(), BrokenProcessPool)
+        assert wait_for_free_slots(pool, 2) == 2
+        print("slots released after errors, timeouts and a dead worker\n")
+    finally:
+        pool.shutdown()
+
+def test_concurrent_requests():
+    print("=== Testing Concurrent Requests ===\n")
+
+    # By default the fast and slow pools share the CPUs between them
+    httpd = server.create_server(0)
+    try:
+        cpus = os.cpu_count() or 1
+        print(f"{cpus} CPU(s): {httpd.pool.workers} fast worker(s), {httpd.slow_pool.workers} slow")
+        assert httpd.slow_pool.workers == max(1, cpus // 4)
+        assert httpd.pool.workers + httpd.slow_pool.workers == max(cpus, 2)
+    finally:
+        server.close_server(httpd)
+
+    httpd = start_server(workers=1, queue_size=0, slow_workers=1)
+    try:
+        # With the only fast worker busy, a request is refused with 429
+        busy = httpd.pool.submit(time.sleep, 1)
+        status, headers, response = calculate_over_http(httpd, {'expression': '2 + 2'})
+        print(f"while busy: {status} {response}, Retry-After {headers['Retry-After']}")
+        assert status == 429 and headers['Retry-After'] == '1'
+        busy.result()
+        assert wait_for_free_slots(httpd.pool, 1) == 1
+        status, _, response = calculate_over_http(httpd, {'expression': '2 + 2'})
+        assert status == 200 and response == {'result': '4'}
+    finally:
+        stop_server(httpd)
+
+    # Requests on many connections at once are all answered, in any order
+    httpd = start_server(workers=2, queue_size=16, slow_workers=1)
+    try:
+        results = {}
+        def client(n):
+            results[n] = calculate_over_http(httpd, {'expression': f'{n}^{n} + 1'})
+        threads = [threading.Thread(target=client, args=(n,)) for n in range(2, 18)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        for n, (status, _, response) in results.items():
+            assert status == 200 and response == {'result': str(n ** n + 1)}, n
+        print(f"{len(results)} concurrent requests answered")
+        assert wait_for_free_slots(httpd.pool, 18) == 18
+
+        # A bad request does not take a slot
+        status, _, response = calculate_over_http(httpd, {'expression': '1 +'})
+        print(f"'1 +': {status} {response}\n")
+        assert status == 200 and 'error' in response
+        assert wait_for_free_slots(httpd.pool, 18) == 18
+    finally:
+        stop_server(httpd)
+
+def test_admission():
+    print("=== Testing Admission ===\n")
+
+    # Admitted (and to which pool) or refused, with the default time limit
+    cases = [
+        ("10^1000000", 'fast'), ("(1/3)^100000", 'fast'), ("sqrt(2, 20000)", 'fast'),
+        ("(10^6)! / (10^6 - 3)!", 'fast'), ("2^(1/2)", 'fast'), ("7^(10^30 + 1) % 13", 'fast'),
+        ("30000!", 'slow'), ("sqrt(3, 50000)", 'slow'),
+        ("2^(-(10^30)) % 7", None), ("2^(10^9)", None), ("(10^6)!", None),
+    ]
+    for expr, expected in cases:
+        try:
+            estimate = admit({'expression': expr})
+            verdict = 'slow' if estimate.seconds > SLOW_SECONDS else 'fast'
+        except BudgetExceeded as e:
+            estimate, verdict = e, None
+        print(f"{expr}: {verdict or 'refused'} ({estimate})")
+        assert verdict == expected, expr
+
+    # Admission does no big arithmetic of its own, however much the
+    # expression would fold
+    expr = ' + '.join(f'{2000 - n % 50}!' for n in range(1000))
+    start = time.perf_counter()
+    try:
+        admit({'expression': expr, 'timeout_ms': 100})
+        assert False
+    except BudgetExceeded as e:
+        print(f"1000 factorials near 2000!: {e}")
+    assert time.perf_counter() - start < 1
+
+    # Through the server, refusals and evaluation errors come back at once
+    httpd = start_server()
+    try:
+        for expr, error in [("2^(-(10^30)) % 7", 'Expression too'), ("2^(1/2)", 'Exponent must be an integer')]:
+            start = time.perf_counter()
+            status, _, response = calculate_over_http(httpd, {'expression': expr})
+            print(f"{expr}: {response}")
+            assert status == 200 and response['error'].startswith(error)
+            assert time.perf_counter() - start < 1
+    finally:
+        stop_server(httpd)
+    print()
+
+def batch_over_http(httpd, body, content_type='application/json'):
+    # Returns (status, headers, lines) for a /calculate/batch request
+    status, headers, body = request(httpd, 'POST', '/calculate/batch', body, {'Content-Type': content_type})
+    return status, headers, [json.loads(line) for line in body.splitlines()]
+
+def test_batches():
+    print("=== Testing Batches ===\n")
+
+    httpd = start_server(workers=2, queue_size=4)
+    try:
+        # A JSON array of expressions and request objects; every item gets
+        # one line, tagged with its index and id, and errors stay per item
+        items = ["1 + 2", {"expression": "2^100", "id": "power"}, "1/0", 5, {"expression": "3000!"},
+                 {"expression": "sqrt(2, 5)", "explain": True, "id": 7}, {"expression": ""}]
+        status, headers, lines = batch_over_http(httpd, items)
+        print(f"{status} {headers['Content-Type']}, {headers['Transfer-Encoding']}")
+        for line in lines:
+            print(f"  {json.dumps(line)[:80]}")
+        assert status == 200 and headers['Transfer-Encoding'] == 'chunked'
+        by_index = {line['index']: line for line in lines}
+        assert sorted(by_index) == list(range(len(items)))
+        assert by_index[0] == {'index': 0, 'result': '3'}
+        assert by_index[1] == {'index': 1, 'id': 'power', 'result': str(2 ** 100)}
+        assert by_index[2]['error'] == 'Division by zero'
+        assert by_index[3]['error'] == 'Batch items must be strings or JSON objects'
+        assert len(by_index[4]['result']) == 9131 and by_index[4]['result'].startswith('414935960343785')
+        assert by_index[5]['id'] == 7 and 'explain' in by_index[5]
+        assert by_index[6]['error'] == 'Empty expression'
+
+        # NDJSON, with blank lines skipped; a malformed line ends the batch
+        # with an untagged error, but the items before it are still answered
+        body = b'"6 * 7"\n\n{"expression": "10!", "id": "f"}\n{oops\n"1 + 1"\n'
+        status, _, lines = batch_over_http(httpd, body, 'application/x-ndjson')
+        print(f"NDJSON: {lines}")
+        assert {'index': 0, 'result': '42'} in lines
+        assert {'index': 1, 'id': 'f', 'result': '3628800'} in lines
+        malformed = [line for line in lines if line['index'] is None]
+        assert len(malformed) == 1 and 'error' in malformed[0]
+        assert len(lines) == 3
+
+        # A body that is neither an array nor NDJSON is refused as a whole
+        status, _, body = request(httpd, 'POST', '/calculate/batch', {"expression": "1"})
+        print(f"object body: {json.loads(body)}")
+        assert 'error' in json.loads(body)
+
+        # Chunked NDJSON is read as it arrives: the first result comes back
+        # before the rest of the body is sent
+        connection = socket.create_connection(('127.0.0.1', httpd.server_address[1]), timeout=60)
+        try:
+            connection.sendall(b'POST /calculate/batch HTTP/1.1\r\nHost: test\r\n'
+                               b'Content-Type: application/x-ndjson\r\nTransfer-Encoding: chunked\r\n\r\n')
+            def send_chunk(data):
+                connection.sendall(f'{len(data):x}\r\n'.encode('ascii') + data + b'\r\n')
+            response = connection.makefile('rb')
+            send_chunk(b'"3 ^ 3"\n{"expression": "4 ^ 4",')
+            assert response.readline().startswith(b'HTTP/1.1 200')
+            while response.readline() != b'\r\n':
+                pass
+            response.readline()
+            first = json.loads(response.readline())
+            response.readline()
+            print(f"before the body ended: {first}")
+            assert first == {'index': 0, 'result': '27'}
+            send_chunk(b' "id": "split"}\n')
+            send_chunk(b'')
+            rest = []
+            while True:
+                size = int(response.readline(), 16)
+                if not size:
+                    break
+                rest.append(json.loads(response.read(size)))
+                response.readline()
+            print(f"after: {rest}\n")
+            assert rest == [{'index': 1, 'id': 'split', 'result': '256'}]
+        finally:
+            connection.close()
+    finally:
+        stop_server(httpd)
+
+def test_batch_disconnect():
+    print("=== Testing Batch Disconnect ===\n")
+
+    # A client that goes away part way through a large batch: the items
+    # already queued are cancelled rather than run, and no more are read.
+    # Every item that did run leaves a result cache entry. A wide in-flight
+    # window makes the queued ones outnumber those that may be running
+    in_flight_per_worker = server.BATCH_IN_FLIGHT_PER_WORKER
+    server.BATCH_IN_FLIGHT_PER_WORKER = 20
+    httpd = start_server(workers=1, queue_size=40)
+    try:
+        items = b''.join(f'"sqrt({n + 2}, 6000)"\n'.encode('ascii') for n in range(200))
+        connection = socket.create_connection(('127.0.0.1', httpd.server_address[1]), timeout=60)
+        try:
+            connection.sendall(b'POST /calculate/batch HTTP/1.1\r\nHost: test\r\n'
+                               b'Content-Type: application/x-ndjson\r\n'
+                               + f'Content-Length: {len(items)}\r\n\r\n'.encode('ascii') + items)
+            response = connection.makefile('rb')
+            assert response.readline().startswith(b'HTTP/1.1 200')
+            while response.readline() != b'\r\n':
+                pass
+            response.readline()
+            first = json.loads(response.readline())
+            print(f"first result: index {first['index']}")
+            response.close()
+        finally:
+            connection.close()
+
+        # Once the server notices, only calculations already running finish
+        assert wait_for_free_slots(httpd.pool, 41) == 41
+        ran = len(httpd.result_cache)
+        time.sleep(0.5)
+        print(f"{ran} of {len(items.splitlines())} items ran\n")
+        assert len(httpd.result_cache) == ran and ran <= 10
+    finally:
+        stop_server(httpd)
+        server.BATCH_IN_FLIGHT_PER_WORKER = in_flight_per_worker
+
+def test_result_cache():
+    print("=== Testing Result Cache ===\n")
+
+    # Keys are the tokens and the explain option: spacing does not matter,
+    # anything else does
+    def key(expression, explain=False):
+        return result_cache_key({'expression': expression, 'explain': explain})
+    assert key("2^10 + 1") == key(" 2 ^ 10+1 ") == key("2^10\t+\n1")
+    assert key("2^10 + 1") != key("2^10 + 2")
+    assert key("2^10 + 1") != key("2^(10 + 1)")
+    assert key("12 + 3") != key("1 2 + 3")
+    assert key("2^10 + 1") != key("2^10 + 1", explain=True)
+    print("keys ignore spacing only")
+
+    # Least recently used responses go once their total size passes the
+    # budget; each response here takes 20 bytes as JSON
+    cache = ResultCache(max_bytes=60)
+    responses = {n: {'result': str(10 ** 5 + n)} for n in range(4)}
+    assert len(json.dumps(responses[0])) == 20
+    for n in range(3):
+        cache.put(key(str(n)), responses[n])
+    assert cache.get(key("0")) == responses[0]
+    cache.put(key("3"), responses[3])
+    print(f"after 4 puts into 60 bytes: {cache.stats()}")
+    assert cache.get(key("1")) is None
+    assert [cache.get(key(str(n))) for n in (0, 2, 3)] == [responses[0], responses[2], responses[3]]
+    assert cache.stats() == {'entries': 3, 'bytes': 60, 'max_bytes': 60, 'hits': 4, 'misses': 1, 'evictions': 1}
+
+    # A response larger than the whole budget is not kept
+    cache.put(key("4"), {'result': '9' * 100})
+    assert cache.get(key("4")) is None and len(cache) == 3
+
+    # Errors are not kept, nor cancelled or failed calculations; the same
+    # result put twice (two requests that missed together) is one entry
+    cache = ResultCache()
+    cache.put(key("1/0"), {'error': 'Division by zero'})
+    failed, cancelled, done = Future(), Future(), Future()
+    failed.set_exception(TimeoutError())
+    cancelled.cancel()
+    done.set_result({'result': '4'})
+    cache.put_future(key("x"), failed)
+    cache.put_future(key("y"), cancelled)
+    cache.put_future(key("2 + 2"), done)
+    cache.put_future(key("2+2"), done)
+    print(f"after errors and a duplicate: {cache.stats()}")
+    assert len(cache) == 1 and cache.nbytes == len(json.dumps({'result': '4'}))
+
+    # Over HTTP: a repeat is a hit, errors are computed again each time,
+    # and GET /stats reports the counters
+    httpd = start_server()
+    try:
+        for expression in ("3000!", "3000 !", "1/0", "1/0", "2^64"):
+            status, _, response = calculate_over_http(httpd, {'expression': expression})
+            assert status == 200
+        status, _, body = request(httpd, 'GET', '/stats')
+        stats = json.loads(body)['result_cache']
+        print(f"GET /stats: {stats}\n")
+        assert status == 200
+        assert stats['entries'] == 2 and stats['hits'] == 1 and stats['misses'] == 4 and stats['evictions'] == 0
+        assert stats['bytes'] > 9131
+    finally:
+        stop_server(httpd)
+
+def main():
+    test_pool_backpressure()
+    test_concurrent_requests()
+    test_admission()
+    test_batches()
+    test_batch_disconnect()
+    test_result_cache()
+
+if __name__ == "__main__":
+    main()